@@ -0,0 +1,204 @@
+# (C) Copyright (2018,2021) Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import shutil
+import threading
+import time
+
+from image_operations import *
+
+# Builds reading or writing a disk at a time, more of them only compete for the disk bandwidth
+MAX_BUILDS_PER_DISK = 2
+# Free space left untouched on each filesystem
+MIN_FREE_SPACE_GB = 1
+# Seconds between two checks of the free space while builds are queued, other processes may free space
+ADMISSION_RECHECK_INTERVAL = 30
+
+
+def get_existing_path(path):
+    """Returns the path, or its closest existing parent folder, to find the filesystem holding it"""
+    while not os.path.exists(path):
+        path = os.path.dirname(path.rstrip("/")) or "/"
+    return path
+
+
+def get_build_cost(server, config):
+    """This function is to estimate the disk space a build of the custom ISO image of a server needs, from the size of
+    its base ISO image: the output image in HTTP_file_path, and in rebuild mode the per-build tree in Build_temp_path
+    and the extraction of the base image in ISO_cache_path when it is not extracted yet
+
+    Arguments:
+        server {dictionary} -- server details as per the input.yaml
+        config {dictionary} -- Config details as per the input.yaml
+
+    Returns:
+        dictionary -- bytes needed, keyed by a directory of each filesystem
+    """
+    iso_filepath = os.path.join(config["HTTP_file_path"], server["OS_image_name"])
+    iso_size = os.path.getsize(iso_filepath)
+    cost = {config["HTTP_file_path"]: iso_size}
+    if config.get("ISO_build_mode", "patch") == "rebuild":
+        build_temp_path = config.get("Build_temp_path", BUILD_TEMP_PATH)
+        cost[build_temp_path] = cost.get(build_temp_path, 0) + iso_size
+        cache_path = config.get("ISO_cache_path", ISO_CACHE_PATH)
+        if not os.path.isdir(os.path.join(cache_path, get_iso_cache_key(iso_filepath))):
+            cost[cache_path] = cost.get(cache_path, 0) + iso_size
+    return cost
+
+
+class BuildAdmissionController(object):
+    """Admits the image builds while the filesystems they write to have the space they need and their disks are not
+    saturated. Each build reserves its estimated space before it starts and releases it when it is over, the builds
+    which do not fit wait in a queue. Several paths on one filesystem share its free space.
+    """
+
+    def __init__(self, max_builds_per_disk=MAX_BUILDS_PER_DISK, min_free_bytes=MIN_FREE_SPACE_GB * 1024 ** 3):
+        self.max_builds_per_disk = max_builds_per_disk
+        self.min_free_bytes = min_free_bytes
+        self.condition = threading.Condition()
+        self.paths = {}
+        self.reserved = {}
+        self.running = {}
+        self.builds = 0
+        self.queued = 0
+        self.admissions = {}
+
+    def get_device_cost(self, cost):
+        device_cost = {}
+        for path, size in cost.items():
+            path = get_existing_path(path)
+            device = os.stat(path).st_dev
+            self.paths.setdefault(device, path)
+            device_cost[device] = device_cost.get(device, 0) + size
+        return device_cost
+
+    def get_available_bytes(self, device):
+        return shutil.disk_usage(self.paths[device]).free - self.reserved.get(device, 0) - self.min_free_bytes
+
+    def fits(self, device_cost):
+        return all(self.running.get(device, 0) < self.max_builds_per_disk and self.get_available_bytes(device) >= size
+                   for device, size in device_cost.items())
+
+    def acquire(self, name, cost):
+        """This function is to wait until a build can start and reserve its disk space
+
+        Arguments:
+            name {string}       -- name of the build, for the messages
+            cost {dictionary}   -- bytes needed, keyed by a directory of each filesystem, as per get_build_cost
+
+        Returns:
+            dictionary -- reservation to give to release, returns None when the build can never fit
+        """
+        with self.condition:
+            start_time = time.time()
+            device_cost = self.get_device_cost(cost)
+            if not self.fits(device_cost):
+                self.queued += 1
+                print("Build of {} is queued, waiting for disk space or bandwidth {}".format(name, self.get_stats()))
+                try:
+                    while not self.fits(device_cost):
+                        # Nothing to wait for when no build is running, the space is missing
+                        if not self.builds:
+                            print("Not enough free space for the build of {}: {} MB needed".format(
+                                name, sum(device_cost.values()) // 2**20))
+                            return None
+                        self.condition.wait(ADMISSION_RECHECK_INTERVAL)
+                finally:
+                    self.queued -= 1
+                print("Build of {} is admitted".format(name))
+            for device, size in device_cost.items():
+                self.reserved[device] = self.reserved.get(device, 0) + size
+                self.running[device] = self.running.get(device, 0) + 1
+            self.builds += 1
+            self.admissions[name] = dict(self.get_stats(), wait_seconds=int(time.time() - start_time))
+            return device_cost
+
+    def release(self, reservation):
+        """This function is to release the reservation of a build which is over, its output is now on the disk"""
+        with self.condition:
+            for device, size in reservation.items():
+                self.reserved[device] -= size
+                self.running[device] -= 1
+            self.builds -= 1
+            self.condition.notify_all()
+
+    def get_stats(self):
+        """This function is to get the state of the admission queue
+
+        Returns:
+            dictionary -- number of queued and running builds, and bytes reserved per filesystem
+        """
+        with self.condition:
+            return {
+                "queued_builds"     :   self.queued,
+                "running_builds"    :   self.builds,
+                "reserved_bytes"    :   dict((self.paths[device], size) for device, size in self.reserved.items() if size)
+            }
+
+    def get_admission(self, name):
+        """This function is to get how a build was admitted
+
+        Arguments:
+            name {string} -- name of the build, as given to acquire
+
+        Returns:
+            dictionary -- seconds the build waited and the state of the queue once it was admitted, returns None
+                          when the build was not admitted
+        """
+        with self.condition:
+            return self.admissions.get(name)
+
+
+def get_build_admission_controller(config):
+    """This function is to create the admission controller of the builds of a fleet run
+
+    Arguments:
+        config {dictionary} -- Config details, uses the optional Max_builds_per_disk and Min_free_space_gb values
+
+    Returns:
+        object -- BuildAdmissionController
+    """
+    return BuildAdmissionController(int(config.get("Max_builds_per_disk", MAX_BUILDS_PER_DISK)),
+                                    int(float(config.get("Min_free_space_gb", MIN_FREE_SPACE_GB)) * 1024 ** 3))
+
+
+def run_admitted_build(admission, server, config, build_function, *args):
+    """This function is to run an image build once the admission controller has admitted it, the space it
+    reserved is released when the build is over
+
+    Arguments:
+        admission {object}         -- BuildAdmissionController of the run, the build runs at once when None
+        server {dictionary}        -- server details as per the input.yaml
+        config {dictionary}        -- Config details as per the input.yaml
+        build_function {function}  -- function building the image, called with args
+
+    Returns:
+        object -- value returned by build_function, returns False when the build can never fit
+    """
+    if admission is None:
+        return build_function(*args)
+    reservation = admission.acquire(server["Server_serial_number"], get_build_cost(server, config))
+    if reservation is None:
+        return False
+    try:
+        return build_function(*args)
+    finally:
+        admission.release(reservation)
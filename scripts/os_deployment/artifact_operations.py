@@ -0,0 +1,336 @@
+# (C) Copyright (2018,2021) Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+
+from image_operations import *
+from template_operations import *
+from boot_config_operations import BOOT_CONFIG_RULES_PATH
+
+# Folder of the custom ISO images within HTTP_file_path, each image is named after the hash of its build inputs
+ARTIFACT_FOLDER = "artifacts/"
+ARTIFACT_INDEX_NAME = "index.json"
+# Changed when the images built from the same inputs change, so that the previous images are not reused
+ARTIFACT_FORMAT_VERSION = 1
+# External commands whose version is part of the build inputs
+ARTIFACT_TOOLS = ["mkisofs", "isohybrid", "implantisomd5", "mksusecd"]
+# Modules writing the custom ISO images, their code is part of the build inputs
+ARTIFACT_BUILDER_MODULES = ["rhel_operations.py", "rhel8_operations.py", "suse_operations.py", "ubuntu_operations.py",
+                            "boot_config_operations.py", "image_operations.py", "iso_patch_operations.py"]
+# Disk space used by the artifacts, the least recently used ones are deleted beyond it (see evict_artifacts)
+ARTIFACT_BUDGET_GB = 50
+
+ARTIFACT_INDEX_LOCK = threading.Lock()
+ARTIFACT_BUILD_LOCKS = {}
+ARTIFACT_BUILD_LOCKS_LOCK = threading.Lock()
+TOOL_VERSIONS = {}
+FILE_DIGESTS = {}
+
+
+def get_artifact_path(config):
+    return os.path.join(config["HTTP_file_path"], ARTIFACT_FOLDER)
+
+
+def get_artifact_index_path(config):
+    return os.path.join(get_artifact_path(config), ARTIFACT_INDEX_NAME)
+
+
+def get_tool_version(tool):
+    """This function is to get the version of an external command, it is run once per process
+
+    Arguments:
+        tool {string} -- command name
+
+    Returns:
+        string -- first line printed by the command for --version, empty when the command is not installed or has no
+                  --version option (it then fails, e.g. isohybrid, and prints its usage)
+    """
+    if tool not in TOOL_VERSIONS:
+        version = ""
+        if shutil.which(tool):
+            try:
+                result = run_command([tool, "--version"], timeout=30)
+                output = result.stdout_tail or result.stderr_tail
+                if result.returncode == 0 and output:
+                    version = output[0]
+            except OSError:
+                pass
+        TOOL_VERSIONS[tool] = version
+    return TOOL_VERSIONS[tool]
+
+
+def get_file_digest(file_path):
+    """This function is to get the sha256 digest of a small file, recomputed when the file changes"""
+    file_stat = os.stat(file_path)
+    version = (file_stat.st_mtime_ns, file_stat.st_size)
+    cached = FILE_DIGESTS.get(file_path)
+    if not cached or cached[0] != version:
+        with open(file_path, "rb") as input_file:
+            cached = (version, hashlib.sha256(input_file.read()).hexdigest())
+        FILE_DIGESTS[file_path] = cached
+    return cached[1]
+
+
+def get_image_build_inputs(os_type, iso_filepath, config):
+    """This function is to collect the inputs of a custom ISO image build which do not depend on the server:
+    base ISO image, OS type, boot configuration rules, build mode, code of the image builders and versions of the build tools
+
+    Arguments:
+        os_type {string}      -- Type of the OS
+        iso_filepath {string} -- path of the base ISO image
+        config {dictionary}   -- config details
+
+    Returns:
+        dictionary -- build inputs
+    """
+    return {
+        "format"            :   ARTIFACT_FORMAT_VERSION,
+        "base_image"        :   get_iso_cache_key(iso_filepath),
+        "os_type"           :   os_type,
+        "boot_config_rules" :   get_file_digest(BOOT_CONFIG_RULES_PATH),
+        "build_mode"        :   config.get("ISO_build_mode", "patch"),
+        "builders"          :   dict((module, get_file_digest(os.path.join(os.path.dirname(os.path.abspath(__file__)), module)))
+                                     for module in ARTIFACT_BUILDER_MODULES),
+        "tools"             :   dict((tool, get_tool_version(tool)) for tool in ARTIFACT_TOOLS)
+    }
+
+
+def get_inputs_key(inputs):
+    return hashlib.sha256(json.dumps(inputs, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def get_artifact_key(os_type, server, config, kickstart_file, syntax="format"):
+    """This function is to generate the key of the custom ISO image of a server from everything the image is built from:
+    the build inputs as per get_image_build_inputs and the rendered kickstart file.
+    Servers with identical inputs get the same key and share one image.
+
+    Arguments:
+        os_type {string}         -- Type of the OS
+        server {dictionary}      -- server details as per the input.yaml
+        config {dictionary}      -- config details
+        kickstart_file {string}  -- base kickstart file path
+
+    Keyword Arguments:
+        syntax {string}          -- placeholder syntax of the kickstart template (default: {"format"})
+
+    Returns:
+        string -- key of the custom ISO image
+    """
+    inputs = get_image_build_inputs(os_type, config["HTTP_file_path"] + server["OS_image_name"], config)
+    inputs["kickstart"] = hashlib.sha256(get_template(kickstart_file, syntax).render(server).encode("utf-8")).hexdigest()
+    return get_inputs_key(inputs)
+
+
+def get_shared_image_key(os_type, image_name, config):
+    """This function is to generate the key of the ISO image shared by the servers deployed with the same OS type and
+    base image: the build inputs as per get_image_build_inputs and the kickstart URL booted by the image
+
+    Arguments:
+        os_type {string}     -- Type of the OS
+        image_name {string}  -- File name of the base OS ISO image
+        config {dictionary}  -- config details
+
+    Returns:
+        string -- key of the shared ISO image
+    """
+    inputs = get_image_build_inputs(os_type, os.path.join(config["HTTP_file_path"], image_name), config)
+    inputs["kickstart_url"] = get_http_kickstart_url(config["HTTP_server_base_url"])
+    return get_inputs_key(inputs)
+
+
+def get_artifact_build_lock(artifact_key):
+    """This function is to get the lock serialising the builds of an artifact, so that it is built once"""
+    with ARTIFACT_BUILD_LOCKS_LOCK:
+        return ARTIFACT_BUILD_LOCKS.setdefault(artifact_key, threading.Lock())
+
+
+def load_artifact_index(config):
+    """This function is to read the index of the artifact store
+
+    Arguments:
+        config {dictionary} -- config details
+
+    Returns:
+        dictionary -- artifact details keyed by artifact key
+    """
+    try:
+        with open(get_artifact_index_path(config)) as index_file:
+            return json.load(index_file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def update_artifact_index(config, update):
+    """This function is to change the index of the artifact store, under a lock shared with the other deploy processes
+
+    Arguments:
+        config {dictionary} -- config details
+        update {function}   -- function changing the index given as argument, its return value is returned
+    """
+    index_path = get_artifact_index_path(config)
+    create_dir_exist(get_artifact_path(config))
+    with ARTIFACT_INDEX_LOCK, open(index_path + ".lock", "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        index = load_artifact_index(config)
+        result = update(index)
+        with open(index_path + ".tmp", "w") as index_file:
+            json.dump(index, index_file, indent=2)
+        os.rename(index_path + ".tmp", index_path)
+        return result
+
+
+def get_artifact_details(config, artifact_key, entry):
+    details = dict(entry)
+    details["key"] = artifact_key
+    details["path"] = os.path.join(get_artifact_path(config), entry["file"])
+    details["url"] = config["HTTP_server_base_url"] + ARTIFACT_FOLDER + entry["file"]
+    return details
+
+
+def lookup_artifact(config, artifact_key, server_serial_number):
+    """This function is to find the custom ISO image built from the same inputs in the index of the artifact store.
+    The image is pinned for the server until unpin_artifact, so that it is not evicted while the server installs
+
+    Arguments:
+        config {dictionary}           -- config details
+        artifact_key {string}         -- artifact key, as per get_artifact_key
+        server_serial_number {string} -- serial number of the server using the image
+
+    Returns:
+        dictionary -- details of the artifact with its path and url, returns None when it is not in the store
+    """
+    entry = load_artifact_index(config).get(artifact_key)
+    if not entry:
+        return None
+    artifact_path = os.path.join(get_artifact_path(config), entry["file"])
+    if not os.path.isfile(artifact_path) or os.path.getsize(artifact_path) != entry["size"]:
+        update_artifact_index(config, lambda index: index.pop(artifact_key, None))
+        return None
+
+    def mark_used(index):
+        if artifact_key in index:
+            index[artifact_key]["last_used"] = int(time.time())
+            index[artifact_key].setdefault("pins", {})[server_serial_number] = os.getpid()
+            if server_serial_number not in index[artifact_key]["servers"]:
+                index[artifact_key]["servers"].append(server_serial_number)
+            return index[artifact_key]
+    entry = update_artifact_index(config, mark_used) or entry
+    return get_artifact_details(config, artifact_key, entry)
+
+
+def store_artifact(config, artifact_key, image_path, os_type, server_serial_number):
+    """This function is to move a custom ISO image built for a server into the artifact store, pinned for the server
+
+    Arguments:
+        config {dictionary}           -- config details
+        artifact_key {string}         -- artifact key, as per get_artifact_key
+        image_path {string}           -- path of the custom ISO image, within HTTP_file_path
+        os_type {string}              -- Type of the OS
+        server_serial_number {string} -- serial number of the server the image was built for
+
+    Returns:
+        dictionary -- details of the artifact with its path and url
+    """
+    create_dir_exist(get_artifact_path(config))
+    artifact_file = artifact_key + ".iso"
+    os.rename(image_path, os.path.join(get_artifact_path(config), artifact_file))
+    now = int(time.time())
+    entry = {
+        "file"          :   artifact_file,
+        "os_type"       :   os_type,
+        "size"          :   os.path.getsize(os.path.join(get_artifact_path(config), artifact_file)),
+        "created"       :   now,
+        "last_used"     :   now,
+        "servers"       :   [server_serial_number],
+        "pins"          :   {server_serial_number: os.getpid()}
+    }
+
+    def add_entry(index):
+        index[artifact_key] = entry
+    update_artifact_index(config, add_entry)
+    return get_artifact_details(config, artifact_key, entry)
+
+
+def unpin_artifact(config, artifact_key, server_serial_number):
+    """This function is to release the pin of a server on an artifact once its installation is over
+
+    Arguments:
+        config {dictionary}           -- config details
+        artifact_key {string}         -- artifact key, as per get_artifact_key
+        server_serial_number {string} -- serial number of the server
+    """
+    def remove_pin(index):
+        if artifact_key in index:
+            index[artifact_key].get("pins", {}).pop(server_serial_number, None)
+    update_artifact_index(config, remove_pin)
+
+
+def is_artifact_pinned(entry):
+    return any(is_process_alive(pid) for pid in entry.get("pins", {}).values())
+
+
+def evict_artifacts(config, required_bytes=0):
+    """This function is to delete the least recently used artifacts until the artifacts fit in the disk budget,
+    with room for required_bytes more. The artifacts pinned by a running deployment are kept.
+
+    Arguments:
+        config {dictionary}    -- config details, uses the optional Artifact_budget_gb value (default: {ARTIFACT_BUDGET_GB})
+
+    Keyword Arguments:
+        required_bytes {int}   -- space needed by the next artifacts (default: {0})
+
+    Returns:
+        int -- bytes freed
+    """
+    budget = float(config.get("Artifact_budget_gb", ARTIFACT_BUDGET_GB)) * 1024 ** 3
+    artifact_path = get_artifact_path(config)
+
+    def evict(index):
+        freed = 0
+        for artifact_key in list(index):
+            if not os.path.isfile(os.path.join(artifact_path, index[artifact_key]["file"])):
+                del index[artifact_key]
+        used = sum(entry["size"] for entry in index.values())
+        for artifact_key, entry in sorted(index.items(), key=lambda item: item[1]["last_used"]):
+            if used + required_bytes <= budget:
+                break
+            if is_artifact_pinned(entry):
+                continue
+            try:
+                delete_file(os.path.join(artifact_path, entry["file"]))
+            except OSError as er:
+                print("Failed to delete the artifact {} {}".format(entry["file"], er))
+                continue
+            invalidate_remote_file_info(config["HTTP_server_base_url"] + ARTIFACT_FOLDER + entry["file"])
+            print("Evicted the artifact {} last used at {}".format(entry["file"], time.ctime(entry["last_used"])))
+            del index[artifact_key]
+            used -= entry["size"]
+            freed += entry["size"]
+        return freed
+
+    if not os.path.isdir(artifact_path):
+        return 0
+    return update_artifact_index(config, evict)
@@ -0,0 +1,263 @@
+# (C) Copyright (2018,2021) Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import asyncio
+import threading
+import aiohttp
+from async_redfish_object import AsyncRedfishObject, MAX_REQUESTS_PER_ILO
+from polling_policy import *
+
+
+async def create_async_redfish_object(server, http_session=None, max_requests=MAX_REQUESTS_PER_ILO):
+    """This function is to create the asyncio iLO Redfish object of a server and log in
+
+    Arguments:
+        server {dictionary} -- server configuration details provided in the input file
+
+    Keyword Arguments:
+        http_session {object} -- aiohttp session shared by the iLOs, a session is created when it is None (default: {None})
+        max_requests {int}    -- requests in flight to the iLO (default: {MAX_REQUESTS_PER_ILO})
+
+    Returns:
+        [object] -- asyncio iLO Redfish object, returns False when the iLO is not reachable
+    """
+    ilo_https_url = "https://" + server['ILO_Address']
+    try:
+        redfish_obj = AsyncRedfishObject(ilo_https_url, server['ILO_Username'], server['ILO_Password'], http_session, max_requests)
+        return await redfish_obj.login()
+    except Exception as excp:
+        print("Failure: Server with iLO ip {} is not reachable or doesn't support redfish {}".format(ilo_https_url, excp))
+        return False
+
+
+async def get_post_state(redfish_object):
+    """This function is to get server POST state
+
+    Arguments:
+        redfish_object {object} -- asyncio iLO Redfish object
+
+    Returns:
+        string -- returns the server POST state
+    """
+    resp = await redfish_object.get_resource("system")
+    if resp is not None and resp.status == 200:
+        return resp.dict['Oem']['Hpe']['PostState']
+    else:
+        print("Failed to get Post state")
+        return 'Unknown'
+
+
+async def wait_for_post_to_complete(redfish_object, timeout=20, polling_policy=None):
+    """This function is to wait for the server POST operation to complete
+
+    Arguments:
+        redfish_object {object} -- asyncio iLO Redfish object
+
+    Keyword Arguments:
+        timeout {int}           -- timeout in minutes (default: {20})
+        polling_policy {object} -- interval between two polls, every 60 seconds when it is None (default: {None})
+
+    Returns:
+        boolean -- returns True on successful server POST operation. returns False on failure of server POST operation
+    """
+    polling_policy = polling_policy or PollingPolicy("post")
+    polling_policy.start(timeout)
+    while not polling_policy.expired():
+        await asyncio.sleep(polling_policy.next_interval())
+
+        post_state = await get_post_state(redfish_object)
+
+        if post_state == 'InPostDiscoveryComplete' or post_state == 'FinishedPost':
+            await asyncio.sleep(3)
+            new_post_state = await get_post_state(redfish_object)
+            if new_post_state == 'InPostDiscoveryComplete' or new_post_state == 'FinishedPost':
+                polling_policy.complete()
+                return True
+
+    print("Timeout: System {} has not completed POST".format(redfish_object.host))
+    return False
+
+
+async def wait_for_reboot(redfish_object, timeout=20, polling_policy=None):
+    """This function is to wait for the server to reboot
+
+    Arguments:
+        redfish_object {object} -- asyncio iLO Redfish object
+
+    Keyword Arguments:
+        timeout {int}           -- timeout in minutes (default: {20})
+        polling_policy {object} -- interval between two polls, every 60 seconds when it is None (default: {None})
+
+    Returns:
+        boolean -- returns True on successful reboot. returns False on reboot failure
+    """
+    polling_policy = polling_policy or PollingPolicy("install")
+    polling_policy.start(timeout)
+    while not polling_policy.expired():
+        await asyncio.sleep(polling_policy.next_interval())
+
+        post_state = await get_post_state(redfish_object)
+
+        if post_state != 'InPostDiscoveryComplete' and post_state != 'FinishedPost':
+            polling_policy.complete()
+            return True
+
+    print("Timeout: System {} has not rebooted".format(redfish_object.host))
+    return False
+
+
+async def wait_for_os_deployment_to_complete(redfish_object, server_serial_number, post_timeout=20, install_timeout=30, polling_policies=None):
+    """This function is to wait for the OS deployment of a server once it has been powered on with the virtual media attached
+
+    Arguments:
+        redfish_object {object}       -- asyncio iLO Redfish object
+        server_serial_number {string} -- Server serial number
+
+    Keyword Arguments:
+        post_timeout {int}            -- Timeout for POST operation (default: {20})
+        install_timeout {int}         -- Timeout for install operation (default: {30})
+        polling_policies {dictionary} -- polling policy of the post, install and final_reboot phases (default: {None})
+
+    Returns:
+        boolean -- Returns True on successful OS deployment. Returns False on failure of OS deployment
+    """
+    polling_policies = polling_policies or {}
+    try:
+        if not await wait_for_post_to_complete(redfish_object, post_timeout, polling_policies.get("post")):
+            return False
+        print("Started OS deployment for server with serial number {}.".format(server_serial_number))
+
+        if not await wait_for_reboot(redfish_object, install_timeout, polling_policies.get("install")):
+            return False
+        print("OS deployment completed for server with serial number {}.".format(server_serial_number))
+
+        if not await wait_for_post_to_complete(redfish_object, post_timeout, polling_policies.get("final_reboot")):
+            return False
+        print("Started rebooting server with serial number {} after OS installation.".format(server_serial_number))
+    except Exception as e:
+        print("Failure: OS deployment failed on server {} with exception: {}".format(server_serial_number, e))
+        return False
+
+    return True
+
+
+async def wait_for_server_deployment(server, http_session, config, polling_policies=None):
+    redfish_obj = await create_async_redfish_object(server, http_session, int(config.get("Max_requests_per_ilo", MAX_REQUESTS_PER_ILO)))
+    if not redfish_obj:
+        return False
+    try:
+        return await wait_for_os_deployment_to_complete(redfish_obj, server['Server_serial_number'],
+                                                        polling_policies=polling_policies or get_polling_policies(config))
+    finally:
+        await redfish_obj.logout()
+
+
+async def wait_for_fleet_deployments_async(servers, config):
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False, limit=0)) as http_session:
+        return await asyncio.gather(*[wait_for_server_deployment(server, http_session, config) for server in servers])
+
+
+def wait_for_fleet_deployments(servers, config=None):
+    """This function is to wait for the OS deployment of all the servers from a single event loop,
+    the servers must already be powered on with the virtual media attached
+
+    Arguments:
+        servers {list}      -- server details as per the input.yaml
+
+    Keyword Arguments:
+        config {dictionary} -- Config details, the optional Max_requests_per_ilo value caps the requests in
+                               flight to each iLO (default: {None})
+
+    Returns:
+        list -- True for each server whose OS deployment completed, in the order of the servers
+    """
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(wait_for_fleet_deployments_async(servers, config or {}))
+    finally:
+        loop.close()
+
+
+class AsyncWaitLoop(object):
+    """Runs the waits for the OS deployments of a fleet run in one asyncio event loop on a background thread,
+    so that a server being installed does not hold a thread. The waits share one aiohttp session.
+    """
+
+    def __init__(self, config=None):
+        self.config = config or {}
+        self.http_session = None
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever)
+        self.thread.daemon = True
+        self.thread.start()
+
+    async def run_wait(self, server, polling_policies, callback):
+        is_complete = False
+        try:
+            if self.http_session is None:
+                self.http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False, limit=0))
+            is_complete = await wait_for_server_deployment(server, self.http_session, self.config, polling_policies)
+        except Exception as e:
+            print("Failure: OS deployment failed on server {} with exception: {}".format(server['Server_serial_number'], e))
+        finally:
+            # Also called when the wait is cancelled, so that the server is not waited for forever
+            if callback is not None:
+                try:
+                    callback(is_complete)
+                except Exception as e:
+                    print("Failure: Error occurred while handing over server {} {}".format(server['Server_serial_number'], e))
+        return is_complete
+
+    def submit(self, server, polling_policies=None, callback=None):
+        """This function is to start waiting for the OS deployment of a server, it returns at once
+
+        Arguments:
+            server {dictionary}           -- server details as per the input.yaml, powered on with the virtual media attached
+
+        Keyword Arguments:
+            polling_policies {dictionary} -- polling policy of each phase (default: {None})
+            callback {function}           -- called from the event loop with the outcome of the wait, it must not block
+                                             (default: {None})
+
+        Returns:
+            object -- concurrent.futures.Future of the outcome, True when the OS deployment completed
+        """
+        return asyncio.run_coroutine_threadsafe(self.run_wait(server, polling_policies, callback), self.loop)
+
+    def is_running(self):
+        """Returns False once the event loop has stopped, the waits still in progress are then never over"""
+        return self.thread.is_alive()
+
+    def close(self):
+        """Cancels the waits still in progress, their callbacks get False, closes the aiohttp session and stops the
+        event loop"""
+        async def shutdown():
+            waits = [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+            for task in waits:
+                task.cancel()
+            await asyncio.gather(*waits, return_exceptions=True)
+            if self.http_session is not None:
+                await self.http_session.close()
+                self.http_session = None
+        if self.thread.is_alive():
+            asyncio.run_coroutine_threadsafe(shutdown(), self.loop).result()
+            self.loop.call_soon_threadsafe(self.loop.stop)
+            self.thread.join()
+        self.loop.close()
@@ -0,0 +1,210 @@
+###
+# (C) Copyright 2021 Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+###
+
+import asyncio
+import json
+import aiohttp
+from logger import *
+
+SESSIONS_URI = "/redfish/v1/SessionService/Sessions/"
+# Requests in flight to a single iLO, its web server handles few requests at a time
+MAX_REQUESTS_PER_ILO = 4
+
+
+class AsyncRedfishResponse(object):
+    """Response of an AsyncRedfishObject request, with the status/dict/obj/text attributes used on the
+    responses of RedfishObject"""
+
+    def __init__(self, status, text, headers):
+        self.status = status
+        self.text = text
+        self.headers = headers
+        try:
+            self.dict = json.loads(text) if text else {}
+        except ValueError:
+            self.dict = {}
+        self.obj = self.dict
+
+    def getheader(self, name):
+        return self.headers.get(name)
+
+
+class AsyncRedfishObject(object):
+    """Asyncio variant of RedfishObject, so that the requests to hundreds of iLOs are in flight from a
+    single event loop. The requests to one iLO are capped by max_requests, the iLOs can share one
+    aiohttp session (and its connection pool) given as http_session.
+    """
+
+    def __init__(self, host, login_account, login_password, http_session=None, max_requests=MAX_REQUESTS_PER_ILO):
+        self.host = host.rstrip("/")
+        self.login_account = login_account
+        self.login_password = login_password
+        self.http_session = http_session
+        self.own_http_session = http_session is None
+        self.semaphore = asyncio.Semaphore(max_requests)
+        self.login_lock = asyncio.Lock()
+        self.session_key = None
+        self.session_location = None
+        self.uri_cache = {}
+        self.resource_directory = None
+
+    async def login(self):
+        if self.http_session is None:
+            self.http_session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False))
+        body = {"UserName": self.login_account, "Password": self.login_password}
+        async with self.semaphore:
+            async with self.http_session.post(self.host + SESSIONS_URI, json=body) as response:
+                if response.status not in [200, 201]:
+                    raise Exception("Login to {} failed with status {}".format(self.host, response.status))
+                self.session_key = response.headers.get("X-Auth-Token")
+                self.session_location = response.headers.get("Location")
+        return self
+
+    async def logout(self):
+        try:
+            if self.session_location:
+                await self.redfish_delete(self.session_location)
+                self.session_key = None
+                self.session_location = None
+        except Exception as excp:
+            log_info("Failed to log out of " + self.host + ": " + str(excp))
+        finally:
+            if self.own_http_session and self.http_session is not None:
+                await self.http_session.close()
+                self.http_session = None
+
+    async def relogin(self, expired_session_key):
+        async with self.login_lock:
+            if self.session_key == expired_session_key:
+                log_info("iLO session expired, logging in again to " + self.host)
+                await self.login()
+
+    async def send_request(self, method, suburi, request_body=None):
+        """Sends a request, logging in again and resending it when the session has expired (401)"""
+        for attempt in range(2):
+            session_key = self.session_key
+            url = suburi if suburi.startswith("http") else self.host + suburi
+            async with self.semaphore:
+                async with self.http_session.request(method, url, json=request_body,
+                                                     headers={"X-Auth-Token": session_key or ""}) as response:
+                    result = AsyncRedfishResponse(response.status, await response.text(), response.headers)
+            if result.status != 401 or attempt:
+                return result
+            await self.relogin(session_key)
+
+    async def redfish_get(self, suburi):
+        """REDFISH GET"""
+        return await self.send_request("GET", suburi)
+
+    async def redfish_patch(self, suburi, request_body):
+        """REDFISH PATCH"""
+        log_debug("PATCH " + str(request_body) + " to " + suburi)
+        response = await self.send_request("PATCH", suburi, request_body)
+        log_debug("PATCH response: " + str(response.status))
+
+        return response
+
+    async def redfish_post(self, suburi, request_body):
+        """REDFISH POST"""
+        log_info("POST " + str(request_body) + " to " + suburi)
+        response = await self.send_request("POST", suburi, request_body)
+        log_info("POST response: " + str(response.status))
+
+        return response
+
+    async def redfish_delete(self, suburi):
+        """REDFISH DELETE"""
+        log_info("DELETE " + suburi)
+        response = await self.send_request("DELETE", suburi)
+        log_info("DELETE response: " + str(response.status))
+
+        return response
+
+    async def search_for_type(self, type):
+        if self.resource_directory is None:
+            response = await self.redfish_get("/redfish/v1/resourcedirectory/")
+            self.resource_directory = response.dict.get("Instances", []) if response.status == 200 else []
+            self.resource_ids = set(item["@odata.id"].lower() for item in self.resource_directory)
+        instances = [item for item in self.resource_directory
+                     if "@odata.type" in item and type.lower() in item["@odata.type"].lower() and
+                     (item["@odata.id"] + "/settings/").lower() not in self.resource_ids]
+
+        if not instances:
+            log_info("Resource or feature is not supported on this system:" + type)
+        return instances
+
+    async def get_first_member(self, collection_uri, type):
+        response = await self.redfish_get(collection_uri)
+        if response.status == 200 and response.dict.get("Members"):
+            return response.dict["Members"][0]["@odata.id"]
+        instances = await self.search_for_type(type)
+        return instances[0]["@odata.id"] if instances else None
+
+    async def get_uri(self, name):
+        """Returns the URI of the system, manager, dvd_media or reset_target resource, resolved once per session"""
+        if name not in self.uri_cache:
+            uri = None
+            if name == "system":
+                uri = await self.get_first_member("/redfish/v1/Systems/", "ComputerSystem.")
+            elif name == "manager":
+                uri = await self.get_first_member("/redfish/v1/Managers/", "Manager.")
+            elif name == "dvd_media":
+                manager_uri = await self.get_uri("manager")
+                if manager_uri:
+                    rsp = await self.redfish_get(manager_uri)
+                    rsp = await self.redfish_get(rsp.dict["VirtualMedia"]["@odata.id"])
+                    for vmlink in rsp.dict["Members"]:
+                        response = await self.redfish_get(vmlink["@odata.id"])
+                        if response.status == 200 and "DVD" in response.dict["MediaTypes"]:
+                            uri = vmlink["@odata.id"]
+                            break
+            elif name == "reset_target":
+                system_uri = await self.get_uri("system")
+                if system_uri:
+                    rsp = await self.redfish_get(system_uri)
+                    uri = rsp.dict["Actions"]["#ComputerSystem.Reset"]["target"]
+            if not uri:
+                log_info("Resource or feature is not supported on this system:" + name)
+                return None
+            self.uri_cache[name] = uri
+        return self.uri_cache[name]
+
+    async def request_resource(self, method, name, request_body=None):
+        """Sends a request to a resource resolved by get_uri, resolving it again on 404"""
+        for attempt in range(2):
+            uri = await self.get_uri(name)
+            if not uri:
+                return None
+            response = await self.send_request(method, uri, request_body)
+            if response.status != 404:
+                break
+            self.uri_cache = {}
+        return response
+
+    async def get_resource(self, name):
+        return await self.request_resource("GET", name)
+
+    async def patch_resource(self, name, request_body):
+        return await self.request_resource("PATCH", name, request_body)
+
+    async def post_resource(self, name, request_body):
+        return await self.request_resource("POST", name, request_body)
@@ -0,0 +1,145 @@
+# (C) Copyright (2018,2021) Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import json
+import os
+import re
+import shutil
+import threading
+
+# Rules applied to the boot configuration files of each OS type, see rewrite_boot_config
+BOOT_CONFIG_RULES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "boot_config_rules.json")
+BOOT_CONFIG_RULES = None
+BOOT_CONFIG_RULES_LOCK = threading.Lock()
+
+
+class BootConfigRule(object):
+    """Rule of a boot configuration file, as read from boot_config_rules.json:
+        match        -- the rule applies to the lines containing this text (a regular expression when regex is true)
+        old, new     -- text replaced in the line (regular expression and replacement when regex is true)
+        after        -- the rule applies once to the first matching line following each line containing this text
+        once         -- the rule applies to the first matching line of the file only
+        capture      -- named regular expressions whose first group is captured from the line, for the next rules
+        insert_after -- lines inserted after the line
+        prepend      -- lines inserted at the start of the file
+    The new, insert_after and prepend texts can use {variables} given to rewrite_boot_config and the captured values.
+    """
+
+    def __init__(self, rule):
+        self.regex = rule.get("regex", False)
+        self.match = rule.get("match")
+        self.old = rule.get("old")
+        self.new = rule.get("new", "")
+        self.after = rule.get("after")
+        self.once = rule.get("once", False)
+        self.capture = dict((name, re.compile(pattern)) for name, pattern in rule.get("capture", {}).items())
+        self.insert_after = rule.get("insert_after", [])
+        self.prepend = rule.get("prepend", [])
+        if self.regex:
+            self.match = re.compile(self.match) if self.match else None
+            self.old = re.compile(self.old) if self.old else None
+
+    def matches(self, line):
+        if self.match is None:
+            return not self.prepend
+        if self.regex:
+            return self.match.search(line) is not None
+        return self.match in line
+
+    def apply(self, line, variables):
+        for name, pattern in self.capture.items():
+            found = pattern.search(line)
+            if found:
+                variables[name] = found.group(1)
+        if self.old:
+            new = self.new.format(**variables)
+            if self.regex:
+                line = self.old.sub(new, line)
+            else:
+                line = line.replace(self.old, new)
+        if self.insert_after:
+            if not line.endswith("\n"):
+                line += "\n"
+            line += "".join(text.format(**variables) + "\n" for text in self.insert_after)
+        return line
+
+
+def get_boot_config_rules(os_type, config_name):
+    """This function is to get the rules of a boot configuration file, the rules file is read once
+
+    Arguments:
+        os_type {string}     -- OS type, as a key of boot_config_rules.json
+        config_name {string} -- boot configuration file, efi_grub or isolinux
+
+    Returns:
+        list -- rules of the file
+    """
+    global BOOT_CONFIG_RULES
+    with BOOT_CONFIG_RULES_LOCK:
+        if BOOT_CONFIG_RULES is None:
+            with open(BOOT_CONFIG_RULES_PATH, "r") as rules_file:
+                BOOT_CONFIG_RULES = dict((os_name, dict((name, [BootConfigRule(rule) for rule in rules])
+                                                        for name, rules in configs.items()))
+                                         for os_name, configs in json.load(rules_file).items())
+    return BOOT_CONFIG_RULES[os_type][config_name]
+
+
+def rewrite_boot_config(file_path, os_type, config_name, variables=None):
+    """This function is to rewrite a boot configuration file (grub.cfg, isolinux.cfg...) with the rules of the OS type.
+    The file is read and written line by line to a temporary file which then replaces it, so that it is never left half written
+
+    Arguments:
+        file_path {string}   -- path of the boot configuration file
+        os_type {string}     -- OS type, as a key of boot_config_rules.json
+        config_name {string} -- boot configuration file, efi_grub or isolinux
+
+    Keyword Arguments:
+        variables {dictionary} -- values of the {variables} used by the rules, e.g. ks_boot_option (default: {None})
+
+    Returns:
+        dictionary -- the variables, with the values captured from the file
+    """
+    rules = get_boot_config_rules(os_type, config_name)
+    variables = dict(variables or {})
+    armed = [False] * len(rules)
+    fired = [False] * len(rules)
+    temp_path = "{}.{}.tmp".format(file_path, threading.get_ident())
+    try:
+        with open(file_path, "r") as file_read, open(temp_path, "w") as file_write:
+            for rule in rules:
+                for text in rule.prepend:
+                    file_write.write(text.format(**variables) + "\n")
+            for line in file_read:
+                for index, rule in enumerate(rules):
+                    if rule.after and rule.after in line:
+                        armed[index] = True
+                    if rule.prepend or (rule.after and not armed[index]) or (rule.once and fired[index]):
+                        continue
+                    if rule.matches(line):
+                        line = rule.apply(line, variables)
+                        fired[index] = True
+                        armed[index] = False
+                file_write.write(line)
+        shutil.copymode(file_path, temp_path)
+        os.rename(temp_path, file_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+    return variables
@@ -28,6 +28,9 @@ from time import sleep
 import requests
 import os
 import json
+import fcntl
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from datetime import timedelta
 from rhel_operations import *
@@ -36,6 +39,25 @@ from image_operations import *
 from suse_operations import *
 from rhel8_operations import *
 from ubuntu_operations import *
+from artifact_operations import *
+from lifecycle_operations import *
+from admission_operations import *
+from async_ilo_operations import AsyncWaitLoop
+
+# Base kickstart file of each supported OS type, relative to the base_dir_path
+KICKSTART_FILES = {
+    "rhel7"                     :   "kickstart_files/ks_rhel7.cfg",
+    "rhel8"                     :   "kickstart_files/ks_rhel8.cfg",
+    "sles15"                    :   "kickstart_files/autoinst.xml",
+    "centos8"                   :   "kickstart_files/ks_rhel8.cfg",
+    "ubuntu18"                  :   "kickstart_files/ks-ubuntu.cfg",
+    "ubuntu20"                  :   "kickstart_files/ks-ubuntu.cfg"
+}
+
+# Operating systems whose installer can fetch its kickstart file over HTTP, keyed by the server serial number
+SHARED_ISO_OS_TYPES = ["rhel7", "rhel8", "centos8"]
+# Seconds between two checks that the event loop waiting for the installations is still running
+WAIT_LOOP_CHECK_INTERVAL = 10
 
 
 def image_deployment(server, config):
@@ -49,30 +71,43 @@ def image_deployment(server, config):
     Returns:
         Boolean -- returns True on successful OS deployment, returns False on failure of OS deployment
     """
+    deployment = build_server_image(server, config)
+    if not deployment:
+        return False
+    return install_server_image(server, config, deployment)
+
+
+def build_server_image(server, config, admission=None):
+    """This function is the build stage of the OS deployment. It validates the server and creates the custom ISO image
+    (or the shared ISO image and the kickstart file served over HTTP) of the server.
+    
+    Arguments:
+        server {dictionary}        -- server details as per the input.yaml
+        config {dictionary}        -- Config details as per the input.yaml
+
+    Keyword Arguments:
+        admission {object}         -- BuildAdmissionController admitting the image builds, the images reused from
+                                      the artifact store or the shared image are not admitted (default: {None})
+
+    Returns:
+        dictionary -- details of the image to install on the server, returns False on failure
+    """
     try:
-        # Opening input files
-        kickstart_files = {
-        "rhel7"                     :   "kickstart_files/ks_rhel7.cfg",
-        "rhel8"                     :   "kickstart_files/ks_rhel8.cfg",
-        "sles15"                    :   "kickstart_files/autoinst.xml",
-        "centos8"                   :   "kickstart_files/ks_rhel8.cfg",
-        "ubuntu18"                  :   "kickstart_files/ks-ubuntu.cfg",
-        "ubuntu20"                  :   "kickstart_files/ks-ubuntu.cfg"
-        }
         server_serial_number = server['Server_serial_number']
         os_type = server["OS_type"]
         image_path = "".join([config["HTTP_server_base_url"],server["OS_image_name"]])
         # Check if iso image present or not in the given location
-        iso_file_check = is_iso_file_present(image_path)
+        iso_file_check = is_iso_file_present(image_path, config)
         if not iso_file_check:
             print("OS deployment failed for server with serial number {}.".format(server_serial_number))
             print("ISO image not preset in the specified location")
             return False
 
         # Check OS type
-        if os_type not in kickstart_files.keys():
+        if os_type not in KICKSTART_FILES.keys():
             print("OS deployment failed for server with serial number {}.".format(server_serial_number))
             print("Unsupported OS type. Supported OS types are rhel7, rhel8, sles15 and centos8")
+            return False
         # Create a REDFISH object
         redfish_obj = create_redfish_object(server)
         if not redfish_obj:
@@ -88,77 +123,616 @@ def image_deployment(server, config):
             print("Server with serial number {} is not supported for this solution".format(server['Server_serial_number']))
             return False
 
-        base_kickstart_filepath = "".join([config['base_dir_path'],kickstart_files[os_type]])
+        base_kickstart_filepath = "".join([config['base_dir_path'],KICKSTART_FILES[os_type]])
         print(" base kickstart filepath", base_kickstart_filepath)
+        shared_iso = config.get("Deployment_mode", "per_server_iso") == "shared_iso"
+        if shared_iso and os_type not in SHARED_ISO_OS_TYPES:
+            print("Shared ISO deployment is not supported for {}, creating a custom image for server {}".format(os_type, server_serial_number))
+            shared_iso = False
         # Create custom iso image with the given kickstart file
-        if os_type == "rhel7":
-            custom_iso_created = create_custom_iso_image_redhat(os_type, server, config, base_kickstart_filepath)
-        elif os_type == "sles15":
-            custom_iso_created = create_custom_iso_image_sles(os_type, server, config, base_kickstart_filepath)
-        elif os_type in ["rhel8", "centos8"]:
-            custom_iso_created = create_custom_iso_image_redhat8(os_type, server, config, base_kickstart_filepath)
-        elif os_type in ["ubuntu18", "ubuntu20"]:
-            custom_iso_created = create_custom_iso_image_ubuntu(os_type, server, config, base_kickstart_filepath)
+        artifact = None
+        if shared_iso:
+            custom_kickstart_path = get_http_kickstart_path(config["HTTP_file_path"], server_serial_number)
+            custom_iso_created = create_shared_iso_image(os_type, server, config, base_kickstart_filepath, admission) and \
+                create_http_kickstart_file_for_redhat(custom_kickstart_path, base_kickstart_filepath, server)
+        elif config.get("Artifact_cache", True):
+            artifact = build_custom_iso_artifact(os_type, server, config, base_kickstart_filepath, admission)
+            custom_iso_created = bool(artifact)
         else:
-            print("Unsupported OS type. Supported OS types are rhel7, rhel8, sles15 and centos8")
-        print("Starting OS installation for server: {}".format(server_serial_number))
+            custom_iso_created = run_admitted_build(admission, server, config, create_custom_iso_image,
+                                                    os_type, server, config, base_kickstart_filepath)
 
         # Get custom image path
         print("getting custom image path")
-        custom_image_path = get_custom_image_path(config["HTTP_file_path"], os_type, server_serial_number)
-        # Get custom image url
+        if shared_iso:
+            custom_image_path = get_shared_image_path(config["HTTP_file_path"], os_type, server["OS_image_name"])
+            custom_image_url = get_shared_image_url(config["HTTP_server_base_url"], os_type, server["OS_image_name"])
+        elif artifact:
+            custom_image_path = artifact["path"]
+            custom_image_url = artifact["url"]
+            custom_kickstart_path = get_custom_kickstart_path(config["HTTP_file_path"], os_type, server_serial_number)
+        else:
+            custom_image_path = get_custom_image_path(config["HTTP_file_path"], os_type, server_serial_number)
+            # Get custom image url
+            custom_image_url = get_custom_image_url(config["HTTP_server_base_url"], os_type, server_serial_number)
+            # Get custom kickstart file path
+            custom_kickstart_path = get_custom_kickstart_path(config["HTTP_file_path"], os_type, server_serial_number)
         print("custom image path", custom_image_path)
-        custom_image_url = get_custom_image_url(config["HTTP_server_base_url"], os_type, server_serial_number)
-        # Get custom kickstart file path
-        custom_kickstart_path = get_custom_kickstart_path(config["HTTP_file_path"], os_type, server_serial_number)
         print("custom kickstart path", custom_kickstart_path)
 
-        custom_iso_present = is_iso_file_present(custom_image_url)
+        custom_iso_present = is_iso_file_present(custom_image_url, config)
         print("custom_is_crated", custom_iso_created)
         print("custom_iso_present", custom_iso_present)
         print("custom_image_url", custom_image_url)
-        if(custom_iso_created and custom_iso_present):
-            # Unmount the previous ISO and mount the custom ISO image
-            print("custom iso crated and present")
-            unmount_virtual_media_iso(redfish_obj)
-            print("unmounted virtual medai")
-            mount_virtual_media_iso(redfish_obj, custom_image_url, True)
-            print("mounted virtual media")
-            power_staus = get_post_state(redfish_obj)
-            if power_staus == "PowerOff":
-                change_server_power_state(redfish_obj, server_serial_number, power_state="On")
-            else:
-                change_server_power_state(redfish_obj, server_serial_number, power_state="ForceRestart")
-
-            is_complete = wait_for_os_deployment_to_complete(redfish_obj, server['Server_serial_number'])
-            print("waited for os deployment")
-            #unmount ISO once OS deployment is complete
-            unmount_virtual_media_iso(redfish_obj)
-            
-            # Delete custom ISO image and Kickstart files
+        if not (custom_iso_created and custom_iso_present):
+            print("Error in fetching custom image for server {}".format(server_serial_number))
+            redfish_obj.delete_obj()
+            return False
+        return {
+            "redfish_obj"           :   redfish_obj,
+            "server_model"          :   server_model,
+            "shared_iso"            :   shared_iso,
+            "artifact_key"          :   artifact["key"] if artifact else None,
+            "custom_image_path"     :   custom_image_path,
+            "custom_image_url"      :   custom_image_url,
+            "custom_kickstart_path" :   custom_kickstart_path
+        }
+    except Exception as e:
+        print("Failure: Error occurred while deploying image on server {}".format(e))
+        return False
+
+
+def get_kickstart_syntax(os_type):
+    """Returns the placeholder syntax of the base kickstart file of the OS type"""
+    return "token" if os_type in ["ubuntu18", "ubuntu20"] else "format"
+
+
+def create_custom_iso_image(os_type, server, config, base_kickstart_filepath):
+    """This function is to create the custom ISO image of a server with the builder of its OS type
+    
+    Arguments:
+        os_type {string}                 -- Type of the OS
+        server {dictionary}              -- server details as per the input.yaml
+        config {dictionary}              -- Config details as per the input.yaml
+        base_kickstart_filepath {string} -- base kickstart file path
+
+    Returns:
+        Boolean -- returns True when the custom ISO image is created at get_custom_image_path
+    """
+    if os_type == "rhel7":
+        return create_custom_iso_image_redhat(os_type, server, config, base_kickstart_filepath)
+    elif os_type == "sles15":
+        return create_custom_iso_image_sles(os_type, server, config, base_kickstart_filepath)
+    elif os_type in ["rhel8", "centos8"]:
+        return create_custom_iso_image_redhat8(os_type, server, config, base_kickstart_filepath)
+    elif os_type in ["ubuntu18", "ubuntu20"]:
+        return create_custom_iso_image_ubuntu(os_type, server, config, base_kickstart_filepath)
+    print("Unsupported OS type. Supported OS types are rhel7, rhel8, sles15 and centos8")
+    return False
+
+
+def build_custom_iso_artifact(os_type, server, config, base_kickstart_filepath, admission=None):
+    """This function is to get the custom ISO image of a server from the artifact store, the image is built and
+    added to the store when no image was built from the same inputs
+    
+    Arguments:
+        os_type {string}                 -- Type of the OS
+        server {dictionary}              -- server details as per the input.yaml
+        config {dictionary}              -- Config details as per the input.yaml
+        base_kickstart_filepath {string} -- base kickstart file path
+
+    Keyword Arguments:
+        admission {object}               -- BuildAdmissionController admitting the build of the image (default: {None})
+
+    Returns:
+        dictionary -- details of the artifact with its path and url, returns None on failure
+    """
+    server_serial_number = server["Server_serial_number"]
+    # The key is computed before the build, the builders change some of the server details (e.g. the password hash)
+    artifact_key = get_artifact_key(os_type, server, config, base_kickstart_filepath, get_kickstart_syntax(os_type))
+    with get_artifact_build_lock(artifact_key):
+        artifact = lookup_artifact(config, artifact_key, server_serial_number)
+        if artifact:
+            print("Reusing the custom image {} for server {}".format(artifact["file"], server_serial_number))
+            return artifact
+        # Make room for the new image within the disk budget of the artifacts
+        evict_artifacts(config, os.path.getsize(config["HTTP_file_path"] + server["OS_image_name"]))
+        if not run_admitted_build(admission, server, config, create_custom_iso_image,
+                                  os_type, server, config, base_kickstart_filepath):
+            return None
+        image_path = get_custom_image_path(config["HTTP_file_path"], os_type, server_serial_number)
+        return store_artifact(config, artifact_key, image_path, os_type, server_serial_number)
+
+
+def boot_server_image(server, deployment):
+    """This function is to boot the server from the image created by the build stage
+    
+    Arguments:
+        server {dictionary}        -- server details as per the input.yaml
+        deployment {dictionary}    -- details of the image to install, as returned by build_server_image
+    """
+    server_serial_number = server['Server_serial_number']
+    redfish_obj = deployment["redfish_obj"]
+    print("Starting OS installation for server: {}".format(server_serial_number))
+    # Unmount the previous ISO and mount the custom ISO image
+    print("custom iso crated and present")
+    unmount_virtual_media_iso(redfish_obj)
+    print("unmounted virtual medai")
+    mount_virtual_media_iso(redfish_obj, deployment["custom_image_url"], True)
+    print("mounted virtual media")
+
+
+def power_on_server(server, deployment):
+    redfish_obj = deployment["redfish_obj"]
+    power_staus = get_post_state(redfish_obj)
+    if power_staus == "PowerOff":
+        change_server_power_state(redfish_obj, server['Server_serial_number'], power_state="On")
+    else:
+        change_server_power_state(redfish_obj, server['Server_serial_number'], power_state="ForceRestart")
+
+
+def finish_server_installation(server, config, deployment, is_complete):
+    """This function is to unmount the image once the OS installation is over and delete the per-server files
+    
+    Arguments:
+        server {dictionary}        -- server details as per the input.yaml
+        config {dictionary}        -- Config details as per the input.yaml
+        deployment {dictionary}    -- details of the installed image, as returned by build_server_image
+        is_complete {Boolean}      -- True when the OS installation completed
+
+    Returns:
+        Boolean -- returns True on successful OS deployment, returns False on failure of OS deployment
+    """
+    try:
+        server_serial_number = server['Server_serial_number']
+        redfish_obj = deployment["redfish_obj"]
+        print("waited for os deployment")
+        #unmount ISO once OS deployment is complete
+        unmount_virtual_media_iso(redfish_obj)
+        
+        # Delete custom ISO image and Kickstart files, the shared image and the artifacts are kept for the next deployments
+        if deployment["artifact_key"]:
+            unpin_artifact(config, deployment["artifact_key"], server_serial_number)
+        elif not deployment["shared_iso"]:
             print("Deleting custom image for server {}".format(server_serial_number))
-            delete_file(custom_image_path)    
-            print("Deleting custom kickstart file for server {}".format(server_serial_number))            
-            delete_file(custom_kickstart_path)
+            delete_file(deployment["custom_image_path"])
+            invalidate_remote_file_info(deployment["custom_image_url"])
+        print("Deleting custom kickstart file for server {}".format(server_serial_number))            
+        delete_file(deployment["custom_kickstart_path"])
 
 
-            # Logout of iLO 
-            print("Logging out of iLO for server {}".format(server_serial_number))
-            redfish_obj.redfish_client.logout()
+        # Logout of iLO 
+        print("Logging out of iLO for server {}".format(server_serial_number))
+        redfish_obj.delete_obj()
 
-            if is_complete:
-                print("OS installation is complete for server {}".format(server_serial_number))
-                return True
-            else:
-                print("OS installation failed on server {}".format(server_serial_number))
-                return False
+        if is_complete:
+            print("OS installation is complete for server {}".format(server_serial_number))
+            return True
         else:
-            print("Error in fetching custom image for server {}".format(server_serial_number))
+            print("OS installation failed on server {}".format(server_serial_number))
             return False
     except Exception as e:
         print("Failure: Error occurred while deploying image on server {}".format(e))
         return False
 
+
+def install_server_image(server, config, deployment):
+    """This function is the install stage of the OS deployment. It boots the server from the image created by the
+    build stage, waits for the OS installation to complete and deletes the per-server files.
+    
+    Arguments:
+        server {dictionary}        -- server details as per the input.yaml
+        config {dictionary}        -- Config details as per the input.yaml
+        deployment {dictionary}    -- details of the image to install, as returned by build_server_image
+
+    Returns:
+        Boolean -- returns True on successful OS deployment, returns False on failure of OS deployment
+    """
+    try:
+        server_serial_number = server['Server_serial_number']
+        redfish_obj = deployment["redfish_obj"]
+        boot_server_image(server, deployment)
+        # Subscribe to the iLO events before the power change so that no POST state change is missed
+        server_events = start_server_events(redfish_obj, server_serial_number, config)
+        try:
+            power_on_server(server, deployment)
+            polling_policies = get_polling_policies(config, deployment["server_model"])
+            is_complete = wait_for_os_deployment_to_complete(redfish_obj, server['Server_serial_number'], server_events=server_events,
+                                                             polling_policies=polling_policies)
+        finally:
+            server_events.stop()
+        record_phase_durations(config, deployment["server_model"], polling_policies)
+    except Exception as e:
+        print("Failure: Error occurred while deploying image on server {}".format(e))
+        is_complete = False
+    return finish_server_installation(server, config, deployment, is_complete)
+
+
+def get_deployment_result(server, status, build_seconds, install_seconds):
+    """This function is to report the outcome of the deployment of a server as a structured result
+    
+    Arguments:
+        server {dictionary}     -- server details as per the input.yaml
+        status {Boolean}        -- True on successful OS deployment
+        build_seconds {int}     -- time spent in the build stage
+        install_seconds {int}   -- time spent in the install stage
+    
+    Returns:
+        dictionary -- deployment result of the server
+    """
+    return {
+        "Server_serial_number"  :   server["Server_serial_number"],
+        "ILO_Address"           :   server["ILO_Address"],
+        "OS_type"               :   server["OS_type"],
+        "status"                :   "success" if status else "failed",
+        "build_seconds"         :   int(build_seconds),
+        "install_seconds"       :   int(install_seconds),
+        "duration_seconds"      :   int(build_seconds + install_seconds)
+    }
+
+
+def validate_server(server, config):
+    """This function is to validate a server before its deployment: OS type, kickstart template and its placeholders,
+    base ISO image on the HTTP server host, iLO login and server model
+    
+    Arguments:
+        server {dictionary}        -- server details as per the input.yaml
+        config {dictionary}        -- Config details as per the input.yaml
+
+    Returns:
+        list -- the problems found, empty when the server can be deployed
+    """
+    errors = []
+    os_type = server.get("OS_type")
+    if os_type not in KICKSTART_FILES:
+        errors.append("Unsupported OS type {}. Supported OS types are {}".format(os_type, ", ".join(KICKSTART_FILES.keys())))
+    else:
+        # Compile the template and check the server details it uses, so that no kickstart file fails to render later
+        errors.extend(get_template_errors(os.path.join(config["base_dir_path"], KICKSTART_FILES[os_type]), server,
+                                          get_kickstart_syntax(os_type)))
+    if not os.path.isfile(os.path.join(config["HTTP_file_path"], server.get("OS_image_name", ""))):
+        errors.append("ISO image {} not found in {}".format(server.get("OS_image_name"), config["HTTP_file_path"]))
+
+    redfish_obj = create_redfish_object(server)
+    if not redfish_obj:
+        errors.append("iLO {} is not reachable or the login failed".format(server["ILO_Address"]))
+        return errors
+    try:
+        server_model = get_server_model(redfish_obj)
+        if "Gen10" not in server_model:
+            errors.append("Server model {} is not supported for this solution".format(server_model))
+    except Exception as e:
+        errors.append("Failed to get the server model {}".format(e))
+    return errors
+
+
+def get_required_space(servers, config):
+    """This function is to estimate the free space needed by the planned builds, per filesystem
+    
+    Arguments:
+        servers {list}      -- server details of the valid servers
+        config {dictionary} -- Config details as per the input.yaml
+
+    Returns:
+        dictionary -- bytes needed, keyed by a directory of each filesystem
+    """
+    image_sizes = dict((server["OS_image_name"], os.path.getsize(os.path.join(config["HTTP_file_path"], server["OS_image_name"])))
+                       for server in servers)
+    if not image_sizes:
+        return {}
+    required = {}
+    # Custom images are written to the HTTP server, up to Max_pending_installs of them exist at a time
+    if config.get("Deployment_mode", "per_server_iso") == "shared_iso":
+        images = set((server["OS_type"], server["OS_image_name"]) for server in servers)
+        required[config["HTTP_file_path"]] = sum(image_sizes[image_name] for os_type, image_name in images)
+    else:
+        pending = int(config.get("Max_pending_installs", int(config.get("Max_parallel_builds", 2)) + int(config.get("Max_parallel_deployments", 8))))
+        required[config["HTTP_file_path"]] = max(image_sizes.values()) * min(pending, len(servers))
+    # The rebuild mode extracts each base image into the ISO cache
+    if config.get("ISO_build_mode", "patch") == "rebuild":
+        cache_path = config.get("ISO_cache_path", ISO_CACHE_PATH)
+        required[cache_path] = sum(image_sizes.values())
+    return required
+
+
+def check_free_space(required):
+    """This function is to check that the filesystems have the space needed by the planned builds
+    
+    Arguments:
+        required {dictionary} -- bytes needed, keyed by a directory of each filesystem
+
+    Returns:
+        list -- the problems found, empty when there is enough space
+    """
+    filesystems = {}
+    for path, size in required.items():
+        while not os.path.exists(path):
+            path = os.path.dirname(path.rstrip("/")) or "/"
+        device = os.stat(path).st_dev
+        filesystem = filesystems.setdefault(device, {"path": path, "required": 0})
+        filesystem["required"] += size
+
+    errors = []
+    for filesystem in filesystems.values():
+        free = shutil.disk_usage(filesystem["path"]).free
+        if free < filesystem["required"]:
+            errors.append("Not enough free space in {}: {} MB needed, {} MB free".format(
+                filesystem["path"], filesystem["required"] // 2**20, free // 2**20))
+    return errors
+
+
+def preflight_validation(servers, config, max_workers=32):
+    """This function is to validate all the servers concurrently before any ISO image is built or server rebooted:
+    OS type, kickstart template, base ISO image (one HEAD request per image), iLO login, server model and the
+    free space needed by the planned builds
+    
+    Arguments:
+        servers {list}      -- server details as per the input.yaml
+        config {dictionary} -- Config details as per the input.yaml
+
+    Keyword Arguments:
+        max_workers {int}   -- number of servers validated at a time (default: {32})
+
+    Returns:
+        dictionary -- the problems found for each server serial number, the servers without problems are not listed
+    """
+    image_urls = set("".join([config["HTTP_server_base_url"], server["OS_image_name"]]) for server in servers)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(servers) + len(image_urls)))) as executor:
+        image_checks = dict((image_url, executor.submit(is_iso_file_present, image_url, config)) for image_url in image_urls)
+        server_checks = [executor.submit(validate_server, server, config) for server in servers]
+
+    errors = {}
+    for server, server_check in zip(servers, server_checks):
+        try:
+            server_errors = server_check.result()
+        except Exception as e:
+            server_errors = ["Validation failed {}".format(e)]
+        if not image_checks["".join([config["HTTP_server_base_url"], server["OS_image_name"]])].result():
+            server_errors.append("ISO image not present at {}".format("".join([config["HTTP_server_base_url"], server["OS_image_name"]])))
+        if server_errors:
+            errors[server["Server_serial_number"]] = server_errors
+
+    valid_servers = [server for server in servers if server["Server_serial_number"] not in errors]
+    space_errors = check_free_space(get_required_space(valid_servers, config))
+    for server in valid_servers:
+        if space_errors:
+            errors[server["Server_serial_number"]] = space_errors
+
+    for server_serial_number, server_errors in errors.items():
+        for error in server_errors:
+            print("Pre-flight check failed for server {}: {}".format(server_serial_number, error))
+    return errors
+
+
+def deploy_fleet(servers, config):
+    """This function is to deploy the OS on all the servers from a single process.
+    The deployment is pipelined: a pool of build workers creates the images (disk bound) while a separate pool of
+    install workers drives the iLOs and waits for the installations (idle), so the image of the next server is built
+    while the previous servers install. The extracted ISO images, the HTTP sessions and the iLO registry data are shared.
+    
+    Arguments:
+        servers {list}      -- server details as per the input.yaml
+        config {dictionary} -- Config details as per the input.yaml, with the optional values
+                               Max_parallel_builds       -- number of images built at a time (default: 2)
+                               Max_parallel_deployments  -- number of servers installed at a time (default: 8)
+                               Max_pending_installs      -- number of built images waiting for or being installed,
+                                                            the build stage pauses when it is reached
+                                                            (default: Max_parallel_deployments + Max_parallel_builds)
+                               Preflight_abort_on_failure -- deploy no server when the pre-flight validation of
+                                                            any server fails (default: False)
+                               Command_timeout           -- seconds after which a build command is killed (default: 3600)
+                               Max_heavy_commands        -- number of mkisofs like commands run at a time (default: 2)
+                               Artifact_budget_gb        -- disk space of the custom images kept for the next
+                                                            deployments (default: 50)
+                               Max_builds_per_disk       -- number of builds writing to a disk at a time (default: 2)
+                               Min_free_space_gb         -- free space the builds leave on each filesystem (default: 1)
+                               Async_install_waits       -- wait for the installations from one asyncio event loop,
+                                                            the install workers only boot the servers and clean up
+                                                            (default: False)
+    
+    Returns:
+        list -- deployment result of each server, in the order of the servers, with how its image build was admitted
+    """
+    # Reclaim the mounts, folders and artifacts left by the previous runs before the free space is checked
+    run_startup_janitor(config)
+    # Validate the whole inventory before any image is built, the servers that fail are not deployed
+    preflight_errors = preflight_validation(servers, config)
+    abort = bool(preflight_errors) and config.get("Preflight_abort_on_failure", False)
+    if abort:
+        print("Pre-flight validation failed, no server is deployed")
+
+    configure_command_executor(config)
+    build_workers = int(config.get("Max_parallel_builds", 2))
+    install_workers = int(config.get("Max_parallel_deployments", 8))
+    pending_installs = threading.BoundedSemaphore(int(config.get("Max_pending_installs", build_workers + install_workers)))
+    # The builds are admitted while the filesystems have the space they need, the others wait in its queue
+    admission = get_build_admission_controller(config)
+    # The installing servers are waited for by the event loop instead of holding an install worker each
+    wait_loop = AsyncWaitLoop(config) if config.get("Async_install_waits", False) else None
+    results = {}
+    results_condition = threading.Condition()
+
+    def set_result(index, result):
+        with results_condition:
+            results[index] = result
+            results_condition.notify_all()
+
+    # The result of each server is set whatever happens in its stages, the exceptions of the pool tasks are lost
+    def install_stage(index, server, deployment, build_seconds):
+        start_time = time.time()
+        status = False
+        try:
+            status = install_server_image(server, config, deployment)
+        except Exception as e:
+            print("Failure: Error occurred while deploying image on server {}".format(e))
+        finally:
+            pending_installs.release()
+            set_result(index, get_deployment_result(server, status, build_seconds, time.time() - start_time))
+
+    def finish_stage(index, server, deployment, build_seconds, start_time, polling_policies, is_complete):
+        status = False
+        try:
+            if polling_policies:
+                record_phase_durations(config, deployment["server_model"], polling_policies)
+            status = finish_server_installation(server, config, deployment, is_complete)
+        except Exception as e:
+            print("Failure: Error occurred while deploying image on server {}".format(e))
+        finally:
+            pending_installs.release()
+            set_result(index, get_deployment_result(server, status, build_seconds, time.time() - start_time))
+
+    def async_install_stage(index, server, deployment, build_seconds):
+        start_time = time.time()
+        try:
+            boot_server_image(server, deployment)
+            power_on_server(server, deployment)
+            polling_policies = get_polling_policies(config, deployment["server_model"])
+            wait_loop.submit(server, polling_policies, lambda is_complete: install_pool.submit(
+                finish_stage, index, server, deployment, build_seconds, start_time, polling_policies, is_complete))
+        except Exception as e:
+            print("Failure: Error occurred while deploying image on server {}".format(e))
+            finish_stage(index, server, deployment, build_seconds, start_time, None, False)
+
+    def build_stage(index, server):
+        # Backpressure: wait for an installation to complete before building more images
+        pending_installs.acquire()
+        start_time = time.time()
+        deployment = False
+        try:
+            deployment = build_server_image(server, config, admission)
+            if deployment:
+                install_pool.submit(install_stage if wait_loop is None else async_install_stage, index, server, deployment, time.time() - start_time)
+        except Exception as e:
+            print("Failure: Error occurred while building the image of server {} {}".format(server["Server_serial_number"], e))
+            deployment = False
+        finally:
+            if not deployment:
+                pending_installs.release()
+                set_result(index, get_deployment_result(server, False, time.time() - start_time, 0))
+
+    deployed = [index for index, server in enumerate(servers)
+                if not abort and server["Server_serial_number"] not in preflight_errors]
+    # The build pool is shut down first, once every build has handed its server over to the install pool
+    try:
+        with ThreadPoolExecutor(max_workers=install_workers) as install_pool, ThreadPoolExecutor(max_workers=build_workers) as build_pool:
+            for index in deployed:
+                build_pool.submit(build_stage, index, servers[index])
+            if wait_loop is not None:
+                # The waits of the event loop hand the servers back to the install pool, it stays open until they are over
+                with results_condition:
+                    while not all(index in results for index in deployed) and wait_loop.is_running():
+                        results_condition.wait(WAIT_LOOP_CHECK_INTERVAL)
+    finally:
+        if wait_loop is not None:
+            wait_loop.close()
+
+    # The servers still being waited for when the event loop stopped are failed
+    for index in deployed:
+        if index not in results:
+            print("The wait for the OS deployment of server {} stopped before it was over".format(servers[index]["Server_serial_number"]))
+    results = [results.get(index, get_deployment_result(server, False, 0, 0)) for index, server in enumerate(servers)]
+    for result in results:
+        if result["Server_serial_number"] in preflight_errors:
+            result["preflight_errors"] = preflight_errors[result["Server_serial_number"]]
+        build_admission = admission.get_admission(result["Server_serial_number"])
+        if build_admission:
+            result["admission"] = build_admission
+    print("Build admission at the end of the run {}".format(admission.get_stats()))
+    return results
+
+
+def snapshot_fleet_state(servers, max_workers=32):
+    """This function is to get the state of all the servers at once, e.g. to follow a rollout.
+    The servers are queried concurrently through the shared iLO sessions, so that a snapshot costs
+    about two small requests per server.
+    
+    Arguments:
+        servers {list}      -- server details as per the input.yaml
+    
+    Keyword Arguments:
+        max_workers {int}   -- number of iLOs queried at a time (default: {32})
+    
+    Returns:
+        list -- one row per server with its POST state, power state, virtual media image and model
+    """
+    def get_row(server):
+        row = {"Server_serial_number": server["Server_serial_number"], "ILO_Address": server["ILO_Address"]}
+        try:
+            redfish_obj = create_redfish_object(server)
+            if redfish_obj:
+                row.update(get_server_state(redfish_obj))
+            else:
+                row.update({"PostState": "Unreachable", "PowerState": "Unknown", "Model": "Unknown", "VirtualMedia": "Unknown"})
+        except Exception as e:
+            print("Failure: Failed to get the state of server {} {}".format(server["Server_serial_number"], e))
+            row.update({"PostState": "Unknown", "PowerState": "Unknown", "Model": "Unknown", "VirtualMedia": "Unknown"})
+        return row
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(servers)))) as executor:
+        return list(executor.map(get_row, servers))
+
+
+def format_fleet_state(rows):
+    """This function is to format the fleet state snapshot as a text table
+    
+    Arguments:
+        rows {list} -- fleet state as returned by snapshot_fleet_state
+    
+    Returns:
+        string -- one line per server
+    """
+    columns = ["Server_serial_number", "ILO_Address", "PowerState", "PostState", "VirtualMedia", "Model"]
+    widths = [max([len(column)] + [len(str(row.get(column, ""))) for row in rows]) for column in columns]
+    lines = ["  ".join(column.ljust(width) for column, width in zip(columns, widths)).rstrip()]
+    for row in rows:
+        lines.append("  ".join(str(row.get(column, "")).ljust(width) for column, width in zip(columns, widths)).rstrip())
+    return "\n".join(lines)
+
+
+def create_shared_iso_image(os_type, server, config, base_kickstart_filepath, admission=None):
+    """This function is to create the ISO image shared by all the servers deployed with the same OS type and base image.
+    The image is created once, the servers deployed in parallel wait for it and reuse it. It is created again when
+    the key of its build inputs changes, as per get_shared_image_key.
+    
+    Arguments:
+        os_type {string}                  -- Type of the operating system
+        server {dictionary}               -- server details
+        config {dictionary}               -- Config details
+        base_kickstart_filepath {string}  -- Path of the base kickstart file
+
+    Keyword Arguments:
+        admission {object}                -- BuildAdmissionController admitting the build of the image (default: {None})
+    
+    Returns:
+        Boolean -- returns True if the shared image is available, returns False on failure
+    """
+    shared_image_path = get_shared_image_path(config["HTTP_file_path"], os_type, server["OS_image_name"])
+    lock_dir = config.get("ISO_cache_path", ISO_CACHE_PATH)
+    create_dir_exist(lock_dir)
+    key_path = os.path.join(lock_dir, get_shared_image_name(os_type, server["OS_image_name"]) + ".key")
+    with open(os.path.join(lock_dir, get_shared_image_name(os_type, server["OS_image_name"]) + ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            image_key = get_shared_image_key(os_type, server["OS_image_name"], config)
+            if os.path.isfile(shared_image_path) and os.path.isfile(key_path):
+                with open(key_path) as key_file:
+                    if key_file.read().strip() == image_key:
+                        print("Reusing the shared image {}".format(shared_image_path))
+                        return True
+            delete_file(key_path)
+            kickstart_url = get_http_kickstart_url(config["HTTP_server_base_url"])
+            build_function = create_custom_iso_image_redhat if os_type == "rhel7" else create_custom_iso_image_redhat8
+            image_created = run_admitted_build(admission, server, config, build_function,
+                                               os_type, server, config, base_kickstart_filepath, kickstart_url)
+            if image_created:
+                with open(key_path + ".tmp", "w") as key_file:
+                    key_file.write(image_key)
+                os.rename(key_path + ".tmp", key_path)
+            return image_created
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
 def unmount_virtual_media(server):
     """This function is to call unmount_virtual_media_iso function
     
@@ -169,6 +743,7 @@ def unmount_virtual_media(server):
         # Creating redfish object
         redfish_obj = create_redfish_object(server)        
         unmount_virtual_media_iso(redfish_obj)
+        redfish_obj.delete_obj()
     except Exception as e:
         print("Failure: Failed to unmount virtual media {}".format(e))
 
@@ -183,6 +758,7 @@ def wait_for_os_deployment(server):
         # Creating redfish object
         redfish_obj = create_redfish_object(server)
         wait_for_os_deployment_to_complete(redfish_obj, server['Server_serial_number'])
+        redfish_obj.delete_obj()
     except Exception as e:
         print("Failure: Image deployment failed {}".format(e))
 
@@ -0,0 +1,279 @@
+# (C) Copyright (2018,2021) Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import json
+import os
+import socket
+import ssl
+import threading
+import requests
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse
+from logger import *
+
+EVENT_SERVICE_URI = "/redfish/v1/EventService/"
+EVENT_TYPES = ["StatusChange", "ResourceUpdated", "Alert"]
+
+EVENT_LISTENER = None
+EVENT_LISTENER_LOCK = threading.Lock()
+
+
+class ServerEvents(object):
+    """Wakes up the POST state waits of a server as soon as its iLO reports an event.
+
+    The events are received from the Server-Sent Events stream of the iLO EventService when it is
+    available, otherwise from a push subscription delivered to the local EventListener. Any event of
+    the server wakes up the waits, which then read the POST state of the server. When no event source
+    is available (or the stream is lost) the waits fall back to polling.
+    """
+
+    def __init__(self, redfish_object, server_serial_number, listener=None):
+        self.redfish_object = redfish_object
+        self.server_serial_number = server_serial_number
+        self.listener = listener
+        self.condition = threading.Condition()
+        self.event_count = 0
+        self.seen_count = 0
+        self.active = False
+        self.stream = None
+        self.subscription_uri = None
+
+    def start(self):
+        """Subscribes to the iLO events of the server
+
+        Returns:
+            boolean -- returns True if the events of the server are received, returns False if the waits have to poll
+        """
+        try:
+            response = self.redfish_object.redfish_get(EVENT_SERVICE_URI)
+            if response.status != 200 or not response.dict.get("ServiceEnabled", True):
+                print("iLO EventService is not available for server {}, polling for POST state".format(self.server_serial_number))
+                return False
+            sse_uri = response.dict.get("ServerSentEventUri")
+            if sse_uri and self.start_event_stream(sse_uri):
+                print("Receiving iLO event stream for server {}".format(self.server_serial_number))
+            elif self.listener and self.create_subscription(response.dict["Subscriptions"]["@odata.id"]):
+                print("Subscribed to iLO events for server {}".format(self.server_serial_number))
+            else:
+                print("iLO events are not available for server {}, polling for POST state".format(self.server_serial_number))
+        except Exception as e:
+            print("Failed to subscribe to iLO events for server {}, polling for POST state {}".format(self.server_serial_number, e))
+        return self.active
+
+    def stop(self):
+        """Closes the event stream and deletes the event subscription of the server"""
+        self.active = False
+        if self.stream is not None:
+            # Closing the response would wait for the read in progress, shutting the socket down ends the read
+            # and the reading thread closes the response
+            try:
+                with socket.socket(fileno=os.dup(self.stream.raw.fileno())) as stream_socket:
+                    stream_socket.shutdown(socket.SHUT_RDWR)
+            except Exception:
+                pass
+            self.stream = None
+        if self.listener is not None:
+            self.listener.unregister(self.server_serial_number)
+        if self.subscription_uri:
+            try:
+                self.redfish_object.redfish_delete(self.subscription_uri)
+            except Exception as e:
+                log_info("Failed to delete event subscription {} {}".format(self.subscription_uri, e))
+            self.subscription_uri = None
+
+    def start_event_stream(self, sse_uri):
+        """Opens the Server-Sent Events stream of the iLO and reads it in a background thread
+
+        Arguments:
+            sse_uri {string} -- ServerSentEventUri of the iLO EventService
+
+        Returns:
+            boolean -- returns True if the stream is open
+        """
+        client = self.redfish_object.redfish_client
+        headers = {"Accept": "text/event-stream", "X-Auth-Token": client.session_key}
+        response = requests.get(client.base_url.rstrip("/") + sse_uri, headers=headers, stream=True, verify=False, timeout=(30, None))
+        if response.status_code != 200:
+            response.close()
+            return False
+        self.stream = response
+        self.active = True
+        thread = threading.Thread(target=self.read_event_stream, args=(response,))
+        thread.daemon = True
+        thread.start()
+        return True
+
+    def read_event_stream(self, response):
+        """Notifies the waits for each event of the Server-Sent Events stream
+
+        Arguments:
+            response {object} -- streamed HTTP response of the ServerSentEventUri
+        """
+        try:
+            # Read byte by byte, a larger chunk would hold the events until the chunk is full
+            for line in response.iter_lines(chunk_size=1):
+                if line.startswith(b"data:"):
+                    self.notify()
+        except Exception as e:
+            if self.active:
+                log_info("iLO event stream lost for server {} {}".format(self.server_serial_number, e))
+        finally:
+            response.close()
+        # Fall back to polling and wake up the waits so that they read the POST state
+        self.active = False
+        self.notify()
+
+    def create_subscription(self, subscriptions_uri):
+        """Subscribes the local event listener to the events of the iLO
+
+        Arguments:
+            subscriptions_uri {string} -- URI of the EventService subscriptions collection
+
+        Returns:
+            boolean -- returns True if the subscription is created
+        """
+        self.listener.register(self.server_serial_number, self)
+        body = {"Destination": self.listener.destination, "EventTypes": EVENT_TYPES, "Context": self.server_serial_number}
+        response = self.redfish_object.redfish_post(subscriptions_uri, body)
+        if response.status not in [200, 201]:
+            self.redfish_object.error_handler(response)
+            self.listener.unregister(self.server_serial_number)
+            return False
+        location = response.getheader("Location") if hasattr(response, "getheader") else None
+        self.subscription_uri = urlparse(location).path if location else None
+        self.active = True
+        return True
+
+    def notify(self):
+        """Wakes up the waits of the server"""
+        with self.condition:
+            self.event_count += 1
+            self.condition.notify_all()
+
+    def wait_for_event(self, timeout):
+        """Waits for the next event of the server
+
+        Arguments:
+            timeout {int} -- maximum time to wait in seconds
+
+        Returns:
+            boolean -- returns True if an event is received, returns False on timeout
+        """
+        with self.condition:
+            if self.event_count == self.seen_count:
+                self.condition.wait(timeout)
+            received = self.event_count != self.seen_count
+            self.seen_count = self.event_count
+        return received
+
+
+class EventListenerHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        try:
+            event = json.loads(self.rfile.read(length).decode("utf-8"))
+        except ValueError:
+            event = {}
+        self.send_response(200)
+        self.end_headers()
+        self.server.listener.dispatch(event.get("Context"))
+
+    def log_message(self, format, *args):
+        log_debug("Event listener: " + format % args)
+
+
+class ThreadingEventServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class EventListener(object):
+    """Receives the events pushed by the iLOs and dispatches them to the ServerEvents of the servers,
+    using the serial number set as the Context of the subscriptions.
+    """
+
+    def __init__(self, destination, certificate_path=None):
+        self.destination = destination
+        self.servers = {}
+        self.lock = threading.Lock()
+        self.httpd = ThreadingEventServer(("", urlparse(destination).port or 443), EventListenerHandler)
+        self.httpd.listener = self
+        if certificate_path:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certificate_path)
+            self.httpd.socket = context.wrap_socket(self.httpd.socket, server_side=True)
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def register(self, server_serial_number, server_events):
+        with self.lock:
+            self.servers[server_serial_number] = server_events
+
+    def unregister(self, server_serial_number):
+        with self.lock:
+            self.servers.pop(server_serial_number, None)
+
+    def dispatch(self, server_serial_number):
+        with self.lock:
+            server_events = self.servers.get(server_serial_number)
+        if server_events is not None:
+            server_events.notify()
+
+
+def get_event_listener(config):
+    """This function is to get the event listener of the process, it is started on first use
+
+    Arguments:
+        config {dictionary} -- Config details, the listener is enabled by the optional Event_listener_url value
+                               (iLO requires an https URL, the certificate and key are read from the PEM file
+                               given by Event_listener_certificate)
+
+    Returns:
+        object -- the event listener, returns None when it is not configured or fails to start
+    """
+    global EVENT_LISTENER
+    destination = config.get("Event_listener_url")
+    if not destination:
+        return None
+    with EVENT_LISTENER_LOCK:
+        if EVENT_LISTENER is None:
+            try:
+                EVENT_LISTENER = EventListener(destination, config.get("Event_listener_certificate"))
+            except Exception as e:
+                print("Failed to start the event listener on {} {}".format(destination, e))
+                return None
+    return EVENT_LISTENER
+
+
+def start_server_events(redfish_object, server_serial_number, config):
+    """This function is to subscribe to the iLO events of a server before it is powered on
+
+    Arguments:
+        redfish_object {object}       -- iLO Redfish object
+        server_serial_number {string} -- Server serial number
+        config {dictionary}           -- Config details
+
+    Returns:
+        object -- the events of the server, the waits poll when no event source is available
+    """
+    server_events = ServerEvents(redfish_object, server_serial_number, get_event_listener(config))
+    server_events.start()
+    return server_events
@@ -22,15 +22,17 @@ from subprocess import CalledProcessError
 import shutil
 import subprocess
 import threading
-from redfish_object import RedfishObject
+from redfish_object import RedfishObject, get_redfish_session
 from time import sleep
 import requests
 import os
 import json
 from datetime import datetime
 from datetime import timedelta
+from event_operations import *
+from polling_policy import *
 
-def wait_for_os_deployment_to_complete(redfish_object, server_serial_number, post_timeout=20, install_timeout=30):
+def wait_for_os_deployment_to_complete(redfish_object, server_serial_number, post_timeout=20, install_timeout=30, server_events=None, polling_policies=None):
     """This function is to initiate the OS deployment on the server once the virtual media is successfully attached.
     
     Arguments:
@@ -40,22 +42,26 @@ def wait_for_os_deployment_to_complete(redfish_object, server_serial_number, pos
     Keyword Arguments:
         post_timeout {int}            -- Timeout for POST operation (default: {20})
         install_timeout {int}         -- Timeout for install operation (default: {30})
+        server_events {object}        -- iLO events of the server, the waits poll when it is None (default: {None})
+        polling_policies {dictionary} -- polling policy of the post, install and final_reboot phases, the
+                                         waits poll every 60 seconds when it is None (default: {None})
     
     Returns:
         boolean -- Returns True on successful OS deployment. Returns False on failure of OS deployment
     """
+    polling_policies = polling_policies or {}
     try:
-        if not wait_for_post_to_complete(redfish_object, post_timeout):
+        if not wait_for_post_to_complete(redfish_object, post_timeout, server_events, polling_policies.get("post")):
             print("Timeout: server {} did not complete POST on time".format(server_serial_number))
             return False
         print("Started OS deployment for server with serial number {}.".format(server_serial_number))
 
-        if not wait_for_reboot(redfish_object, install_timeout):
+        if not wait_for_reboot(redfish_object, install_timeout, server_events, polling_policies.get("install")):
             print("Timeout: server {} did not complete POST on time".format(server_serial_number))
             return False
         print("OS deployment completed for server with serial number {}.".format(server_serial_number))
 
-        if not wait_for_post_to_complete(redfish_object, post_timeout):
+        if not wait_for_post_to_complete(redfish_object, post_timeout, server_events, polling_policies.get("final_reboot")):
             print("Timeout: server {} did not complete POST on time".format(server_serial_number))
             return False
         print("Started rebooting server with serial number {} after OS installation.".format(server_serial_number))
@@ -77,34 +83,34 @@ def get_post_state(redfish_object):
         string -- returns the server POST state
     """
     print("Get post state.")
-    instances = redfish_object.search_for_type("ComputerSystem.")
-
-    for instance in instances:
-        resp = redfish_object.redfish_get(instance["@odata.id"])
-        if resp.status == 200:
-            return resp.dict['Oem']['Hpe']['PostState']
-        else:
-            print("Failed to get Post state")
-            return 'Unknown'
+    resp = redfish_object.get_resource("system")
+    if resp is not None and resp.status == 200:
+        return resp.dict['Oem']['Hpe']['PostState']
+    else:
+        print("Failed to get Post state")
+        return 'Unknown'
 
 
-def wait_for_post_to_complete(redfish_object, timeout=20):
+def wait_for_post_to_complete(redfish_object, timeout=20, server_events=None, polling_policy=None):
     """This function is to wait for the server POST operation to complete
     
     Arguments:
         redfish_object {object} -- iLO Redfish object
     
     Keyword Arguments:
-        timeout {int} -- timeout in minutes (default: {20})
+        timeout {int}           -- timeout in minutes (default: {20})
+        server_events {object}  -- iLO events of the server, the POST state is read as soon as an event is
+                                   received (default: {None})
+        polling_policy {object} -- interval between two polls, every 60 seconds when it is None (default: {None})
     
     Returns:
         boolean -- returns True on successful server POST operation. returns False on failure of server POST operation
     """
-    wait_time = datetime.now() + timedelta(minutes=timeout)
+    polling_policy = polling_policy or PollingPolicy("post")
+    polling_policy.start(timeout)
     print("Waiting for system to complete POST")
-    while wait_time > datetime.now():
-        print("Sleeping for 60 seconds before poll")
-        sleep(60)
+    while not polling_policy.expired():
+        wait_for_next_poll(server_events, polling_policy.next_interval())
 
         post_state = get_post_state(redfish_object)
 
@@ -112,40 +118,59 @@ def wait_for_post_to_complete(redfish_object, timeout=20):
             sleep(3)
             new_post_state = get_post_state(redfish_object)
             if new_post_state == 'InPostDiscoveryComplete' or new_post_state == 'FinishedPost':
+                polling_policy.complete()
                 return True
 
     print("Timeout: System has not completed POST")
     return False
 
 
-def wait_for_reboot(redfish_object, timeout=20):
+def wait_for_next_poll(server_events=None, interval=60):
+    """This function is to wait before reading the server POST state again
+    
+    Keyword Arguments:
+        server_events {object} -- iLO events of the server, the wait ends on the next event (default: {None})
+        interval {int}         -- maximum time to wait in seconds (default: {60})
+    """
+    if server_events is not None and server_events.active:
+        print("Waiting up to {:.0f} seconds for an iLO event before poll".format(interval))
+        server_events.wait_for_event(interval)
+    else:
+        print("Sleeping for {:.0f} seconds before poll".format(interval))
+        sleep(interval)
+
+
+def wait_for_reboot(redfish_object, timeout=20, server_events=None, polling_policy=None):
     """This function is to initaite a server reboot and wait for the reboot to complete
     
     Arguments:
         redfish_object {object} -- iLO Redfish object
     
     Keyword Arguments:
-        timeout {int} -- timeout in minutes (default: {20})
+        timeout {int}           -- timeout in minutes (default: {20})
+        server_events {object}  -- iLO events of the server, the POST state is read as soon as an event is
+                                   received (default: {None})
+        polling_policy {object} -- interval between two polls, every 60 seconds when it is None (default: {None})
     
     Returns:
         boolean -- returns True on successful reboot. returns False on reboot failure
     """
-    wait_time = datetime.now() + timedelta(minutes=timeout)
+    polling_policy = polling_policy or PollingPolicy("install")
+    polling_policy.start(timeout)
     print("Waiting for system to reboot")
-    while wait_time > datetime.now():
-        print("Sleeping for 60 seconds before poll")
-        sleep(60)
+    while not polling_policy.expired():
+        wait_for_next_poll(server_events, polling_policy.next_interval())
 
         post_state = get_post_state(redfish_object)
 
         if post_state != 'InPostDiscoveryComplete' and post_state != 'FinishedPost':
+            polling_policy.complete()
             return True
 
     print("Timeout: System has not completed POST")
     return False
 
 
-
 def mount_virtual_media_iso(redfish_object, img_url, boot_on_next_server_reset=True):
     """This function is to mount virtual media ISO on the iLO
     
@@ -154,20 +179,10 @@ def mount_virtual_media_iso(redfish_object, img_url, boot_on_next_server_reset=T
     """
     print("Mounting virtual media")
     try:
-        instances = redfish_object.search_for_type("Manager.")
-
-        for instance in instances:
-            rsp = redfish_object.redfish_get(instance["@odata.id"])
-            rsp = redfish_object.redfish_get(rsp.dict["VirtualMedia"]["@odata.id"])
-
-            for vmlink in rsp.dict["Members"]:
-                response = redfish_object.redfish_get(vmlink["@odata.id"])
-                if response.status == 200 and "DVD" in response.dict["MediaTypes"]:
-                    body = {"Image": img_url, "Oem": {"Hpe": {"BootOnNextServerReset": boot_on_next_server_reset}}}
-                    response = redfish_object.redfish_patch(vmlink["@odata.id"], body)
-                    redfish_object.error_handler(response)
-                elif response.status != 200:
-                    redfish_object.error_handler(response)
+        body = {"Image": img_url, "Oem": {"Hpe": {"BootOnNextServerReset": boot_on_next_server_reset}}}
+        response = redfish_object.patch_resource("dvd_media", body)
+        if response is not None:
+            redfish_object.error_handler(response)
     except Exception as e:
         print("Error occurred while mounting the cd image {} and error is {}".format(img_url, e))
 
@@ -180,26 +195,17 @@ def unmount_virtual_media_iso(redfish_object):
     """
     print("Unmounting virtual media")
     try:
-        instances = redfish_object.search_for_type("Manager.")
-
-        for instance in instances:
-            rsp = redfish_object.redfish_get(instance["@odata.id"])
-            rsp = redfish_object.redfish_get(rsp.dict["VirtualMedia"]["@odata.id"])
-
-            for vmlink in rsp.dict["Members"]:
-                response = redfish_object.redfish_get(vmlink["@odata.id"])
-                if response.status == 200 and "DVD" in response.dict["MediaTypes"]:
-                    body = {"Image": None}
-                    response = redfish_object.redfish_patch(vmlink["@odata.id"], body)
-                    redfish_object.error_handler(response)
-                elif response.status != 200:
-                    redfish_object.error_handler(response)
+        body = {"Image": None}
+        response = redfish_object.patch_resource("dvd_media", body)
+        if response is not None:
+            redfish_object.error_handler(response)
     except Exception as e:
         print("Error occurred while unmounting the cd image and error is {}".format(e))
 
 
 def create_redfish_object(server):
-    """This function is to create iLO Redfish object
+    """This function is to get the iLO Redfish object of the server, the iLO session is shared by all the
+    operations of the run and logged out at exit
     
     Arguments:
         server {dictionary} -- server configuration details provided in the input file
@@ -212,7 +218,7 @@ def create_redfish_object(server):
     ilo_username = server['ILO_Username']
     ilo_password = server['ILO_Password']
     try:
-        redfish_obj = RedfishObject(ilo_https_url, ilo_username, ilo_password)
+        redfish_obj = get_redfish_session(ilo_https_url, ilo_username, ilo_password)
     except Exception as excp:
         print("Failure: Server with iLO ip {} is not reachable or doesn't support redfish {}".format(ilo_https_url, excp))
         return False
@@ -229,26 +235,16 @@ def change_server_power_state(redfish_obj, serial_number, power_state):
     Returns:
         boolean -- returns True on successful change in power state. returns False on failure of change in power state
     """
-    resource_instances = redfish_obj.search_for_type("ComputerSystem.")
-    for instance in resource_instances:
-        #Use Resource directory to find the relevant URI
-        if '#ComputerSystem.' in instance['@odata.type']:
-           systems_members_uri = instance['@odata.id']
-           systems_members_response = redfish_obj.redfish_get(systems_members_uri)
-
-    if systems_members_response:
-       system_reboot_uri = systems_members_response.obj['Actions']['#ComputerSystem.Reset']\
-                                                                                        ['target']
-       body = dict()
-       body['Action'] = 'ComputerSystem.Reset'
-       body['ResetType'] = power_state
-       resp = redfish_obj.redfish_post(system_reboot_uri, body)
-       if resp.status == 200:
-           print("Success : Changed the power state of server {} to {} ".format(serial_number, power_state))
-           return True
-       else:
-           print("Failure: Failed to change the power state of server {} to {} ".format(serial_number, power_state))
-           return False
+    body = dict()
+    body['Action'] = 'ComputerSystem.Reset'
+    body['ResetType'] = power_state
+    resp = redfish_obj.post_resource("reset_target", body)
+    if resp is not None and resp.status == 200:
+        print("Success : Changed the power state of server {} to {} ".format(serial_number, power_state))
+        return True
+    else:
+        print("Failure: Failed to change the power state of server {} to {} ".format(serial_number, power_state))
+        return False
 
 def get_server_model(restobj):
     """
@@ -257,7 +253,30 @@ def get_server_model(restobj):
     Returns:
         string (server Model)         -- returns server model
     """
-    instances = restobj.search_for_type("ComputerSystem.")
-    for instance in instances:
-        response = restobj.redfish_get(instance["@odata.id"])
+    response = restobj.get_resource("system")
     return (str(response.dict["Model"]))
+
+
+def get_server_state(redfish_obj):
+    """This function is to get the POST state, power state, virtual media status and model of the server,
+    only these properties are fetched when the iLO supports $select
+    
+    Arguments:
+        redfish_obj {object}          -- Redfish object
+    
+    Returns:
+        dictionary -- state of the server, the values that could not be read are 'Unknown'
+    """
+    state = {"PostState": "Unknown", "PowerState": "Unknown", "Model": "Unknown", "VirtualMedia": "Unknown"}
+    response = redfish_obj.get_resource("system", select=["PowerState", "Model", "Oem/Hpe/PostState"])
+    if response is not None and response.status == 200:
+        state["PostState"] = response.dict.get("Oem", {}).get("Hpe", {}).get("PostState", "Unknown")
+        state["PowerState"] = response.dict.get("PowerState", "Unknown")
+        state["Model"] = response.dict.get("Model", "Unknown")
+    response = redfish_obj.get_resource("dvd_media", select=["Inserted", "Image"])
+    if response is not None and response.status == 200:
+        if response.dict.get("Inserted"):
+            state["VirtualMedia"] = response.dict.get("Image") or "Inserted"
+        else:
+            state["VirtualMedia"] = "Ejected"
+    return state
@@ -19,6 +19,7 @@
 # THE SOFTWARE.
 
 from subprocess import CalledProcessError
+import collections
 import shutil
 import subprocess
 import threading
@@ -26,8 +27,55 @@ from time import sleep
 import requests
 import os
 import json
+import fcntl
+import hashlib
+import signal
+import socket
+import tempfile
+import time
+from email.utils import formatdate
+from urllib.parse import unquote, urlparse
 from datetime import datetime
 from datetime import timedelta
+from logger import *
+
+# Location where the contents of each base ISO image are extracted once and shared by all servers
+ISO_CACHE_PATH = "/tmp/iso_cache/"
+
+# Ways of building the per-server ISO tree on top of the extracted base ISO contents
+ISO_STAGING_MODES = ["auto", "overlay", "reflink", "hardlink", "copy"]
+
+# ioctl request to share the data blocks of a file with another file (reflink)
+FICLONE = 0x40049409
+
+# Folder holding the per-build ISO trees, each build gets its own temporary folder within it
+BUILD_TEMP_PATH = "/tmp/"
+
+# Temporary folders and mounts created by the builds, with the process which created them, so that the
+# leftovers of a crashed run are found and reclaimed by the next run (see lifecycle_operations)
+RESOURCE_REGISTRY_PATH = "/tmp/os_deployment_resources.json"
+RESOURCE_REGISTRY_LOCK = threading.Lock()
+RESOURCE_KINDS = ["temp_tree", "loop_mount", "overlay_mount"]
+
+# HEAD requests share one pooled HTTP session, the files found are remembered for a short time
+# so that a fleet run sends one HEAD request per distinct image
+HTTP_HEAD_CACHE_TTL = 60
+HTTP_HEAD_CACHE = {}
+HTTP_HEAD_LOCKS = {}
+HTTP_SESSION = None
+HTTP_SESSION_LOCK = threading.Lock()
+
+# Result of is_local_host for each host name of the HTTP server
+LOCAL_HOSTS = {}
+
+# The output of the commands is logged line by line, only the last lines are kept for the error messages
+COMMAND_OUTPUT_TAIL_LINES = 50
+# Seconds after which a command is killed, see configure_command_executor
+COMMAND_TIMEOUT = 3600
+# Commands reading or writing whole ISO images, only a few of them run at a time
+HEAVY_COMMANDS = ["mkisofs", "genisoimage", "xorriso", "mksusecd", "isohybrid", "implantisomd5"]
+MAX_HEAVY_COMMANDS = 2
+HEAVY_COMMAND_SEMAPHORE = threading.BoundedSemaphore(MAX_HEAVY_COMMANDS)
 
 def mount_iso_image(file_name, org_path):
     """This function is to mount the file to the desired path
@@ -40,6 +88,7 @@ def mount_iso_image(file_name, org_path):
     try:
         args = ["mount", "-o", "loop", file_name, org_path]
         proc = execute_linux_command(args)
+        register_resource(org_path, "loop_mount")
         return proc.returncode
     except CalledProcessError as subprcer:
         print("Subprocess error occurred while mounting iso image {}".format(subprcer))
@@ -49,16 +98,19 @@ def mount_iso_image(file_name, org_path):
         return 1
 
 
-def copy_iso_contents(origpath, newpath):
+def copy_iso_contents(origpath, newpath, staging_mode="copy"):
     """This function is to copy the contents of the ISO image to the desired location
     
     Arguments:
         origpath {string} -- source path
         newpath {string}  -- destination path
+    
+    Keyword Arguments:
+        staging_mode {string} -- how the files are copied, one of reflink, hardlink or copy (default: {"copy"})
     """
     if os.path.isdir(newpath):
         shutil.rmtree(newpath)
-    shutil.copytree(origpath, newpath)
+    shutil.copytree(origpath, newpath, symlinks=True, copy_function=get_staging_copy_function(staging_mode))
 
 
 def unmount_iso_image(org_path):
@@ -71,6 +123,7 @@ def unmount_iso_image(org_path):
         args = ["umount", org_path]
         proc = execute_linux_command(args)
         if proc.returncode == 0:
+            release_resource(org_path, "loop_mount")
             shutil.rmtree(org_path)
         return proc.returncode
     except CalledProcessError as subprcer:
@@ -122,6 +175,73 @@ def get_custom_image_name(os_type, server_serial_number):
     return os_type + server_serial_number + ".iso"
 
 
+def get_shared_image_name(os_type, image_name):
+    """This function is to generate name for the OS ISO file shared by all the servers deployed with the same OS type and base image
+    
+    Arguments:
+        os_type {string}    -- Type of the opertaing system
+        image_name {string} -- File name of the base OS ISO image
+    
+    Returns:
+        string -- shared ISO filename
+    """
+    return os_type + "_shared_" + os.path.splitext(os.path.basename(image_name))[0] + ".iso"
+
+
+def get_shared_image_url(http_url, os_type, image_name):
+    """This function is to generate URL for the shared OS ISO file based on the type of OS and base image
+    
+    Arguments:
+        http_url {string}   -- HTTP server base URL
+        os_type {string}    -- Type of the opertaing system
+        image_name {string} -- File name of the base OS ISO image
+    
+    Returns:
+        string -- shared ISO URL
+    """
+    return http_url + get_shared_image_name(os_type, image_name)
+
+
+def get_shared_image_path(http_path, os_type, image_name):
+    """This function is to generate path for the shared OS ISO file based on the type of OS and base image
+    
+    Arguments:
+        http_path {string}  -- HTTP server base file path
+        os_type {string}    -- Type of the opertaing system
+        image_name {string} -- File name of the base OS ISO image
+    
+    Returns:
+        string -- shared ISO path
+    """
+    return os.path.join(http_path, get_shared_image_name(os_type, image_name))
+
+
+def get_http_kickstart_url(http_url):
+    """This function is to generate the kickstart URL booted by the shared OS ISO files.
+    The HTTP server answers it with the kickstart file matching the X-System-Serial-Number header sent by the installer.
+    
+    Arguments:
+        http_url {string} -- HTTP server base URL
+    
+    Returns:
+        string -- kickstart URL
+    """
+    return http_url + "kickstarts/ks.cfg"
+
+
+def get_http_kickstart_path(http_path, server_serial_number):
+    """This function is to generate path for the kickstart file of a server served over HTTP
+    
+    Arguments:
+        http_path {string}            -- HTTP server base file path
+        server_serial_number {string} -- Server serial number
+    
+    Returns:
+        string -- kickstart file path
+    """
+    return os.path.join(http_path, "kickstarts", server_serial_number + ".cfg")
+
+
 def get_custom_kickstart_url(http_url, os_type, server_serial_number):
     """This function is to generate URL for the custom kickstart file based on the type of OS and server serial number
     
@@ -176,6 +296,88 @@ def create_dir_exist(dir_path):
         print("Error occurred while creating the dir {}".format(er))
 
 
+def load_resource_registry():
+    """This function is to read the temporary folders and mounts registered by the builds
+
+    Returns:
+        dictionary -- path, kind, process id and creation time of each resource, keyed by kind and path
+    """
+    try:
+        with open(RESOURCE_REGISTRY_PATH) as registry_file:
+            return json.load(registry_file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def update_resource_registry(update):
+    """This function is to change the resource registry, under a lock shared with the other deploy processes
+
+    Arguments:
+        update {function} -- function changing the registry given as argument
+    """
+    try:
+        with RESOURCE_REGISTRY_LOCK, open(RESOURCE_REGISTRY_PATH + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            registry = load_resource_registry()
+            update(registry)
+            with open(RESOURCE_REGISTRY_PATH + ".tmp", "w") as registry_file:
+                json.dump(registry, registry_file, indent=2)
+            os.rename(RESOURCE_REGISTRY_PATH + ".tmp", RESOURCE_REGISTRY_PATH)
+    except (IOError, OSError) as er:
+        log_error("Failed to update the resource registry {}".format(er))
+
+
+def is_process_alive(pid):
+    """This function is to check whether a process is still running, e.g. the owner of a registered resource"""
+    try:
+        os.kill(pid, 0)
+        return True
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+
+
+def register_resource(path, kind):
+    """This function is to register a temporary folder or a mount created by this process
+
+    Arguments:
+        path {string} -- path of the folder or mount point
+        kind {string} -- one of RESOURCE_KINDS
+    """
+    path = os.path.abspath(path)
+    entry = {"path": path, "kind": kind, "pid": os.getpid(), "created": int(time.time())}
+    update_resource_registry(lambda registry: registry.__setitem__(kind + ":" + path, entry))
+
+
+def release_resource(path, kind):
+    """This function is to remove a deleted temporary folder or an unmounted mount point from the registry
+
+    Arguments:
+        path {string} -- path of the folder or mount point
+        kind {string} -- one of RESOURCE_KINDS
+    """
+    update_resource_registry(lambda registry: registry.pop(kind + ":" + os.path.abspath(path), None))
+
+
+def create_build_temp_path(config, prefix):
+    """This function is to create the temporary folder of a single image build, unique even when the same
+    server or image is built by several threads at a time
+    
+    Arguments:
+        config {dictionary} -- config details, uses the optional Build_temp_path value
+        prefix {string}     -- prefix of the folder name, e.g. redhatmount_<serial number>_
+    
+    Returns:
+        string -- path of the folder, ending with a slash
+    """
+    build_temp_path = config.get("Build_temp_path", BUILD_TEMP_PATH)
+    create_dir_exist(build_temp_path)
+    temppath = tempfile.mkdtemp(prefix=prefix, dir=build_temp_path)
+    register_resource(temppath, "temp_tree")
+    return temppath + "/"
+
+
 def delete_file(filepath):
     """This function is to delete a file
     
@@ -208,16 +410,145 @@ def delete_temp_folder(temppath):
         temppath {string} -- Path of the folder to be deleted
     """
     try:
+        unmount_overlay_tree(temppath)
         shutil.rmtree(temppath)
+        release_resource(temppath, "temp_tree")
     except Exception as ex:
         print("Error occurred while deleting the temp folder {}".format(ex))
 
 
-def execute_linux_command(args):
+class CommandResult(object):
+    """Result of a command run by run_command: exit code, duration and the last lines of its output"""
+
+    def __init__(self, args, returncode, duration, stdout_tail, stderr_tail, timed_out=False):
+        self.args = args
+        self.returncode = returncode
+        self.duration = duration
+        self.stdout_tail = stdout_tail
+        self.stderr_tail = stderr_tail
+        self.timed_out = timed_out
+
+    @property
+    def stdout(self):
+        return "\n".join(self.stdout_tail)
+
+    @property
+    def stderr(self):
+        return "\n".join(self.stderr_tail)
+
+    def check_returncode(self):
+        if self.returncode != 0:
+            raise CalledProcessError(self.returncode, self.args, self.stdout, self.stderr)
+
+
+def configure_command_executor(config):
+    """This function is to set the limits of the commands run by run_command from the config details.
+    It is called once before the builds start.
+    
+    Arguments:
+        config {dictionary} -- config details, uses the optional Command_timeout (seconds) and Max_heavy_commands values
+    """
+    global COMMAND_TIMEOUT, HEAVY_COMMAND_SEMAPHORE
+    COMMAND_TIMEOUT = int(config.get("Command_timeout", COMMAND_TIMEOUT))
+    HEAVY_COMMAND_SEMAPHORE = threading.BoundedSemaphore(int(config.get("Max_heavy_commands", MAX_HEAVY_COMMANDS)))
+
+
+def log_command_output(stream, command_name, tail):
+    for line in iter(stream.readline, b""):
+        line = line.decode("utf-8", "replace").rstrip()
+        log_debug("{}: {}".format(command_name, line))
+        tail.append(line)
+    stream.close()
+
+
+def run_command(args, timeout=None):
+    """This function is to run a command given as a list of arguments, without a shell.
+    The output is streamed line by line to the logger instead of being buffered, only its last lines are kept.
+    The commands of HEAVY_COMMANDS wait for one of the MAX_HEAVY_COMMANDS slots before starting.
+    The command runs in its own process group, so that the timeout kills the processes it started as well
+    (e.g. the xorriso run by mksusecd), which would otherwise keep its output pipes open.
+    
+    Arguments:
+        args {list}    -- command and its arguments
+    
+    Keyword Arguments:
+        timeout {int}  -- seconds after which the command is killed (default: {COMMAND_TIMEOUT})
+    
+    Returns:
+        object -- CommandResult of the command, timed_out is set when it was killed by the timeout
+    """
+    command_name = os.path.basename(args[0])
+    timeout = timeout or COMMAND_TIMEOUT
+    semaphore = HEAVY_COMMAND_SEMAPHORE if command_name in HEAVY_COMMANDS else None
+    if semaphore:
+        semaphore.acquire()
+    try:
+        start_time = time.time()
+        stdout_tail = collections.deque(maxlen=COMMAND_OUTPUT_TAIL_LINES)
+        stderr_tail = collections.deque(maxlen=COMMAND_OUTPUT_TAIL_LINES)
+        process = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.DEVNULL,
+                                   start_new_session=True)
+        stderr_reader = threading.Thread(target=log_command_output, args=(process.stderr, command_name, stderr_tail))
+        stderr_reader.daemon = True
+        stderr_reader.start()
+        timed_out = threading.Event()
+
+        def kill_process():
+            timed_out.set()
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except OSError:
+                # The whole group has exited already
+                pass
+
+        timer = threading.Timer(timeout, kill_process)
+        timer.start()
+        try:
+            log_command_output(process.stdout, command_name, stdout_tail)
+            stderr_reader.join()
+            returncode = process.wait()
+        finally:
+            timer.cancel()
+        if timed_out.is_set():
+            log_error("{} was killed after {} seconds".format(" ".join(args), timeout))
+        return CommandResult(args, returncode, time.time() - start_time, list(stdout_tail), list(stderr_tail),
+                             timed_out.is_set())
+    finally:
+        if semaphore:
+            semaphore.release()
+
+
+def execute_linux_command(args, timeout=None):
+    """
+    This function is to execute linux commands, raises CalledProcessError when the command fails
     """
-    This function is to execute linux commands 
+    result = run_command(args, timeout)
+    result.check_returncode()
+    return result
+
+
+def get_mkisofs_args(source_root, custom_iso, efi_boot_image, volume_label=None):
+    """This function is to build the mkisofs arguments creating a BIOS and UEFI bootable ISO image from a tree.
+    The boot image paths are relative to the source root, so the command does not depend on the working directory
+    
+    Arguments:
+        source_root {string}    -- path of the ISO tree
+        custom_iso {string}     -- path of the resultant ISO image
+        efi_boot_image {string} -- path of the EFI boot image relative to the ISO root, e.g. images/efiboot.img
+    
+    Keyword Arguments:
+        volume_label {string}   -- volume label of the ISO image (default: {None})
+    
+    Returns:
+        list -- mkisofs command arguments
     """
-    return subprocess.run(args, stdout=subprocess.PIPE, stderr=subprocess.PIPE, check=True)
+    args = ["mkisofs", "-o", custom_iso, "-b", "isolinux/isolinux.bin", "-J", "-R", "-l", "-c", "isolinux/boot.cat",
+            "-no-emul-boot", "-boot-load-size", "4", "-boot-info-table", "-eltorito-alt-boot", "-e", efi_boot_image,
+            "-no-emul-boot", "-graft-points"]
+    if volume_label:
+        args += ["-V", volume_label]
+    args.append(source_root)
+    return args
 
 
 def is_iso_image(filename):
@@ -234,20 +565,407 @@ def is_iso_image(filename):
     return False
 
 
-def is_iso_file_present(image_url):
+def is_iso_file_present(image_url, config=None):
     """
     
     Arguments:
         image_url {string} -- URL of the OS image
     
+    Keyword Arguments:
+        config {dictionary} -- Config details, the file is checked on the local disk when the URL is served
+                               by this host from HTTP_file_path (default: {None})
+    
     Returns:
         Boolean -- Returns True if the ISO file is present on the remote location. Returns False if the ISO image is not present on the remote location
     """
+    return get_remote_file_info(image_url, config=config)["status"] == 200
+
+
+def is_local_host(hostname):
+    """This function is to find whether a host name is an address of this host, by binding a socket to it
+    
+    Arguments:
+        hostname {string} -- host name or IP address
+    
+    Returns:
+        Boolean -- returns True if the host name resolves to an address of this host
+    """
+    if hostname not in LOCAL_HOSTS:
+        try:
+            address_info = socket.getaddrinfo(hostname, None, 0, socket.SOCK_STREAM)[0]
+            with socket.socket(address_info[0], socket.SOCK_STREAM) as test_socket:
+                test_socket.bind((address_info[4][0], 0))
+            LOCAL_HOSTS[hostname] = True
+        except (OSError, IndexError):
+            LOCAL_HOSTS[hostname] = False
+    return LOCAL_HOSTS[hostname]
+
+
+def get_local_file_path(file_url, config):
+    """This function is to map a URL of the HTTP server to the file under HTTP_file_path, when the HTTP server is this host
+    
+    Arguments:
+        file_url {string}   -- URL of the file
+        config {dictionary} -- Config details
+    
+    Returns:
+        string -- path of the file, returns None when the URL is not served by this host from HTTP_file_path
+    """
+    if not config or not config.get("HTTP_server_base_url") or not config.get("HTTP_file_path"):
+        return None
+    base_url = config["HTTP_server_base_url"]
+    if not base_url.endswith("/"):
+        base_url += "/"
+    if not file_url.startswith(base_url) or not is_local_host(urlparse(base_url).hostname):
+        return None
+    root = os.path.realpath(config["HTTP_file_path"])
+    file_path = os.path.realpath(os.path.join(root, unquote(urlparse(file_url).path[len(urlparse(base_url).path):])))
+    if file_path != root and not file_path.startswith(root + os.sep):
+        return None
+    return file_path
+
+
+def get_http_session():
+    """This function is to get the HTTP session shared by the HEAD requests, its connections are pooled
+    
+    Returns:
+        object -- requests session
+    """
+    global HTTP_SESSION
+    with HTTP_SESSION_LOCK:
+        if HTTP_SESSION is None:
+            requests.packages.urllib3.disable_warnings(requests.packages.urllib3.exceptions.InsecureRequestWarning)
+            session = requests.Session()
+            session.verify = False
+            session.mount("http://", requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=32))
+            session.mount("https://", requests.adapters.HTTPAdapter(pool_connections=8, pool_maxsize=32))
+            HTTP_SESSION = session
+    return HTTP_SESSION
+
+
+def get_remote_file_info(file_url, max_age=HTTP_HEAD_CACHE_TTL, config=None):
+    """This function is to get the status, size and ETag of a file on the HTTP server.
+    When the HTTP server is this host, the file is read from the disk without going through the web server.
+    Files found are cached for max_age seconds, and concurrent checks of the same URL send a single HEAD request
+    
+    Arguments:
+        file_url {string} -- URL of the file
+    
+    Keyword Arguments:
+        max_age {int}       -- age in seconds of a cached result that can be returned, 0 to always send a request (default: {HTTP_HEAD_CACHE_TTL})
+        config {dictionary} -- Config details, used to map the URL to a local file (default: {None})
+    
+    Returns:
+        dictionary -- status (HTTP status code, 0 when the server is not reachable), size (bytes), etag and last_modified of the file
+    """
+    local_path = get_local_file_path(file_url, config)
+    if local_path and os.path.isfile(local_path):
+        file_stat = os.stat(local_path)
+        # Same ETag format as nginx
+        return {"status": 200, "size": file_stat.st_size,
+                "etag": '"{:x}-{:x}"'.format(int(file_stat.st_mtime), file_stat.st_size),
+                "last_modified": formatdate(file_stat.st_mtime, usegmt=True)}
+    with HTTP_SESSION_LOCK:
+        url_lock = HTTP_HEAD_LOCKS.setdefault(file_url, threading.Lock())
+    with url_lock:
+        cached = HTTP_HEAD_CACHE.get(file_url)
+        if cached and time.time() - cached["time"] < max_age:
+            return cached["info"]
+        info = {"status": 0, "size": None, "etag": None, "last_modified": None}
+        try:
+            file_head = get_http_session().head(file_url, timeout=30)
+            info["status"] = file_head.status_code
+            if "Content-Length" in file_head.headers:
+                info["size"] = int(file_head.headers["Content-Length"])
+            info["etag"] = file_head.headers.get("ETag")
+            info["last_modified"] = file_head.headers.get("Last-Modified")
+        except Exception as e:
+            print("Failed to check {} {}".format(file_url, e))
+        # Only the files found are cached, a missing file may be created in the meantime
+        if info["status"] == 200:
+            HTTP_HEAD_CACHE[file_url] = {"time": time.time(), "info": info}
+        else:
+            HTTP_HEAD_CACHE.pop(file_url, None)
+        return info
+
+
+def invalidate_remote_file_info(file_url):
+    """This function is to drop the cached HEAD result of a file which is replaced or deleted
+    
+    Arguments:
+        file_url {string} -- URL of the file
+    """
+    HTTP_HEAD_CACHE.pop(file_url, None)
+
+
+def get_iso_cache_key(iso_filepath):
+    """This function is to generate the cache key of a base ISO image from its path, size and modification time
+    
+    Arguments:
+        iso_filepath {string} -- path of the base ISO image
+    
+    Returns:
+        string -- cache key of the base ISO image
+    """
+    iso_stat = os.stat(iso_filepath)
+    iso_identity = "{}:{}:{}".format(os.path.realpath(iso_filepath), iso_stat.st_size, iso_stat.st_mtime_ns)
+    return hashlib.sha1(iso_identity.encode("utf-8")).hexdigest()
+
+
+def extract_base_iso(iso_filepath, cache_path=ISO_CACHE_PATH):
+    """This function is to extract the contents of a base ISO image into the shared extraction cache.
+    The ISO image is mounted and copied only once, concurrent callers wait for the extraction in progress.
+    
+    Arguments:
+        iso_filepath {string} -- path of the base ISO image
+    
+    Keyword Arguments:
+        cache_path {string}   -- path of the extraction cache (default: {ISO_CACHE_PATH})
+    
+    Returns:
+        string -- path of the extracted ISO contents, None on failure
+    """
+    cache_key = get_iso_cache_key(iso_filepath)
+    extracted_path = os.path.join(cache_path, cache_key)
+    if os.path.isdir(extracted_path):
+        return extracted_path
+
+    create_dir_exist(cache_path)
+    with open(os.path.join(cache_path, cache_key + ".lock"), "w") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            # Another process may have completed the extraction while we were waiting for the lock
+            if os.path.isdir(extracted_path):
+                return extracted_path
+
+            print("Extracting the contents of the image {} to {}".format(iso_filepath, extracted_path))
+            mount_path = os.path.join(cache_path, cache_key + ".mnt")
+            partial_path = os.path.join(cache_path, cache_key + ".partial")
+            mount_proc_id = mount_iso_image(iso_filepath, mount_path)
+            if mount_proc_id != 0:
+                print("Attempting to unmount the previously mounted image")
+                unmount_iso_image(mount_path)
+                mount_proc_id = mount_iso_image(iso_filepath, mount_path)
+                if mount_proc_id != 0:
+                    print("Failed to mount the image {}".format(iso_filepath))
+                    return None
+            try:
+                copy_iso_contents(mount_path, partial_path)
+            finally:
+                unmount_iso_image(mount_path)
+            os.rename(partial_path, extracted_path)
+            return extracted_path
+        except Exception as er:
+            print("Error occurred while extracting the image {} {}".format(iso_filepath, er))
+            return None
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def link_or_copy_file(src, dst):
+    """This function is to hardlink a file and fall back to a copy when the paths are on different filesystems
+    
+    Arguments:
+        src {string} -- source file path
+        dst {string} -- destination file path
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+    return dst
+
+
+def reflink_file(src, dst):
+    """This function is to create a copy of a file which shares the data blocks of the source file
+    
+    Arguments:
+        src {string} -- source file path
+        dst {string} -- destination file path
+    """
+    with open(src, "rb") as src_file, open(dst, "wb") as dst_file:
+        fcntl.ioctl(dst_file.fileno(), FICLONE, src_file.fileno())
+    shutil.copystat(src, dst)
+    return dst
+
+
+def is_reflink_supported(src_dir, dst_dir):
+    """This function is to check if files of src_dir can be reflinked into dst_dir
+    
+    Arguments:
+        src_dir {string} -- source folder path
+        dst_dir {string} -- destination folder path
+    
+    Returns:
+        Boolean -- returns True if the filesystem supports reflinks between the two folders
+    """
+    probe_name = ".reflink_probe_{}_{}".format(os.getpid(), threading.get_ident())
+    src_probe = os.path.join(src_dir, probe_name)
+    dst_probe = os.path.join(dst_dir, probe_name + ".clone")
     try:
-        requests.packages.urllib3.disable_warnings()
-        file_head = requests.head(image_url, verify=False)
-        if file_head.status_code == 200:
-            return True
-    except Exception as e:
+        create_dir_exist(dst_dir)
+        with open(src_probe, "wb") as probe_file:
+            probe_file.write(b"reflink")
+        reflink_file(src_probe, dst_probe)
+        return True
+    except (IOError, OSError):
+        return False
+    finally:
+        delete_file(src_probe)
+        delete_file(dst_probe)
+
+
+def get_staging_copy_function(staging_mode):
+    """This function is to get the file copy function for the given staging mode
+    
+    Arguments:
+        staging_mode {string} -- one of reflink, hardlink or copy
+    
+    Returns:
+        function -- file copy function usable with shutil.copytree
+    """
+    copy_functions = {
+        "reflink"   :   reflink_file,
+        "hardlink"  :   link_or_copy_file,
+        "copy"      :   shutil.copy2
+    }
+    return copy_functions[staging_mode]
+
+
+def get_overlay_work_path(temppath):
+    """This function is to generate the path holding the upper and work folders of an overlay staging tree
+    
+    Arguments:
+        temppath {string} -- path of the per-server ISO tree
+    
+    Returns:
+        string -- path of the overlay upper and work folders
+    """
+    return temppath.rstrip("/") + ".overlay"
+
+
+def mount_overlay_tree(base_tree, temppath):
+    """This function is to mount an overlay filesystem on the per-server ISO tree with the extracted base ISO contents as the lower layer
+    
+    Arguments:
+        base_tree {string} -- path of the extracted base ISO contents
+        temppath {string}  -- path of the per-server ISO tree
+    """
+    overlay_path = get_overlay_work_path(temppath)
+    upper_path = os.path.join(overlay_path, "upper")
+    work_path = os.path.join(overlay_path, "work")
+    for dir_path in [upper_path, work_path, temppath]:
+        create_dir_exist(dir_path)
+    options = "lowerdir={},upperdir={},workdir={}".format(base_tree, upper_path, work_path)
+    args = ["mount", "-t", "overlay", "overlay", "-o", options, temppath]
+    execute_linux_command(args)
+    register_resource(temppath, "overlay_mount")
+
+
+def unmount_overlay_tree(temppath):
+    """This function is to unmount the overlay filesystem of a per-server ISO tree and delete its upper and work folders
+    
+    Arguments:
+        temppath {string} -- path of the per-server ISO tree
+    """
+    if os.path.ismount(temppath):
+        execute_linux_command(["umount", temppath])
+        release_resource(temppath, "overlay_mount")
+    overlay_path = get_overlay_work_path(temppath)
+    if os.path.isdir(overlay_path):
+        shutil.rmtree(overlay_path)
+
+
+def resolve_staging_mode(base_tree, temppath, staging_mode):
+    """This function is to resolve the auto staging mode to the cheapest mode of copying files supported by the filesystem
+    
+    Arguments:
+        base_tree {string}    -- path of the extracted base ISO contents
+        temppath {string}     -- path of the per-server ISO tree
+        staging_mode {string} -- requested staging mode
+    
+    Returns:
+        string -- one of reflink, hardlink or copy
+    """
+    if staging_mode != "auto":
+        return staging_mode
+    if is_reflink_supported(os.path.dirname(base_tree.rstrip("/")), os.path.dirname(temppath.rstrip("/"))):
+        return "reflink"
+    return "hardlink"
+
+
+def detach_staged_file(filepath):
+    """This function is to replace a file linked to the extraction cache with a private copy so it can be modified
+    
+    Arguments:
+        filepath {string} -- path of the file within the staging tree
+    """
+    if os.path.isfile(filepath):
+        detached_filepath = filepath + ".detached"
+        shutil.copy2(filepath, detached_filepath)
+        os.replace(detached_filepath, filepath)
+
+
+def stage_iso_tree(base_tree, temppath, modified_files, staging_mode="auto"):
+    """This function is to create the per-server ISO tree from the extracted base ISO contents.
+    Unchanged files are shared with the extraction cache, only the files to be modified get their own copy.
+    
+    Arguments:
+        base_tree {string}      -- path of the extracted base ISO contents
+        temppath {string}       -- path of the per-server ISO tree
+        modified_files {list}   -- paths relative to the ISO root of the files modified for the server
+    
+    Keyword Arguments:
+        staging_mode {string}   -- one of ISO_STAGING_MODES (default: {"auto"})
+    
+    Returns:
+        string -- staging mode used to create the per-server ISO tree
+    """
+    if staging_mode not in ISO_STAGING_MODES:
+        raise ValueError("Unsupported ISO staging mode {}. Supported modes are {}".format(staging_mode, ", ".join(ISO_STAGING_MODES)))
+    unmount_overlay_tree(temppath)
+    if os.path.isdir(temppath):
+        shutil.rmtree(temppath)
+
+    if staging_mode in ["auto", "overlay"]:
+        try:
+            # Files modified through the overlay are copied up to the upper folder, the lower folder is never written
+            mount_overlay_tree(base_tree, temppath)
+            return "overlay"
+        except (CalledProcessError, OSError) as er:
+            if staging_mode == "overlay":
+                raise
+            print("Overlay staging is not available for {}, falling back to file links {}".format(temppath, er))
+            unmount_overlay_tree(temppath)
+            shutil.rmtree(temppath, ignore_errors=True)
+
+    staging_mode = resolve_staging_mode(base_tree, temppath, staging_mode)
+    shutil.copytree(base_tree, temppath, symlinks=True, copy_function=get_staging_copy_function(staging_mode))
+    if staging_mode == "hardlink":
+        for modified_file in modified_files:
+            detach_staged_file(os.path.join(temppath, modified_file))
+    return staging_mode
+
+
+def prepare_iso_staging_tree(iso_filepath, temppath, modified_files, config):
+    """This function is to prepare the per-server ISO tree using the shared extraction cache of the base ISO image
+    
+    Arguments:
+        iso_filepath {string}   -- path of the base ISO image
+        temppath {string}       -- path of the per-server ISO tree
+        modified_files {list}   -- paths relative to the ISO root of the files modified for the server
+        config {dictionary}     -- config details, uses the optional ISO_cache_path and ISO_staging_mode values
+    
+    Returns:
+        Boolean -- returns True if the per-server ISO tree is ready, returns False on failure
+    """
+    base_tree = extract_base_iso(iso_filepath, config.get("ISO_cache_path", ISO_CACHE_PATH))
+    if not base_tree:
+        return False
+    try:
+        staging_mode = stage_iso_tree(base_tree, temppath, modified_files, config.get("ISO_staging_mode", "auto"))
+        print("Prepared the ISO tree {} using {} staging".format(temppath, staging_mode))
+        return True
+    except Exception as er:
+        print("Error occurred while preparing the ISO tree {} {}".format(temppath, er))
         return False
-    return False
\ No newline at end of file
@@ -0,0 +1,638 @@
+# (C) Copyright 2021 Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import re
+import shutil
+import struct
+import zlib
+from datetime import datetime
+
+from image_operations import *
+
+# ISO9660 logical sector size
+SECTOR_SIZE = 2048
+
+# Sector of the first volume descriptor
+VOLUME_DESCRIPTOR_START = 16
+
+# Directory record flags
+FILE_FLAG_DIRECTORY = 0x02
+FILE_FLAG_MULTI_EXTENT = 0x80
+
+# Escape sequences identifying a Joliet supplementary volume descriptor
+JOLIET_ESCAPE_SEQUENCES = [b"%/@", b"%/C", b"%/E"]
+
+# Identifiers of the UDF volume recognition sequence following the ISO9660 volume descriptors
+UDF_IDENTIFIERS = [b"BEA01", b"NSR02", b"NSR03", b"TEA01"]
+
+# Sector size of the MBR and GPT partition tables of hybrid images
+PARTITION_SECTOR_SIZE = 512
+MBR_PARTITION_TABLE_OFFSET = 446
+MBR_PROTECTIVE_TYPE = 0xEE
+GPT_SIGNATURE = b"EFI PART"
+
+# Application use area of the primary volume descriptor, holding the media checksum of implantisomd5 or tagmedia
+APPLICATION_USE_OFFSET = 883
+APPLICATION_USE_LENGTH = 512
+MEDIA_CHECKSUM_MARKERS = [b"ISO MD5SUM", b"md5sum="]
+
+
+class IsoPatchError(Exception):
+    """Raised when an ISO image can not be patched in place"""
+    pass
+
+
+def both_endian_16(value):
+    """This function is to encode a 16 bit value in the ISO9660 both-endian format"""
+    return struct.pack("<H", value) + struct.pack(">H", value)
+
+
+def both_endian_32(value):
+    """This function is to encode a 32 bit value in the ISO9660 both-endian format"""
+    return struct.pack("<I", value) + struct.pack(">I", value)
+
+
+def get_gpt_header_crc(header):
+    """This function is to compute the CRC32 of a GPT header, with its own CRC field zeroed"""
+    return zlib.crc32(header[:16] + b"\x00" * 4 + header[20:]) & 0xffffffff
+
+
+def set_gpt_header_crc(header):
+    return header[:16] + struct.pack("<I", get_gpt_header_crc(header)) + header[20:]
+
+
+def get_record_timestamp():
+    """This function is to generate the 7 byte recording date and time of a directory record in UTC"""
+    now = datetime.utcnow()
+    return bytes([now.year - 1900, now.month, now.day, now.hour, now.minute, now.second, 0])
+
+
+def get_iso9660_identifier(filename):
+    """This function is to generate the primary volume file identifier of a file name
+
+    Arguments:
+        filename {string} -- name of the file
+
+    Returns:
+        bytes -- d-characters file identifier with version number
+    """
+    base_name, _, extension = filename.rpartition(".") if "." in filename else (filename, "", "")
+    base_name = re.sub("[^A-Z0-9_]", "_", base_name.upper())[:30]
+    extension = re.sub("[^A-Z0-9_]", "_", extension.upper())[:30 - len(base_name)]
+    return (base_name + "." + extension + ";1").encode("ascii")
+
+
+def build_directory_record(extent, size, flags, identifier, system_use=b""):
+    """This function is to build an ISO9660 directory record
+
+    Arguments:
+        extent {int}        -- sector of the file data
+        size {int}          -- length of the file data in bytes
+        flags {int}         -- file flags
+        identifier {bytes}  -- file identifier
+
+    Keyword Arguments:
+        system_use {bytes}  -- system use area holding the Rock Ridge entries (default: {b""})
+
+    Returns:
+        bytes -- directory record
+    """
+    padding = b"\x00" if len(identifier) % 2 == 0 else b""
+    record = bytes([0, 0]) + both_endian_32(extent) + both_endian_32(size) + get_record_timestamp() + \
+             bytes([flags, 0, 0]) + both_endian_16(1) + bytes([len(identifier)]) + identifier + padding + system_use
+    if len(record) % 2:
+        record += b"\x00"
+    return bytes([len(record)]) + record[1:]
+
+
+def set_record_extent(record_data, extent, size):
+    """This function is to update the extent location and data length of a directory record
+
+    Arguments:
+        record_data {bytes} -- directory record
+        extent {int}        -- sector of the file data
+        size {int}          -- length of the file data in bytes
+
+    Returns:
+        bytes -- updated directory record
+    """
+    return record_data[:2] + both_endian_32(extent) + both_endian_32(size) + record_data[18:]
+
+
+def iter_susp_entries(system_use):
+    """This function is to iterate over the System Use Sharing Protocol entries of a system use area
+
+    Arguments:
+        system_use {bytes} -- system use area of a directory record
+
+    Returns:
+        generator -- (signature, entry) tuples
+    """
+    position = 0
+    while position + 4 <= len(system_use):
+        entry_length = system_use[position + 2]
+        if entry_length < 4:
+            break
+        yield system_use[position:position + 2], system_use[position:position + entry_length]
+        position += entry_length
+
+
+class IsoImage(object):
+    """Directory record level access to the ISO9660 and Joliet hierarchies of an ISO image file.
+    Files are patched by appending their data after the end of the image and pointing the directory records to it,
+    so the existing file data, the El Torito boot catalog and the boot images are never moved.
+    The MBR and GPT of hybrid images are kept in line with the new image size, images with a UDF bridge or an Apple
+    partition map are refused.
+    """
+
+    def __init__(self, iso_file):
+        self.iso_file = iso_file
+        self.hierarchies = []
+        self.volume_descriptors = []
+        self.susp_skip = 0
+
+        sector = VOLUME_DESCRIPTOR_START
+        while True:
+            descriptor = self.read_sectors(sector)
+            if descriptor[1:6] != b"CD001":
+                raise IsoPatchError("Invalid volume descriptor at sector {}".format(sector))
+            descriptor_type = descriptor[0]
+            if descriptor_type == 255:
+                break
+            if descriptor_type in [1, 2]:
+                if struct.unpack("<H", descriptor[128:130])[0] != SECTOR_SIZE:
+                    raise IsoPatchError("Unsupported logical block size")
+                self.volume_descriptors.append(sector)
+                joliet = descriptor_type == 2 and any(seq in descriptor[88:120] for seq in JOLIET_ESCAPE_SEQUENCES)
+                if descriptor_type == 1 or joliet:
+                    self.hierarchies.append({"descriptor": sector, "joliet": joliet})
+            sector += 1
+
+        if not self.hierarchies or self.hierarchies[0]["joliet"]:
+            raise IsoPatchError("Primary volume descriptor not found")
+
+        # The UDF bridge of an image has its own directory structures, they would keep pointing to the old files
+        for udf_sector in range(sector + 1, sector + 17):
+            if self.read_sectors(udf_sector)[1:6] in UDF_IDENTIFIERS:
+                raise IsoPatchError("UDF bridge images are not supported")
+        self.read_partition_tables()
+
+        # The SP entry of the root directory gives the number of bytes to skip in each system use area
+        root = self.get_root_record(self.hierarchies[0])
+        dot_record = self.read_directory(root["extent"], root["size"])[0]
+        for signature, entry in iter_susp_entries(dot_record["system_use"]):
+            if signature == b"SP" and entry[4:6] == b"\xbe\xef":
+                self.susp_skip = entry[6]
+                self.hierarchies[0]["rock_ridge"] = True
+
+    def read_partition_tables(self):
+        """Reads the MBR and GPT of a hybrid image, they are written again by write_partition_tables once the image grew"""
+        system_area = self.read_sectors(0)
+        self.image_size = self.get_image_size()
+        self.mbr = system_area[:PARTITION_SECTOR_SIZE] if system_area[510:512] == b"\x55\xaa" else None
+        self.gpt = None
+        if system_area[0:2] == b"ER" and b"PM" in [system_area[512:514], system_area[2048:2050]]:
+            raise IsoPatchError("Apple partition map hybrid images are not supported")
+        header = system_area[PARTITION_SECTOR_SIZE:2 * PARTITION_SECTOR_SIZE]
+        if header[0:8] != GPT_SIGNATURE:
+            return
+        header_size = struct.unpack("<I", header[12:16])[0]
+        if not 92 <= header_size <= PARTITION_SECTOR_SIZE or get_gpt_header_crc(header[:header_size]) != struct.unpack("<I", header[16:20])[0]:
+            raise IsoPatchError("Invalid GPT header")
+        entries_lba, entry_count, entry_size = struct.unpack("<QII", header[72:88])
+        self.iso_file.seek(entries_lba * PARTITION_SECTOR_SIZE)
+        entries = self.iso_file.read(entry_count * entry_size)
+        if zlib.crc32(entries) & 0xffffffff != struct.unpack("<I", header[88:92])[0]:
+            raise IsoPatchError("Invalid GPT partition entries")
+        self.gpt = {"header": header[:header_size], "entries": entries}
+
+    def write_partition_tables(self):
+        """Moves the backup GPT to the new end of the image and extends the partitions covering the whole image, in the
+        MBR and in the GPT partition entries.
+        It is called once all the files are written, nothing can be appended after the backup GPT."""
+        if self.get_image_size() == self.image_size:
+            return
+        if self.gpt:
+            end = self.get_volume_size() * SECTOR_SIZE
+            entries = self.gpt["entries"]
+            entries_sectors = (len(entries) + PARTITION_SECTOR_SIZE - 1) // PARTITION_SECTOR_SIZE
+            tail_size = (entries_sectors + 1) * PARTITION_SECTOR_SIZE
+            tail_size += (SECTOR_SIZE - tail_size % SECTOR_SIZE) % SECTOR_SIZE
+            backup_lba = (end + tail_size) // PARTITION_SECTOR_SIZE - 1
+            backup_entries_lba = backup_lba - entries_sectors
+            header = self.gpt["header"]
+            entries = self.extend_gpt_entries(header, entries, backup_entries_lba - 1)
+            entries_crc = struct.pack("<I", zlib.crc32(entries) & 0xffffffff)
+            primary = header[:32] + struct.pack("<Q", backup_lba) + header[40:48] + struct.pack("<Q", backup_entries_lba - 1) + \
+                header[56:88] + entries_crc + header[92:]
+            backup = header[:24] + struct.pack("<QQ", backup_lba, 1) + primary[40:72] + struct.pack("<Q", backup_entries_lba) + primary[80:]
+            self.write_at(end, b"\x00" * (backup_entries_lba * PARTITION_SECTOR_SIZE - end))
+            self.write_at(struct.unpack("<Q", header[72:80])[0] * PARTITION_SECTOR_SIZE, entries)
+            self.write_at(backup_entries_lba * PARTITION_SECTOR_SIZE, entries.ljust(entries_sectors * PARTITION_SECTOR_SIZE, b"\x00"))
+            self.write_at(backup_lba * PARTITION_SECTOR_SIZE, set_gpt_header_crc(backup).ljust(PARTITION_SECTOR_SIZE, b"\x00"))
+            self.write_at(PARTITION_SECTOR_SIZE, set_gpt_header_crc(primary))
+        if self.mbr:
+            old_sectors = self.image_size // PARTITION_SECTOR_SIZE
+            new_sectors = self.get_image_size() // PARTITION_SECTOR_SIZE
+            for offset in range(MBR_PARTITION_TABLE_OFFSET, MBR_PARTITION_TABLE_OFFSET + 64, 16):
+                partition_type = self.mbr[offset + 4]
+                start, count = struct.unpack("<II", self.mbr[offset + 8:offset + 16])
+                # The protective partition of a GPT, or the isohybrid partition holding the ISO filesystem
+                if partition_type == MBR_PROTECTIVE_TYPE:
+                    count = min(new_sectors - 1, 0xffffffff)
+                elif partition_type and start == 0 and count == old_sectors:
+                    count = min(new_sectors, 0xffffffff)
+                else:
+                    continue
+                self.write_at(offset + 12, struct.pack("<I", count))
+
+    def extend_gpt_entries(self, header, entries, last_usable_lba):
+        """Returns the GPT partition entries with the partitions which ended at the old end of the image (the isohybrid
+        partition holding the ISO filesystem) ending at the new last usable LBA"""
+        old_ends = [struct.unpack("<Q", header[48:56])[0], self.image_size // PARTITION_SECTOR_SIZE - 1]
+        entry_count, entry_size = struct.unpack("<II", header[80:88])
+        entries = bytearray(entries)
+        for offset in range(0, entry_count * entry_size, entry_size):
+            if not any(entries[offset:offset + 16]):
+                continue
+            if struct.unpack("<Q", entries[offset + 40:offset + 48])[0] in old_ends:
+                entries[offset + 40:offset + 48] = struct.pack("<Q", last_usable_lba)
+        return bytes(entries)
+
+    def clear_media_checksum(self):
+        """Blanks the media checksum implanted in the base image, it does not match the patched image anymore"""
+        application_use = self.read_sectors(self.hierarchies[0]["descriptor"])[APPLICATION_USE_OFFSET:APPLICATION_USE_OFFSET + APPLICATION_USE_LENGTH]
+        if any(marker in application_use for marker in MEDIA_CHECKSUM_MARKERS):
+            self.write_at(self.hierarchies[0]["descriptor"] * SECTOR_SIZE + APPLICATION_USE_OFFSET, b" " * APPLICATION_USE_LENGTH)
+
+    def get_image_size(self):
+        self.iso_file.seek(0, os.SEEK_END)
+        return self.iso_file.tell()
+
+    def read_sectors(self, sector, count=1):
+        self.iso_file.seek(sector * SECTOR_SIZE)
+        return self.iso_file.read(count * SECTOR_SIZE)
+
+    def write_at(self, position, data):
+        self.iso_file.seek(position)
+        self.iso_file.write(data)
+
+    def get_volume_size(self):
+        """Number of sectors of the image, including any data after the end of the recorded volume"""
+        descriptor = self.read_sectors(self.volume_descriptors[0])
+        volume_size = struct.unpack("<I", descriptor[80:84])[0]
+        return max(volume_size, (self.get_image_size() + SECTOR_SIZE - 1) // SECTOR_SIZE)
+
+    def set_volume_size(self, sectors):
+        for descriptor in self.volume_descriptors:
+            self.write_at(descriptor * SECTOR_SIZE + 80, both_endian_32(sectors))
+
+    def append_data(self, data):
+        """Writes data after the end of the image and returns its first sector"""
+        sector = self.get_volume_size()
+        padding = (SECTOR_SIZE - len(data) % SECTOR_SIZE) % SECTOR_SIZE
+        self.write_at(sector * SECTOR_SIZE, data + b"\x00" * padding)
+        self.set_volume_size(sector + (len(data) + padding) // SECTOR_SIZE)
+        return sector
+
+    def parse_record(self, data, offset, position):
+        length = data[offset]
+        identifier_length = data[offset + 32]
+        identifier = data[offset + 33:offset + 33 + identifier_length]
+        system_use_offset = 33 + identifier_length + (1 - identifier_length % 2)
+        return {
+            "position": position,
+            "data": data[offset:offset + length],
+            "extent": struct.unpack("<I", data[offset + 2:offset + 6])[0],
+            "size": struct.unpack("<I", data[offset + 10:offset + 14])[0],
+            "flags": data[offset + 25],
+            "identifier": identifier,
+            "system_use": data[offset + system_use_offset:offset + length]
+        }
+
+    def get_root_record(self, hierarchy):
+        position = hierarchy["descriptor"] * SECTOR_SIZE + 156
+        descriptor = self.read_sectors(hierarchy["descriptor"])
+        return self.parse_record(descriptor, 156, position)
+
+    def read_directory(self, extent, size):
+        """Returns the records of a directory, records never cross a sector boundary"""
+        data = self.read_sectors(extent, (size + SECTOR_SIZE - 1) // SECTOR_SIZE)
+        records = []
+        for sector_offset in range(0, size, SECTOR_SIZE):
+            offset = sector_offset
+            while offset < sector_offset + SECTOR_SIZE and data[offset] != 0:
+                records.append(self.parse_record(data, offset, extent * SECTOR_SIZE + offset))
+                offset += data[offset]
+        return records
+
+    def get_rock_ridge_name(self, record):
+        name = b""
+        for signature, entry in iter_susp_entries(record["system_use"][self.susp_skip:]):
+            if signature == b"NM":
+                name += entry[5:]
+        return name.decode("utf-8") if name else None
+
+    def get_record_name(self, hierarchy, record):
+        if hierarchy["joliet"]:
+            name = record["identifier"].decode("utf-16-be")
+        else:
+            name = self.get_rock_ridge_name(record) if hierarchy.get("rock_ridge") else None
+            if name is None:
+                name = record["identifier"].decode("ascii", "replace")
+        name = name.split(";")[0]
+        if not hierarchy["joliet"] and name.endswith("."):
+            name = name[:-1]
+        return name
+
+    def find_record(self, hierarchy, iso_path):
+        """Returns the record of a path relative to the ISO root, names are compared case-insensitively"""
+        record = self.get_root_record(hierarchy)
+        for name in [part for part in iso_path.split("/") if part]:
+            if not record["flags"] & FILE_FLAG_DIRECTORY:
+                return None
+            for child in self.read_directory(record["extent"], record["size"])[2:]:
+                if self.get_record_name(hierarchy, child).lower() == name.lower():
+                    record = child
+                    break
+            else:
+                return None
+        return record
+
+    def read_file(self, iso_path):
+        record = self.find_record(self.hierarchies[0], iso_path)
+        if record is None or record["flags"] & FILE_FLAG_DIRECTORY:
+            raise IsoPatchError("File {} not found in the ISO image".format(iso_path))
+        if record["flags"] & FILE_FLAG_MULTI_EXTENT:
+            raise IsoPatchError("Multi-extent file {} is not supported".format(iso_path))
+        data = self.read_sectors(record["extent"], (record["size"] + SECTOR_SIZE - 1) // SECTOR_SIZE)
+        return data[:record["size"]]
+
+    def build_system_use(self, hierarchy, siblings, filename):
+        """Builds the Rock Ridge entries of a new file from the entries of a sibling file"""
+        if hierarchy["joliet"] or not hierarchy.get("rock_ridge"):
+            return b""
+        name_entry = b"NM" + bytes([5 + len(filename.encode("utf-8")), 1, 0]) + filename.encode("utf-8")
+        for sibling in siblings:
+            system_use = sibling["system_use"]
+            entries = list(iter_susp_entries(system_use[self.susp_skip:]))
+            signatures = [signature for signature, entry in entries]
+            if sibling["flags"] & FILE_FLAG_DIRECTORY or b"CE" in signatures or b"PX" not in signatures:
+                continue
+            cloned = b"".join(entry for signature, entry in entries if signature != b"NM")
+            return system_use[:self.susp_skip] + cloned + name_entry
+        # POSIX attributes r--r--r--, one link, owned by root
+        posix_entry = b"PX" + bytes([36, 1]) + both_endian_32(0o100444) + both_endian_32(1) + both_endian_32(0) + both_endian_32(0)
+        return b"\x00" * self.susp_skip + posix_entry + name_entry
+
+    def get_identifier(self, hierarchy, siblings, filename):
+        if not hierarchy["joliet"]:
+            return get_iso9660_identifier(filename)
+        # Follow the existing Joliet names on whether a ";1" version number is appended
+        version = ";1".encode("utf-16-be")
+        files = [sibling for sibling in siblings if not sibling["flags"] & FILE_FLAG_DIRECTORY]
+        if not files:
+            root = self.get_root_record(hierarchy)
+            files = [child for child in self.read_directory(root["extent"], root["size"])[2:]
+                     if not child["flags"] & FILE_FLAG_DIRECTORY]
+        if not any(sibling["identifier"].endswith(version) for sibling in files):
+            version = b""
+        return filename[:64].encode("utf-16-be") + version
+
+    def add_file_record(self, hierarchy, iso_path, extent, size):
+        """Adds the record of a new file to its parent directory, relocating the directory when it is full"""
+        parent_path, _, filename = iso_path.strip("/").rpartition("/")
+        parent = self.find_record(hierarchy, parent_path)
+        if parent is None or not parent["flags"] & FILE_FLAG_DIRECTORY:
+            raise IsoPatchError("Directory {} not found in the ISO image".format(parent_path or "/"))
+
+        records = self.read_directory(parent["extent"], parent["size"])
+        siblings = records[2:]
+        identifier = self.get_identifier(hierarchy, siblings, filename)
+        system_use = self.build_system_use(hierarchy, siblings, filename)
+        new_record = build_directory_record(extent, size, 0, identifier, system_use)
+
+        # Directory records are sorted by file identifier
+        index = 2
+        while index < len(records) and records[index]["identifier"] < identifier:
+            index += 1
+        record_data = [record["data"] for record in records]
+        record_data.insert(index, new_record)
+        self.write_directory(hierarchy, parent_path, parent, record_data)
+
+    def pack_directory(self, record_data):
+        packed = b""
+        for data in record_data:
+            if len(packed) % SECTOR_SIZE + len(data) > SECTOR_SIZE:
+                packed += b"\x00" * (SECTOR_SIZE - len(packed) % SECTOR_SIZE)
+            packed += data
+        return packed + b"\x00" * ((SECTOR_SIZE - len(packed) % SECTOR_SIZE) % SECTOR_SIZE)
+
+    def write_directory(self, hierarchy, dir_path, dir_record, record_data):
+        packed = self.pack_directory(record_data)
+        if len(packed) <= dir_record["size"]:
+            self.write_at(dir_record["extent"] * SECTOR_SIZE, packed + b"\x00" * (dir_record["size"] - len(packed)))
+            return
+
+        # The directory does not fit in its extent anymore, move it after the end of the image
+        old_extent = dir_record["extent"]
+        new_extent = self.get_volume_size()
+        new_size = len(packed)
+        record_data[0] = set_record_extent(record_data[0], new_extent, new_size)
+        if not dir_path:
+            # The ".." record of the root directory points to the root directory itself
+            record_data[1] = set_record_extent(record_data[1], new_extent, new_size)
+        self.append_data(self.pack_directory(record_data))
+
+        # Records pointing to the directory: its record in the parent directory (or the volume descriptor)
+        # and the ".." record of each sub directory
+        self.write_at(dir_record["position"], set_record_extent(dir_record["data"], new_extent, new_size))
+        for child in self.read_directory(new_extent, new_size)[2:]:
+            if child["flags"] & FILE_FLAG_DIRECTORY:
+                dot_dot_record = self.read_directory(child["extent"], child["size"])[1]
+                self.write_at(dot_dot_record["position"], set_record_extent(dot_dot_record["data"], new_extent, new_size))
+        self.update_path_tables(hierarchy, old_extent, new_extent)
+
+    def update_path_tables(self, hierarchy, old_extent, new_extent):
+        descriptor = self.read_sectors(hierarchy["descriptor"])
+        table_size = struct.unpack("<I", descriptor[132:136])[0]
+        tables = [(struct.unpack("<I", descriptor[140:144])[0], "<"), (struct.unpack("<I", descriptor[144:148])[0], "<"),
+                  (struct.unpack(">I", descriptor[148:152])[0], ">"), (struct.unpack(">I", descriptor[152:156])[0], ">")]
+        for table_extent, endian in tables:
+            if not table_extent:
+                continue
+            table = self.read_sectors(table_extent, (table_size + SECTOR_SIZE - 1) // SECTOR_SIZE)
+            offset = 0
+            while offset < table_size:
+                name_length = table[offset]
+                if name_length == 0:
+                    break
+                if struct.unpack(endian + "I", table[offset + 2:offset + 6])[0] == old_extent:
+                    self.write_at(table_extent * SECTOR_SIZE + offset + 2, struct.pack(endian + "I", new_extent))
+                offset += 8 + name_length + name_length % 2
+
+    def replace_file(self, iso_path, data):
+        """Writes the new contents of a file after the end of the image and points the records of all hierarchies to it"""
+        extent = self.append_data(data)
+        for hierarchy in self.hierarchies:
+            record = self.find_record(hierarchy, iso_path)
+            if record is None:
+                self.add_file_record(hierarchy, iso_path, extent, len(data))
+            elif record["flags"] & (FILE_FLAG_DIRECTORY | FILE_FLAG_MULTI_EXTENT):
+                raise IsoPatchError("{} can not be replaced in the ISO image".format(iso_path))
+            else:
+                self.write_at(record["position"], set_record_extent(record["data"], extent, len(data)))
+
+
+def clone_iso_image(base_iso_path, custom_iso_path):
+    """This function is to copy the base ISO image, sharing its data blocks when the filesystem supports reflinks
+    
+    Arguments:
+        base_iso_path {string}   -- path of the base ISO image
+        custom_iso_path {string} -- path of the copy
+    """
+    delete_file(custom_iso_path)
+    try:
+        reflink_file(base_iso_path, custom_iso_path)
+    except (IOError, OSError):
+        delete_file(custom_iso_path)
+        shutil.copyfile(base_iso_path, custom_iso_path)
+
+
+def can_patch_iso_image(iso_filepath):
+    """This function is to check if the directory records of an ISO image can be patched in place
+    
+    Arguments:
+        iso_filepath {string} -- path of the ISO image
+    
+    Returns:
+        Boolean -- returns True if the ISO image can be patched, returns False otherwise
+    """
+    try:
+        with open(iso_filepath, "rb") as iso_file:
+            IsoImage(iso_file)
+        return True
+    except Exception as er:
+        print("ISO image {} can not be patched {}".format(iso_filepath, er))
+        return False
+
+
+def get_iso_build_mode(iso_filepath, config):
+    """This function is to get how the custom ISO images of a base ISO image are built, as per the optional ISO_build_mode config value.
+    patch (default) - the base ISO image is copied and only the modified files are written to the copy
+    rebuild         - the whole ISO image is recreated from the per-server ISO tree
+    
+    Arguments:
+        iso_filepath {string} -- path of the base ISO image
+        config {dictionary}   -- config details
+    
+    Returns:
+        string -- patch or rebuild
+    """
+    build_mode = config.get("ISO_build_mode", "patch")
+    if build_mode == "patch" and not can_patch_iso_image(iso_filepath):
+        print("Falling back to rebuilding the custom ISO images of {}".format(iso_filepath))
+        return "rebuild"
+    return build_mode
+
+
+def extract_iso_files(iso_filepath, iso_paths, temppath):
+    """This function is to extract a few files of an ISO image without mounting it
+    
+    Arguments:
+        iso_filepath {string} -- path of the ISO image
+        iso_paths {list}      -- paths relative to the ISO root of the files to extract
+        temppath {string}     -- destination folder, the ISO folder layout is kept
+    """
+    with open(iso_filepath, "rb") as iso_file:
+        image = IsoImage(iso_file)
+        for iso_path in iso_paths:
+            filepath = os.path.join(temppath, iso_path)
+            create_dir_exist(os.path.dirname(filepath))
+            with open(filepath, "wb") as file_write:
+                file_write.write(image.read_file(iso_path))
+
+
+def prepare_iso_tree_for_build(iso_filepath, temppath, boot_files, config, build_mode):
+    """This function is to prepare the per-server ISO tree. When patching, the tree only holds the boot files.
+    
+    Arguments:
+        iso_filepath {string} -- path of the base ISO image
+        temppath {string}     -- path of the per-server ISO tree
+        boot_files {list}     -- paths relative to the ISO root of the files modified for the server
+        config {dictionary}   -- config details
+        build_mode {string}   -- patch or rebuild
+    
+    Returns:
+        Boolean -- returns True if the per-server ISO tree is ready, returns False on failure
+    """
+    if build_mode == "rebuild":
+        return prepare_iso_staging_tree(iso_filepath, temppath, boot_files, config)
+    try:
+        if os.path.isdir(temppath):
+            shutil.rmtree(temppath)
+        # Boot images are left untouched in the copy of the base image, only the configuration files are needed
+        extract_iso_files(iso_filepath, [boot_file for boot_file in boot_files if not boot_file.endswith(".bin")], temppath)
+        return True
+    except Exception as er:
+        print("Error occurred while extracting the boot files of {} {}".format(iso_filepath, er))
+        return False
+
+
+def patch_custom_iso_image(iso_filepath, temppath, custom_iso_path):
+    """This function is to create the custom ISO image by writing the files of the per-server ISO tree which differ
+    from the base ISO image into a copy of the base ISO image. The El Torito boot catalog and boot images are kept as is,
+    the backup GPT of hybrid images is moved to the new end of the image and the stale media checksum is cleared.
+    
+    Arguments:
+        iso_filepath {string}    -- path of the base ISO image
+        temppath {string}        -- path of the per-server ISO tree
+        custom_iso_path {string} -- path of the resultant ISO image
+    
+    Returns:
+        Boolean -- returns True on successful creation of the custom ISO image, returns False on failure
+    """
+    try:
+        if os.path.dirname(custom_iso_path):
+            create_dir_exist(os.path.dirname(custom_iso_path))
+        clone_iso_image(iso_filepath, custom_iso_path)
+        with open(custom_iso_path, "r+b") as iso_file:
+            image = IsoImage(iso_file)
+            for dir_path, dir_names, file_names in os.walk(temppath):
+                dir_names.sort()
+                for file_name in sorted(file_names):
+                    filepath = os.path.join(dir_path, file_name)
+                    iso_path = os.path.relpath(filepath, temppath).replace(os.sep, "/")
+                    with open(filepath, "rb") as file_read:
+                        data = file_read.read()
+                    try:
+                        if image.read_file(iso_path) == data:
+                            continue
+                    except IsoPatchError:
+                        pass
+                    image.replace_file(iso_path, data)
+            image.clear_media_checksum()
+            image.write_partition_tables()
+        return True
+    except Exception as er:
+        print("Error occurred while patching the custom iso image {} {}".format(custom_iso_path, er))
+        delete_file(custom_iso_path)
+        return False
@@ -0,0 +1,232 @@
+# (C) Copyright (2018,2021) Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import fcntl
+import glob
+import os
+import re
+import shutil
+
+from image_operations import *
+from artifact_operations import *
+
+# Name prefixes of the per-build temporary folders, also used by the runs which did not register their folders
+BUILD_TEMP_PREFIXES = ["redhatmount_", "slesmount_"]
+# Folders of HTTP_file_path written by the deployments, they hold no base image
+HTTP_OUTPUT_FOLDERS = [ARTIFACT_FOLDER.rstrip("/"), "kickstarts"]
+# Names of the extractions in the extraction cache, as per get_iso_cache_key
+ISO_CACHE_KEY_PATTERN = re.compile(r"^[0-9a-f]{40}$")
+
+
+def get_mount_points():
+    """This function is to list the mount points of the host
+
+    Returns:
+        list -- paths of the mount points
+    """
+    with open("/proc/mounts") as mounts_file:
+        return [line.split()[1].replace("\\040", " ") for line in mounts_file if len(line.split()) > 1]
+
+
+def unmount_stale_mount(mount_path):
+    """This function is to unmount a mount point left by a crashed run, lazily when it is still busy"""
+    try:
+        execute_linux_command(["umount", mount_path])
+    except CalledProcessError:
+        execute_linux_command(["umount", "-l", mount_path])
+
+
+def reclaim_resource(entry):
+    """This function is to unmount or delete a registered resource whose process is not running anymore
+
+    Arguments:
+        entry {dictionary} -- registry entry of the resource, as per register_resource
+    """
+    path = entry["path"]
+    if entry["kind"] in ["loop_mount", "overlay_mount"]:
+        if os.path.ismount(path):
+            unmount_stale_mount(path)
+        if entry["kind"] == "loop_mount":
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            shutil.rmtree(get_overlay_work_path(path), ignore_errors=True)
+    else:
+        if os.path.ismount(path):
+            unmount_stale_mount(path)
+        shutil.rmtree(get_overlay_work_path(path), ignore_errors=True)
+        shutil.rmtree(path, ignore_errors=True)
+    release_resource(path, entry["kind"])
+
+
+def get_stale_build_paths(config, live_paths):
+    """This function is to find the per-build temporary folders (and their overlay folders) of the runs which are over
+
+    Arguments:
+        config {dictionary} -- config details, uses the optional Build_temp_path value
+        live_paths {set}    -- paths registered by running processes
+
+    Returns:
+        list -- paths of the stale folders
+    """
+    build_temp_path = config.get("Build_temp_path", BUILD_TEMP_PATH)
+    stale_paths = []
+    for prefix in BUILD_TEMP_PREFIXES:
+        for path in glob.glob(os.path.join(build_temp_path, prefix + "*")):
+            path = os.path.abspath(path)
+            tree_path = path[:-len(".overlay")] if path.endswith(".overlay") else path
+            if os.path.isdir(path) and tree_path not in live_paths:
+                stale_paths.append(path)
+    return stale_paths
+
+
+def reclaim_partial_extractions(cache_path):
+    """This function is to delete the extractions of base ISO images interrupted by a crash, they are left as
+    <key>.partial and <key>.mnt folders whose extraction lock is not held anymore
+
+    Arguments:
+        cache_path {string} -- path of the extraction cache
+
+    Returns:
+        int -- number of folders deleted
+    """
+    reclaimed = 0
+    for path in glob.glob(os.path.join(cache_path, "*.partial")) + glob.glob(os.path.join(cache_path, "*.mnt")):
+        lock_path = path.rsplit(".", 1)[0] + ".lock"
+        with open(lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                # The extraction is in progress in another process
+                continue
+            try:
+                if os.path.ismount(path):
+                    unmount_stale_mount(path)
+                shutil.rmtree(path, ignore_errors=True)
+                reclaimed += 1
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return reclaimed
+
+
+def get_base_image_keys(http_file_path):
+    """This function is to get the extraction cache keys of the ISO images served from the HTTP server folder and its
+    subfolders, except the folders of the custom images and kickstart files written by the deployments
+
+    Arguments:
+        http_file_path {string} -- path of the folder holding the base ISO images
+
+    Returns:
+        set -- cache keys, as per get_iso_cache_key
+    """
+    keys = set()
+    for folder_path, folder_names, names in os.walk(http_file_path):
+        if os.path.abspath(folder_path) == os.path.abspath(http_file_path):
+            folder_names[:] = [name for name in folder_names if name not in HTTP_OUTPUT_FOLDERS]
+        for name in names:
+            iso_filepath = os.path.join(folder_path, name)
+            if is_iso_image(name) and os.path.isfile(iso_filepath):
+                keys.add(get_iso_cache_key(iso_filepath))
+    return keys
+
+
+def reclaim_stale_extractions(cache_path, http_file_path):
+    """This function is to delete the extractions of base ISO images which are not served anymore: the image was
+    removed or replaced (its key changes with its size and modification time), so that the key of no image in the
+    HTTP server folder matches them. The extractions are skipped while their lock is held.
+
+    Arguments:
+        cache_path {string}     -- path of the extraction cache
+        http_file_path {string} -- path of the folder holding the base ISO images
+
+    Returns:
+        int -- number of folders deleted
+    """
+    if not os.path.isdir(http_file_path):
+        return 0
+    image_keys = get_base_image_keys(http_file_path)
+    reclaimed = 0
+    for name in os.listdir(cache_path):
+        path = os.path.join(cache_path, name)
+        # The extractions are named by their key only, the other entries are locks, keys and interrupted extractions
+        if not ISO_CACHE_KEY_PATTERN.match(name) or name in image_keys or not os.path.isdir(path):
+            continue
+        lock_path = path + ".lock"
+        with open(lock_path, "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except (IOError, OSError):
+                continue
+            try:
+                print("Deleting the extraction {} of an image which is not served anymore".format(path))
+                shutil.rmtree(path, ignore_errors=True)
+                delete_file(lock_path)
+                reclaimed += 1
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+    return reclaimed
+
+
+def run_startup_janitor(config):
+    """This function is to reclaim what the previous runs left behind before a new run starts: the mounts and
+    temporary folders registered by processes which are not running anymore, the unregistered per-build folders and
+    mounts, the interrupted base ISO extractions and the extractions of the images which are not served anymore.
+    The least recently used artifacts beyond the disk budget are then evicted.
+
+    Arguments:
+        config {dictionary} -- config details, uses HTTP_file_path and the optional Build_temp_path, ISO_cache_path
+                               and Artifact_budget_gb values
+
+    Returns:
+        dictionary -- number of mounts and folders reclaimed and bytes of artifacts evicted
+    """
+    summary = {"mounts": 0, "folders": 0, "evicted_bytes": 0}
+    registry = load_resource_registry()
+    live_paths = set(entry["path"] for entry in registry.values() if is_process_alive(entry["pid"]))
+    # The mounts are reclaimed first, so that the folders holding them can be deleted
+    stale_entries = [entry for entry in registry.values() if not is_process_alive(entry["pid"])]
+    for entry in sorted(stale_entries, key=lambda entry: entry["kind"] == "temp_tree"):
+        try:
+            reclaim_resource(entry)
+            summary["mounts" if entry["kind"] != "temp_tree" else "folders"] += 1
+        except Exception as er:
+            print("Failed to reclaim {} {} {}".format(entry["kind"], entry["path"], er))
+
+    build_temp_path = os.path.abspath(config.get("Build_temp_path", BUILD_TEMP_PATH))
+    for mount_path in get_mount_points():
+        if os.path.dirname(mount_path) == build_temp_path and mount_path not in live_paths and \
+                any(os.path.basename(mount_path).startswith(prefix) for prefix in BUILD_TEMP_PREFIXES):
+            try:
+                unmount_stale_mount(mount_path)
+                summary["mounts"] += 1
+            except Exception as er:
+                print("Failed to unmount {} {}".format(mount_path, er))
+    for path in get_stale_build_paths(config, live_paths):
+        shutil.rmtree(path, ignore_errors=True)
+        summary["folders"] += 1
+
+    cache_path = config.get("ISO_cache_path", ISO_CACHE_PATH)
+    if os.path.isdir(cache_path):
+        summary["folders"] += reclaim_partial_extractions(cache_path)
+        summary["folders"] += reclaim_stale_extractions(cache_path, config["HTTP_file_path"])
+
+    summary["evicted_bytes"] = evict_artifacts(config) or 0
+    if any(summary.values()):
+        print("Reclaimed {mounts} stale mounts, {folders} stale folders and {evicted_bytes} bytes of artifacts".format(**summary))
+    return summary
@@ -0,0 +1,168 @@
+# (C) Copyright (2018,2021) Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import fcntl
+import json
+import os
+import random
+import threading
+import time
+from logger import *
+
+# Deployment phases waited for by wait_for_os_deployment_to_complete
+POLLING_PHASES = ["post", "install", "final_reboot"]
+
+# Default polling of each phase: first interval and maximum interval in seconds, backoff factor and jitter ratio
+POLLING_DEFAULTS = {
+    "post"          :   {"initial_interval": 15, "max_interval": 60, "backoff": 1.5, "jitter": 0.2},
+    "install"       :   {"initial_interval": 30, "max_interval": 120, "backoff": 1.5, "jitter": 0.2},
+    "final_reboot"  :   {"initial_interval": 15, "max_interval": 60, "backoff": 1.5, "jitter": 0.2}
+}
+
+PHASE_HISTORY_PATH = "/tmp/os_deployment_phase_history.json"
+# Weight of the latest duration in the recorded average of a phase
+PHASE_HISTORY_WEIGHT = 0.3
+PHASE_HISTORY_LOCK = threading.Lock()
+
+
+class PollingPolicy(object):
+    """Interval between two reads of the server POST state during a deployment phase.
+
+    The first polls are fast and the interval then grows exponentially up to max_interval. When the
+    duration of the phase is known from the previous deployments of the same server model, the policy
+    sleeps until the expected end of the phase and polls fast from there. A random jitter spreads the
+    polls of the servers deployed together, and no interval goes past the deadline of the phase.
+    """
+
+    def __init__(self, phase, initial_interval=60, max_interval=60, backoff=1, jitter=0, expected_seconds=None):
+        self.phase = phase
+        self.initial_interval = initial_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.jitter = jitter
+        self.expected_seconds = expected_seconds
+        self.start_time = None
+        self.deadline = None
+        self.attempts = 0
+        self.duration = None
+
+    def start(self, timeout):
+        """Starts the phase
+
+        Arguments:
+            timeout {int} -- timeout of the phase in minutes
+        """
+        self.start_time = time.time()
+        self.deadline = self.start_time + timeout * 60
+        self.attempts = 0
+        self.duration = None
+
+    def expired(self):
+        return time.time() >= self.deadline
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def complete(self):
+        """Records the duration of the phase once it has completed"""
+        self.duration = self.elapsed()
+
+    def next_interval(self):
+        """Returns the time to wait in seconds before the next poll"""
+        elapsed = self.elapsed()
+        if self.expected_seconds and elapsed + self.initial_interval < self.expected_seconds:
+            # Wake up at the expected end of the phase
+            interval = min(self.max_interval, self.expected_seconds - elapsed)
+        else:
+            interval = min(self.max_interval, self.initial_interval * self.backoff ** self.attempts)
+            self.attempts += 1
+        interval *= random.uniform(1 - self.jitter, 1 + self.jitter)
+        return max(1, min(interval, self.deadline - time.time()))
+
+
+def get_polling_policies(config=None, server_model=None):
+    """This function is to create the polling policy of each deployment phase
+
+    Keyword Arguments:
+        config {dictionary}   -- Config details, the optional Polling_policy value overrides the POLLING_DEFAULTS of
+                                 each phase, e.g. {"install": {"max_interval": 180}} (default: {None})
+        server_model {string} -- server model, the phases poll near the durations recorded for this model (default: {None})
+
+    Returns:
+        dictionary -- polling policy of each phase
+    """
+    config = config or {}
+    history = load_phase_history(config).get(server_model, {}) if server_model else {}
+    overrides = config.get("Polling_policy", {})
+    policies = {}
+    for phase in POLLING_PHASES:
+        settings = dict(POLLING_DEFAULTS[phase])
+        settings.update(overrides.get(phase, {}))
+        policies[phase] = PollingPolicy(phase, expected_seconds=history.get(phase), **settings)
+    return policies
+
+
+def get_phase_history_path(config):
+    return config.get("Phase_history_path", PHASE_HISTORY_PATH)
+
+
+def load_phase_history(config):
+    """This function is to read the phase durations recorded by the previous deployments
+
+    Arguments:
+        config {dictionary} -- Config details, the optional Phase_history_path value sets the history file
+
+    Returns:
+        dictionary -- average duration in seconds of each phase, keyed by server model
+    """
+    try:
+        with open(get_phase_history_path(config)) as history_file:
+            return json.load(history_file)
+    except (IOError, OSError, ValueError):
+        return {}
+
+
+def record_phase_durations(config, server_model, policies):
+    """This function is to record the duration of the completed phases of a deployment
+
+    Arguments:
+        config {dictionary}   -- Config details
+        server_model {string} -- server model
+        policies {dictionary} -- polling policy of each phase
+    """
+    durations = dict((phase, policy.duration) for phase, policy in policies.items() if policy.duration is not None)
+    if not server_model or not durations:
+        return
+    history_path = get_phase_history_path(config)
+    try:
+        with PHASE_HISTORY_LOCK, open(history_path + ".lock", "w") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            history = load_phase_history(config)
+            model_history = history.setdefault(server_model, {})
+            for phase, duration in durations.items():
+                previous = model_history.get(phase)
+                if previous:
+                    duration = previous + PHASE_HISTORY_WEIGHT * (duration - previous)
+                model_history[phase] = int(duration)
+            with open(history_path + ".tmp", "w") as history_file:
+                json.dump(history, history_file, indent=2)
+            os.rename(history_path + ".tmp", history_path)
+    except (IOError, OSError) as e:
+        log_info("Failed to record the phase durations in {} {}".format(history_path, e))
@@ -2,6 +2,9 @@ import sys
 import json
 import time
 from deploy import image_deployment
+from deploy import deploy_fleet
+from deploy import snapshot_fleet_state
+from deploy import format_fleet_state
 
 def image_deployment_(server, config):
     """
@@ -12,6 +15,24 @@ def image_deployment_(server, config):
     """
     return image_deployment(server, config)
 
+def deploy_fleet_(servers, config):
+    """
+    This function is to call deploy_fleet function
+    Arguments
+        servers {list}: details of all the servers
+        config {dict}: configuration details 
+    """
+    return json.dumps(deploy_fleet(servers, config))
+
+def snapshot_fleet_state_(servers, config=None):
+    """
+    This function is to call snapshot_fleet_state function
+    Arguments
+        servers {list}: details of all the servers
+        config {dict}: configuration details 
+    """
+    return format_fleet_state(snapshot_fleet_state(servers))
+
 assert len(
     sys.argv) == 3, "This script takes in exactly two arguments, argument 1: function anme, argument 2: JSON string of arguments to the function."
 function_name = str(sys.argv[1])
@@ -19,5 +40,9 @@ arguments = json.loads(sys.argv[2])
 
 if function_name == 'image_deployment_':
     print(image_deployment_(**arguments))
+elif function_name == 'deploy_fleet_':
+    print(deploy_fleet_(**arguments))
+elif function_name == 'snapshot_fleet_state_':
+    print(snapshot_fleet_state_(**arguments))
 else:
     print('Unknown function name {}'.format(function_name))
@@ -20,10 +20,25 @@
 # THE SOFTWARE.
 ###
 
+import atexit
 import json
+import os
+import threading
 from redfish import AuthMethod, redfish_logger, RedfishClient
 from logger import *
 
+# Message registries are identical on all the iLOs running the same firmware, they are kept on disk
+# and in memory keyed by registry prefix and version (e.g. Base.1.4) and only fetched to decode an error
+REGISTRY_CACHE_PATH = "/tmp/redfish_registry_cache/"
+MESSAGE_REGISTRIES = {}
+MESSAGE_REGISTRY_LOCKS = {}
+MESSAGE_REGISTRIES_LOCK = threading.Lock()
+
+# Sessions shared by all the operations of the run, keyed by iLO address and credentials
+REDFISH_SESSIONS = {}
+REDFISH_SESSION_LOCKS = {}
+REDFISH_SESSIONS_LOCK = threading.Lock()
+
 
 class RedfishObject(object):
     def __init__(self, host, login_account, login_password):
@@ -35,37 +50,170 @@ class RedfishObject(object):
         except:
             raise
         self.redfish_client.login(auth=AuthMethod.SESSION)
-        self.SYSTEMS_RESOURCES = self.ex1_get_resource_directory()
-        self.MESSAGE_REGISTRIES = self.ex2_get_base_registry()
+        self.login_lock = threading.Lock()
+        self.pooled = False
+        # Login is the only request sent here, the resource directory is fetched on first use
+        self.uri_cache = {}
+        self.resource_directory = None
+        self.resource_directory_loaded = False
+
+    @property
+    def SYSTEMS_RESOURCES(self):
+        self.load_resource_directory()
+        return self.resource_directory
+
+    def load_resource_directory(self):
+        if not self.resource_directory_loaded:
+            self.resource_directory = self.ex1_get_resource_directory()
+            self.resource_directory_loaded = True
+            self.index_resource_directory()
 
     def delete_obj(self):
+        # Pooled sessions are kept for the next operations on the iLO and logged out at exit
+        if self.pooled:
+            return
+        self.logout()
+
+    def logout(self):
         try:
             self.redfish_client.logout()
         except AttributeError as excp:
             pass
 
-    def search_for_type(self, type):
-        instances = []
+    def relogin(self, expired_session_key):
+        """Opens a new session once the iLO has expired the session, a single login is sent when
+        several threads find the session expired at the same time"""
+        with self.login_lock:
+            if self.redfish_client.session_key == expired_session_key:
+                log_info("iLO session expired, logging in again to " + str(self.redfish_client.base_url))
+                self.redfish_client.login(auth=AuthMethod.SESSION)
+
+    def send_request(self, send):
+        """Sends a request, logging in again and resending it when the session has expired (401)"""
+        session_key = self.redfish_client.session_key
+        response = send()
+        if response.status == 401:
+            self.relogin(session_key)
+            response = send()
+        return response
 
-        for item in self.SYSTEMS_RESOURCES["resources"]:
-            foundsettings = False
+    def index_resource_directory(self):
+        """Indexes the resource directory by @odata.type and by lowercase @odata.id,
+        so that search_for_type does not rescan the directory for every instance"""
+        self.TYPE_INDEX = {}
+        self.RESOURCE_IDS = set()
+        self.search_cache = {}
+        resources = self.resource_directory["resources"] if self.resource_directory else []
 
-            if "@odata.type" in item and type.lower() in item["@odata.type"].lower():
-                for entry in self.SYSTEMS_RESOURCES["resources"]:
-                    if (item["@odata.id"] + "/settings/").lower() == (entry["@odata.id"]).lower():
-                        foundsettings = True
+        for item in resources:
+            self.RESOURCE_IDS.add(item["@odata.id"].lower())
+            if "@odata.type" in item:
+                self.TYPE_INDEX.setdefault(item["@odata.type"].lower(), []).append(item)
 
-                if not foundsettings:
+    def search_for_type(self, type):
+        self.load_resource_directory()
+        if type in self.search_cache:
+            return self.search_cache[type]
+        instances = []
+
+        for odata_type, items in self.TYPE_INDEX.items():
+            if type.lower() not in odata_type:
+                continue
+            for item in items:
+                if (item["@odata.id"] + "/settings/").lower() not in self.RESOURCE_IDS:
                     instances.append(item)
 
         if not instances:
             log_info("Resource or feature is not supported on this system:" + type)
+        self.search_cache[type] = instances
         return instances
 
-    def error_handler(self, response):
-        if not self.MESSAGE_REGISTRIES:
-            log_info("ERROR: No message registries found.")
+    def get_uri(self, name):
+        """Returns the URI of a resource of the server, it is resolved once per session.
+        name is one of system, manager, dvd_media (DVD virtual media slot) or reset_target (reset action target)"""
+        if name not in self.uri_cache:
+            uri = self.resolve_uri(name)
+            if not uri:
+                log_info("Resource or feature is not supported on this system:" + name)
+                return None
+            self.uri_cache[name] = uri
+        return self.uri_cache[name]
+
+    def resolve_uri(self, name):
+        if name == "system":
+            return self.get_first_member("/redfish/v1/Systems/", "ComputerSystem.")
+        elif name == "manager":
+            return self.get_first_member("/redfish/v1/Managers/", "Manager.")
+        elif name == "dvd_media":
+            manager_uri = self.get_uri("manager")
+            if not manager_uri:
+                return None
+            rsp = self.redfish_get(manager_uri)
+            rsp = self.redfish_get(rsp.dict["VirtualMedia"]["@odata.id"])
+            for vmlink in rsp.dict["Members"]:
+                response = self.redfish_get(vmlink["@odata.id"])
+                if response.status == 200 and "DVD" in response.dict["MediaTypes"]:
+                    return vmlink["@odata.id"]
+                elif response.status != 200:
+                    self.error_handler(response)
+        elif name == "reset_target":
+            system_uri = self.get_uri("system")
+            if not system_uri:
+                return None
+            rsp = self.redfish_get(system_uri)
+            return rsp.dict["Actions"]["#ComputerSystem.Reset"]["target"]
+        return None
+
+    def get_first_member(self, collection_uri, type):
+        """Returns the URI of the first member of a collection, read from the resource directory when the collection is not available"""
+        response = self.redfish_get(collection_uri)
+        if response.status == 200 and response.dict.get("Members"):
+            return response.dict["Members"][0]["@odata.id"]
+        instances = self.search_for_type(type)
+        return instances[0]["@odata.id"] if instances else None
 
+    def invalidate_uri_cache(self):
+        self.uri_cache = {}
+
+    def supports_select_query(self):
+        """Returns True when the iLO supports the $select query parameter, read once per session from the service root"""
+        if "select_query" not in self.uri_cache:
+            response = self.redfish_get("/redfish/v1/")
+            features = response.dict.get("ProtocolFeaturesSupported", {}) if response.status == 200 else {}
+            self.uri_cache["select_query"] = bool(features.get("SelectQuery"))
+        return self.uri_cache["select_query"]
+
+    def request_resource(self, method, name, request_body=None, select=None):
+        """Sends a GET, PATCH or POST request to a resource of the server resolved by get_uri.
+        A GET only returns the select properties when the iLO supports $select.
+        The resolved URIs are dropped and the request is sent again when the iLO no longer knows the URI (404)"""
+        for attempt in range(2):
+            uri = self.get_uri(name)
+            if not uri:
+                return None
+            if method == "GET":
+                if select and self.supports_select_query():
+                    uri = uri + "?$select=" + ",".join(select)
+                response = self.redfish_get(uri)
+            elif method == "PATCH":
+                response = self.redfish_patch(uri, request_body)
+            else:
+                response = self.redfish_post(uri, request_body)
+            if response.status != 404:
+                break
+            self.invalidate_uri_cache()
+        return response
+
+    def get_resource(self, name, select=None):
+        return self.request_resource("GET", name, select=select)
+
+    def patch_resource(self, name, request_body):
+        return self.request_resource("PATCH", name, request_body)
+
+    def post_resource(self, name, request_body):
+        return self.request_resource("POST", name, request_body)
+
+    def error_handler(self, response):
         try:
             message = json.loads(response.text)
             newmessage = message["error"]["@Message.ExtendedInfo"][0]["MessageId"].split(".")
@@ -73,23 +221,73 @@ class RedfishObject(object):
             log_info("No extended error information returned by iLO.")
             return
 
-        for err_mesg in self.MESSAGE_REGISTRIES:
-            if err_mesg != newmessage[0]:
+        registry = self.get_message_registry(newmessage[0], ".".join(newmessage[1:3]))
+        if not registry:
+            log_info("ERROR: No message registries found.")
+            return
+
+        if newmessage[3] in registry:
+            log_info("iLO return code " + str(message["error"]["@Message.ExtendedInfo"][0]) +
+                     " : " + str(registry[newmessage[3]]["Description"]))
+
+    def get_message_registry(self, registry_prefix, registry_version):
+        """Returns the messages of a registry, from memory, from the on-disk cache or from the iLO.
+        Only the threads decoding an error of the same registry wait while it is fetched from an iLO"""
+        registry_key = registry_prefix + "." + registry_version
+        with MESSAGE_REGISTRIES_LOCK:
+            registry_lock = MESSAGE_REGISTRY_LOCKS.setdefault(registry_key, threading.Lock())
+        with registry_lock:
+            if registry_key not in MESSAGE_REGISTRIES:
+                messages = load_cached_registry(registry_key)
+                if messages is None:
+                    registries = self.get_message_registries(registry_prefix, registry_key)
+                    # The registries of the other versions are kept under their own version
+                    for key, fetched_messages in registries.items():
+                        save_cached_registry(key, fetched_messages)
+                    messages = registries.get(registry_key)
+                    if messages is None:
+                        log_info("Message registry " + registry_key + " not found on the iLO")
+                MESSAGE_REGISTRIES[registry_key] = messages
+            return MESSAGE_REGISTRIES[registry_key]
+
+    def get_message_registries(self, registry_prefix, registry_key=None):
+        """Returns the messages of the registries of a prefix available on the iLO, keyed by prefix and version as per
+        get_registry_key. When registry_key is given, the registries of the other versions are not downloaded."""
+        response = self.redfish_get("/redfish/v1/Registries/")
+        registries = {}
+        if response.status != 200:
+            return registries
+
+        for entry in response.dict["Members"]:
+            name = entry["@odata.id"].rstrip("/").split("/")[-1]
+            if name != registry_prefix and not name.startswith(registry_prefix + "."):
                 continue
-            else:
-                for err_entry in self.MESSAGE_REGISTRIES[err_mesg]:
-                    if err_entry == newmessage[3]:
-                        log_info("iLO return code " + str(message["error"]["@Message.ExtendedInfo"][0]) +
-                                 " : " + str(self.MESSAGE_REGISTRIES[err_mesg][err_entry]["Description"]))
+            registry = self.redfish_get(entry["@odata.id"])
+            if registry.status != 200:
+                continue
+            # The registry file resource names the registry it describes, e.g. Base.1.4.0
+            if registry_key and registry.dict.get("Registry") and \
+                    get_registry_key(registry_prefix, registry.dict["Registry"][len(registry_prefix) + 1:]) != registry_key:
+                continue
+
+            for location in registry.dict.get("Location", []):
+                uri = location["Uri"]["extref"] if "extref" in location["Uri"] else location["Uri"]
+                reg_resp = self.redfish_get(uri)
+                if reg_resp.status != 200 or reg_resp.dict.get("RegistryPrefix") != registry_prefix:
+                    log_info("\t" + registry_prefix + " not found at " + uri + "\n")
+                    continue
+                version = reg_resp.dict.get("RegistryVersion") or reg_resp.dict.get("Id", "")[len(registry_prefix) + 1:]
+                registries[get_registry_key(registry_prefix, version)] = reg_resp.dict["Messages"]
+        return registries
 
     def redfish_get(self, suburi, args=None, headers=None):
         """REDFISH GET"""
-        return self.redfish_client.get(path=suburi)
+        return self.send_request(lambda: self.redfish_client.get(path=suburi))
 
     def redfish_patch(self, suburi, request_body, args=None, headers=None):
         """REDFISH PATCH"""
         log_debug("PATCH " + str(request_body) + " to " + suburi)
-        response = self.redfish_client.patch(path=suburi, body=request_body)
+        response = self.send_request(lambda: self.redfish_client.patch(path=suburi, body=request_body))
         log_debug("PATCH response: " + str(response.status))
 
         return response
@@ -97,7 +295,7 @@ class RedfishObject(object):
     def redfish_put(self, suburi, request_body, args=None, headers=None):
         """REDFISH PUT"""
         log_debug("PUT " + str(request_body) + " to " + suburi)
-        response = self.redfish_client.put(path=suburi, body=request_body)
+        response = self.send_request(lambda: self.redfish_client.put(path=suburi, body=request_body))
         log_info("PUT response: " + str(response.status))
 
         return response
@@ -105,7 +303,7 @@ class RedfishObject(object):
     def redfish_post(self, suburi, request_body, args=None, headers=None):
         """REDFISH POST"""
         log_info("POST " + str(request_body) + " to " + suburi)
-        response = self.redfish_client.post(path=suburi, body=request_body)
+        response = self.send_request(lambda: self.redfish_client.post(path=suburi, body=request_body))
         log_info("POST response: " + str(response.status))
 
         return response
@@ -113,7 +311,7 @@ class RedfishObject(object):
     def redfish_delete(self, suburi, headers=None):
         """REDFISH DELETE"""
         log_info("DELETE " + suburi)
-        response = self.redfish_client.delete(path=suburi)
+        response = self.send_request(lambda: self.redfish_client.delete(path=suburi))
         log_info("DELETE response: " + str(response.status))
 
         return response
@@ -155,3 +353,59 @@ class RedfishObject(object):
                                             " not found at " + location + "\n")
 
         return messages
+
+
+def get_registry_key(registry_prefix, registry_version):
+    """Returns the key of a registry from its prefix and version, e.g. Base and 1.4.0 give Base.1.4, the major and
+    minor versions of the MessageIds"""
+    return registry_prefix + "." + ".".join(registry_version.split(".")[:2])
+
+
+def get_cached_registry_path(registry_key):
+    return os.path.join(REGISTRY_CACHE_PATH, registry_key + ".json")
+
+
+def load_cached_registry(registry_key):
+    try:
+        with open(get_cached_registry_path(registry_key)) as registry_file:
+            return json.load(registry_file)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save_cached_registry(registry_key, messages):
+    registry_path = get_cached_registry_path(registry_key)
+    temp_path = "{}.{}.tmp".format(registry_path, os.getpid())
+    try:
+        if not os.path.isdir(REGISTRY_CACHE_PATH):
+            os.makedirs(REGISTRY_CACHE_PATH, exist_ok=True)
+        with open(temp_path, "w") as registry_file:
+            json.dump(messages, registry_file)
+        os.rename(temp_path, registry_path)
+    except (IOError, OSError) as excp:
+        log_info("Failed to cache the message registry " + registry_key + ": " + str(excp))
+
+
+def get_redfish_session(host, login_account, login_password):
+    """Returns the RedfishObject of the iLO, the session and its HTTPS connections are shared by
+    all the operations of the run and logged out at exit"""
+    key = (host, login_account, login_password)
+    with REDFISH_SESSIONS_LOCK:
+        session_lock = REDFISH_SESSION_LOCKS.setdefault(key, threading.Lock())
+    with session_lock:
+        if key not in REDFISH_SESSIONS:
+            redfish_obj = RedfishObject(host, login_account, login_password)
+            redfish_obj.pooled = True
+            REDFISH_SESSIONS[key] = redfish_obj
+        return REDFISH_SESSIONS[key]
+
+
+def logout_redfish_sessions():
+    with REDFISH_SESSIONS_LOCK:
+        sessions = list(REDFISH_SESSIONS.values())
+        REDFISH_SESSIONS.clear()
+    for redfish_obj in sessions:
+        redfish_obj.logout()
+
+
+atexit.register(logout_redfish_sessions)
@@ -33,33 +33,16 @@ from datetime import timedelta
 
 from ilo_operations import *
 from image_operations import *
+from template_operations import *
+from boot_config_operations import *
+from iso_patch_operations import *
 
 import pdb
 
-def run_cmd_on_shell(cmd):
-    """
-    This function executes command on command prompt.
-    It will provide stdout, std err.
-    Return: It will return stdout and stderr of input cmd command for this function.
-    """
-
-    try:
-        # print("cwd: {0}".format(os.getcwd()))
-        # This will form executing command based on stdout and stderr & will execute on shell
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-
-        # This will execute the command/script on shell
-        out, err = p.communicate()
+# Files of the RHEL8/CentOS8 ISO image which are modified for each server, mkisofs rewrites the boot info table of isolinux.bin
+RHEL8_BOOT_FILES = ["EFI/BOOT/grub.cfg", "isolinux/isolinux.cfg", "isolinux/isolinux.bin"]
 
-        # Converting "bytes" type to "str" type
-        out1, err1 = str(out,'utf-8'), str(err, 'utf-8')
-    except Exception as run_except:
-        print("The exception '{}' occurred during execution of the command '{}'".format(run_except, cmd))
-
-    return out1, err1
-
-
-def create_custom_iso_image_redhat8(os_type, server, config, kickstart_file):
+def create_custom_iso_image_redhat8(os_type, server, config, kickstart_file, kickstart_url=None):
     """This is the primary function is to create a custom Red Hat Enterprise Linux ISO image for each of the server. 
     It triggers the functions to create custom kickstart files, mounts the RHEL OS image to the installer machine, 
     copies the contents, updates the custom kickstart file location and rebundles it into a custom RHEL image for each of the server. 
@@ -70,6 +53,10 @@ def create_custom_iso_image_redhat8(os_type, server, config, kickstart_file):
         config {string}                       -- OneView, web server and OS details as per the input_files/config.json
         kickstart_file {string}               -- Path of the base kickstart file for ESXi operating system
 
+    Keyword Arguments:
+        kickstart_url {string}                -- URL the installer fetches its kickstart file from. When given, a shared image
+                                                 without kickstart file is created for all the servers (default: {None})
+
     Returns:
         Boolean -- returns True upon successful creation of custom os image, return False on failure of creation of custom os image
     """
@@ -87,7 +74,7 @@ def create_custom_iso_image_redhat8(os_type, server, config, kickstart_file):
 
     print("Creating modified installation file for RHEL Installation")
     image_url = config["HTTP_server_base_url"] + rhel_iso_filename
-    file_presence = is_iso_file_present(image_url)
+    file_presence = is_iso_file_present(image_url, config)
     if not file_presence:
         print("ISO file is not present in the given http location. Please check the http location and then try again.")
         return False
@@ -100,69 +87,63 @@ def create_custom_iso_image_redhat8(os_type, server, config, kickstart_file):
             filepath = base_iso_image_path + rhel_iso_filename
             server_serial_number = server["Server_serial_number"]
 
-            temppath = "/tmp/" + "redhatmount_" + server_serial_number + "/"
-            mount_path = "/tmp/" + "redhatorig_" + server_serial_number
-
-            kickstart_filepath = temppath + "ks.cfg"
-
-            mount_proc_id = mount_iso_image(filepath, mount_path)
-            if mount_proc_id == 0:
-                print("Successfully mounted the image {}".format(rhel_iso_filename))
+            if kickstart_url:
+                temppath = create_build_temp_path(config, "redhatmount_shared_" + os_type + "_")
+                destination_filename = get_shared_image_name(os_type, rhel_iso_filename)
             else:
-                print("Attempting to unmount the previously mounted image")
-                umount_id = unmount_iso_image(mount_path)
-                mount_proc_id = mount_iso_image(filepath, mount_path)
-                if mount_proc_id == 0:
-                    print("Successfully unmounted the previously mounted image")                
-                else:
-                    print("Failed to mount the image {}".format(rhel_iso_filename))
-                    return False
+                temppath = create_build_temp_path(config, "redhatmount_" + server_serial_number + "_")
+                destination_filename = get_custom_image_name(os_type, server_serial_number)
 
-            # Create dot files
-            run_cmd_on_shell("shopt -s dotglob")
+            kickstart_filepath = temppath + "ks.cfg"
 
-            copy_iso_contents(mount_path, temppath)
+            build_mode = get_iso_build_mode(filepath, config)
+            if not prepare_iso_tree_for_build(filepath, temppath, RHEL8_BOOT_FILES, config, build_mode):
+                print("Failed to prepare the contents of the image {}".format(rhel_iso_filename))
+                delete_temp_folder(temppath)
+                return False
 
             # Confirm the LABEL of the DVD iso
-            run_cmd_on_shell("blkid {}".format(filepath))
-            #run_cmd_on_shell("blkid /usr/share/nginx/html/rhel-8.1-x86_64-dvd.iso")
+            run_command(["blkid", filepath])
 
-            #Encrypting user password
-            host_password = server["Host_Password"]
-            enc_password = crypt.crypt(host_password, salt='lol')
-            server.update(Host_Password = enc_password)
-
-            kickstart_status  = create_kickstart_file_for_redhat(kickstart_filepath, kickstart_file, server)
+            if kickstart_url:
+                # The kickstart file is served over HTTP, keyed by the serial number the installer sends
+                kickstart_status = True
+                ks_boot_option = "inst.ks={} inst.ks.sendsn".format(kickstart_url)
+            else:
+                #Encrypting user password
+                host_password = server["Host_Password"]
+                enc_password = crypt.crypt(host_password, salt='lol')
+                server.update(Host_Password = enc_password)
+
+                kickstart_status  = create_kickstart_file_for_redhat(kickstart_filepath, kickstart_file, server)
+                kickstart_status = kickstart_status and os.path.isfile(kickstart_filepath)
+                ks_boot_option = "inst.ks=cdrom:/ks.cfg"
             #pdb.set_trace() 
-            if(kickstart_status and os.path.isfile(kickstart_filepath)):
+            if kickstart_status:
                 #redhat_label = update_ks_file_location_redhat_iso_efi(temppath + "EFI/BOOT/")
                 #redhat_label = redhat_label.replace("\\x20"," ")
                 #print(redhat_label)
-                redhat_label = update_grub_file_for_efi_boot(temppath, os_type)
+                redhat_label = update_grub_file_for_efi_boot(temppath, os_type, ks_boot_option)
                 # update_ks_file_location_redhat_iso_legacy(temppath + "isolinux/")
-                configure_isolinux_file_to_redhat(temppath, os_type)
-                
-                destination_filename = get_custom_image_name(os_type, server_serial_number) 
+                configure_isolinux_file_to_redhat(temppath, os_type, ks_boot_option)
 
-                out, err = rebuild_iso_redhat_image(temppath, destination_folder, destination_filename, redhat_label, os_type)
-                #if recreate_iso_proc_id.returncode == 0:
-                if out == '':
+                if build_mode == "patch":
+                    iso_created = patch_custom_iso_image(filepath, temppath, destination_folder + destination_filename)
+                else:
+                    recreate_iso_proc_id = rebuild_iso_redhat_image(temppath, destination_folder, destination_filename, redhat_label, os_type)
+                    iso_created = recreate_iso_proc_id is not None and recreate_iso_proc_id.returncode == 0
+                if iso_created:
                     print("Successfully re-created the iso image for server {} after modifying the content".format(server_serial_number))
                     status = True
                 else:
                     print("Error in recreating the iso image for server {} after modifying the content".format(server_serial_number))
                     status = False
-                                
-                umount_proc_id = unmount_iso_image(mount_path)
-                if umount_proc_id == 0:
-                    print("Successfully unmounted the iso image")
-                else:
-                    print("Error in umounting the iso image")                
 
                 delete_temp_folder(temppath)
                 return status
             else:
                 print("Error in fetching custom kickstart file {}".format(kickstart_file))
+                delete_temp_folder(temppath)
                 return status
     else:
         print("File type is not supported")
@@ -179,12 +160,7 @@ def create_kickstart_file_for_redhat(kickstart_filepath, kickstart_file, server_
         server_data {dictionary} -- Custom configurations for a particular server as per the input_files/server_details.json
     """
     try:
-        with open(kickstart_filepath, "w") as file_write:
-            with open(kickstart_file, 'r') as ksfile:
-                kickstart_file_contents_for_redhat = ksfile.read()
-            file_write.write(kickstart_file_contents_for_redhat.format(server = server_data))
-        file_write.close()
-
+        render_template_file(kickstart_file, kickstart_filepath, server_data)
         print("Successfully created kickstart file for server {} ".format(server_data["Server_serial_number"]) )
         return True
     except IOError as ioer:
@@ -194,94 +170,25 @@ def create_kickstart_file_for_redhat(kickstart_filepath, kickstart_file, server_
         print("Error occurred in creating custom kickstart file {}".format(er))
         return False
 
-def update_grub_file_for_efi_boot(efi_file_path, os_type):
-    #pdb.set_trace()
-    efi_cfg_text = ""
-    flag = False
-    efi_grub_file = efi_file_path + "EFI/BOOT/grub.cfg"
-
-    with open(efi_grub_file, 'r') as fp:
-        #main_search_str = "BEGIN"
-        if os_type == "rhel8":
-            main_search_str = "menuentry 'Install Red Hat Enterprise Linux 8.1.0' --class fedora --class gnu-linux --class gnu --class os"
-            search_str = "BaseOS-x86_64"
-        elif os_type == "centos8":
-            main_search_str = "menuentry 'Install CentOS Linux 8' --class fedora --class gnu-linux --class gnu --class os"
-            search_str = "CentOS-8-1-1911-x86_64-dvd"
-        else:
-            pass
-        add_ks_str = search_str + " inst.ks=cdrom:/ks.cfg"
-        for line in fp.readlines():
-            if (main_search_str in line):
-                flag = True
-
-            if "default" in line:
-                line = line.replace("1", "0")
-
-            if "set timeout" in line:
-                line = line.replace("60", "6")
+def update_grub_file_for_efi_boot(efi_file_path, os_type, ks_boot_option="inst.ks=cdrom:/ks.cfg"):
+    """This function is to update the EFI grub.cfg file of the RHEL 8 or CentOS 8 image contents
 
-            if flag and (search_str in line):
-                line = line.replace(search_str, add_ks_str)
-                flag = False
-
-            efi_cfg_text += line
+    Arguments:
+        efi_file_path {string}  -- Path to the custom ISO image contents
+        os_type {string}        -- Type of the OS, rhel8 or centos8
+        ks_boot_option {string} -- Kernel option giving the kickstart file location
 
-    with open(efi_grub_file, 'w') as fp:
-        fp.write(efi_cfg_text)
+    Returns:
+        string -- volume label of the image, from the inst.stage2 option of the install entry
+    """
+    efi_grub_file = efi_file_path + "EFI/BOOT/grub.cfg"
+    variables = rewrite_boot_config(efi_grub_file, os_type, "efi_grub", {"ks_boot_option": ks_boot_option})
+    return variables.get("redhat_label", "").replace("\\x20", " ")
 
 
-def configure_isolinux_file_to_redhat(new_path, os_type):
-    #pdb.set_trace()
-    iso_cfg_text = ""
-    flag = False
-    ks_flag = False
+def configure_isolinux_file_to_redhat(new_path, os_type, ks_boot_option="inst.ks=cdrom:/ks.cfg"):
     iso_conf_file = new_path + "/isolinux/isolinux.cfg"
-    with open(iso_conf_file, 'r') as fp:
-        if os_type == "rhel8":
-            search_str = "BaseOS-x86_64"
-        elif os_type == "centos8":
-            search_str = "CentOS-8-1-1911-x86_64-dvd"
-        else:
-            # just passing for now
-            pass
-
-        add_ks_str = search_str + " inst.ks=cdrom:/ks.cfg"
-        for line in fp.readlines():
-            strip_line = line.strip()
-            if ("label linux" in line):
-                flag = True
-
-            if ("label check" in line):
-                flag = True
-                ks_flag = True
-
-            if flag and (search_str in line):
-                line = line.replace(search_str, add_ks_str)
-                flag = False
-                if (ks_flag):
-                    line += "\n" + "label kickstart" + "\n"
-                    if os_type == "rhel8":
-                        line += "  menu label ^Kickstart Installation of RHEL8.1" + "\n"
-                    elif os_type == "centos8":
-                        line += "  menu label ^Kickstart Installation of CentOS Linux 8" + "\n"
-                    else:
-                        pass
-
-                    line += "  kernel vmlinuz" + "\n"
-                    if os_type == "rhel8":
-                        line += "  append initrd=initrd.img inst.stage2=hd:LABEL=RHEL-8-1-0-BaseOS-x86_64 inst.ks=cdrom:/ks.cfg" + "\n" 
-                    elif os_type == "centos8":
-                        line += "  append initrd=initrd.img inst.stage2=hd:LABEL=CentOS-8-1-1911-x86_64-dvd inst.ks=cdrom:/ks.cfg" + "\n" 
-                    else:
-                        pass
-
-                    ks_flag = False
-
-            iso_cfg_text += line
-
-    with open(iso_conf_file, 'w') as fp:
-        fp.write(iso_cfg_text)
+    rewrite_boot_config(iso_conf_file, os_type, "isolinux", {"ks_boot_option": ks_boot_option})
 
 
 def update_ks_file_location_redhat_iso_legacy(temppath):
@@ -321,41 +228,25 @@ def rebuild_iso_redhat_image(temppath, custom_iso_path, iso_filename, redhat_lab
         temppath {string}           -- Path to the custom ISO image contents which needs to rebuilt
         custom_iso_path {string}    -- Path to store the resultant ISO image
         iso_filename {string}       -- Name for the resultant ISO image
+        redhat_label {string}       -- Volume label of the base ISO image, the installer finds its stage2 with it
+        os_type {string}            -- Type of the OS, rhel8 or centos8
+
+    Returns:
+        object -- completed isohybrid process, returns None on failure
     """
     try:
-        #pdb.set_trace()
-        if os_type == "rhel8":
-            custom_iso_verbose = 'RHEL-8-1-0-BaseOS-x86_64'
-        elif os_type == "centos8":
-            custom_iso_verbose = 'CentOS-8-1-1911-x86_64-dvd'
-        else:
-            pass
+        if not redhat_label:
+            print("Volume label of the {} image not found in its EFI grub.cfg file".format(os_type))
+            return None
 
         create_dir_exist(custom_iso_path)
 
         custom_iso = custom_iso_path + iso_filename
-
-        os.chdir(temppath)
-        #run_cmd_on_shell("mkisofs -o {} -b isolinux/isolinux.bin -J -R -l -c isolinux/boot.cat -no-emul-boot -boot-load-size 4 -boot-info-table -eltorito-alt-boot -e images/efiboot.img -no-emul-boot -graft-points -V {} . ".format(custom_iso, custom_iso_verbose))
-        custom_iso_creation_cmd = "mkisofs -o {} -b isolinux/isolinux.bin -J -R -l -c isolinux/boot.cat -no-emul-boot -boot-load-size 4 -boot-info-table -eltorito-alt-boot -e images/efiboot.img -no-emul-boot -graft-points -V {} . ".format(custom_iso, custom_iso_verbose)
-
-        run_cmd_on_shell(custom_iso_creation_cmd)
+        execute_linux_command(get_mkisofs_args(temppath, custom_iso, "images/efiboot.img", redhat_label))
 
         # Configure proper EFI boot
-        out, err = run_cmd_on_shell("isohybrid --uefi {}".format(custom_iso))
-
-        return out, err
-        '''
-        args = ["mkisofs", "-o", custom_iso, "-b", "isolinux/isolinux.bin", "-J" , "-R", "-l", "-c", "isolinux/boot.cat", "-no-emul-boot", "-boot-load-size", "4",
-                "-boot-info-table", "-eltorito-alt-boot", "-e", "images/efiboot.img", "-no-emul-boot","-graft-points", "-V" , redhat_label , temppath]
-        execute_linux_command(args)
-        args = ["isohybrid","--uefi",custom_iso]
-        proc = execute_linux_command(args)
-        args = ["implantisomd5", custom_iso]
-        proc = execute_linux_command(args)
-        return proc
-        '''
+        return execute_linux_command(["isohybrid", "--uefi", custom_iso])
     except CalledProcessError as subprcer:
-        print("Subprocess error occurred while rebuilding custom iso image {}".format(subprcer))
+        print("Subprocess error occurred while rebuilding custom iso image {} {}".format(subprcer, subprcer.stderr))
     except Exception as er:
         print("Error while rebuilding custom iso image {}".format(er))
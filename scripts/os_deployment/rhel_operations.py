@@ -33,8 +33,14 @@ from datetime import timedelta
 
 from ilo_operations import *
 from image_operations import *
+from template_operations import *
+from boot_config_operations import *
+from iso_patch_operations import *
 
-def create_custom_iso_image_redhat(os_type, server, config, kickstart_file):
+# Files of the RHEL7 ISO image which are modified for each server, mkisofs rewrites the boot info table of isolinux.bin
+RHEL7_BOOT_FILES = ["EFI/BOOT/grub.cfg", "isolinux/isolinux.cfg", "isolinux/isolinux.bin"]
+
+def create_custom_iso_image_redhat(os_type, server, config, kickstart_file, kickstart_url=None):
     """This is the primary function is to create a custom Red Hat Enterprise Linux ISO image for each of the server. 
     It triggers the functions to create custom kickstart files, mounts the RHEL OS image to the installer machine, 
     copies the contents, updates the custom kickstart file location and rebundles it into a custom RHEL image for each of the server. 
@@ -45,6 +51,10 @@ def create_custom_iso_image_redhat(os_type, server, config, kickstart_file):
         config {string}                       -- OneView, web server and OS details as per the input_files/config.json
         kickstart_file {string}               -- Path of the base kickstart file for ESXi operating system
 
+    Keyword Arguments:
+        kickstart_url {string}                -- URL the installer fetches its kickstart file from. When given, a shared image
+                                                 without kickstart file is created for all the servers (default: {None})
+
     Returns:
         Boolean -- returns True upon successful creation of custom os image, return False on failure of creation of custom os image
     """
@@ -60,7 +70,7 @@ def create_custom_iso_image_redhat(os_type, server, config, kickstart_file):
 
     print("Creating modified installation file for RHEL Installation")
     image_url = config["HTTP_server_base_url"] + rhel_iso_filename
-    file_presence = is_iso_file_present(image_url)
+    file_presence = is_iso_file_present(image_url, config)
     if not file_presence:
         print("ISO file is not present in the given http location. Please check the http location and then try again.")
         return False
@@ -72,57 +82,56 @@ def create_custom_iso_image_redhat(os_type, server, config, kickstart_file):
             filepath = base_iso_image_path + rhel_iso_filename
             server_serial_number = server["Server_serial_number"]
 
-            temppath = "/tmp/" + "redhatmount_" + server_serial_number + "/"
-            mount_path = "/tmp/" + "redhatorig_" + server_serial_number
+            if kickstart_url:
+                temppath = create_build_temp_path(config, "redhatmount_shared_" + os_type + "_")
+                destination_filename = get_shared_image_name(os_type, rhel_iso_filename)
+            else:
+                temppath = create_build_temp_path(config, "redhatmount_" + server_serial_number + "_")
+                destination_filename = get_custom_image_name(os_type, server_serial_number)
 
             kickstart_filepath = temppath + "ks.cfg"
 
-            mount_proc_id = mount_iso_image(filepath, mount_path)
-            if mount_proc_id == 0:
-                print("Successfully mounted the image {}".format(rhel_iso_filename))
+            build_mode = get_iso_build_mode(filepath, config)
+            if not prepare_iso_tree_for_build(filepath, temppath, RHEL7_BOOT_FILES, config, build_mode):
+                print("Failed to prepare the contents of the image {}".format(rhel_iso_filename))
+                delete_temp_folder(temppath)
+                return False
+            if kickstart_url:
+                # The kickstart file is served over HTTP, keyed by the serial number the installer sends
+                kickstart_status = True
+                ks_boot_option = "inst.ks={} inst.ks.sendsn".format(kickstart_url)
             else:
-                print("Attempting to unmount the previously mounted image")
-                umount_id = unmount_iso_image(mount_path)
-                mount_proc_id = mount_iso_image(filepath, mount_path)
-                if mount_proc_id == 0:
-                    print("Successfully unmounted the previously mounted image")                
-                else:
-                    print("Failed to mount the image {}".format(rhel_iso_filename))
-                    return False
-
-            copy_iso_contents(mount_path, temppath)
-            #Encrypting user password
-            host_password = server["Host_Password"]
-            enc_password = crypt.crypt(host_password, salt='lol')
-            server.update(Host_Password = enc_password)
-            kickstart_status  = create_kickstart_file_for_redhat(kickstart_filepath, kickstart_file, server)
-            
-            if(kickstart_status and os.path.isfile(kickstart_filepath)):
-                redhat_label = update_ks_file_location_redhat_iso_efi(temppath + "EFI/BOOT/")
+                #Encrypting user password
+                host_password = server["Host_Password"]
+                enc_password = crypt.crypt(host_password, salt='lol')
+                server.update(Host_Password = enc_password)
+                kickstart_status  = create_kickstart_file_for_redhat(kickstart_filepath, kickstart_file, server)
+                kickstart_status = kickstart_status and os.path.isfile(kickstart_filepath)
+                ks_boot_option = "inst.ks=cdrom:/ks.cfg"
+
+            if kickstart_status:
+                redhat_label = update_ks_file_location_redhat_iso_efi(temppath + "EFI/BOOT/", ks_boot_option)
                 redhat_label = redhat_label.replace("\\x20"," ")
                 print(redhat_label)
-                update_ks_file_location_redhat_iso_legacy(temppath + "isolinux/")
-                
-                destination_filename = get_custom_image_name(os_type, server_serial_number) 
+                update_ks_file_location_redhat_iso_legacy(temppath + "isolinux/", ks_boot_option)
                 
-                recreate_iso_proc_id = rebuild_iso_redhat_image(temppath, destination_folder, destination_filename, redhat_label)
-                if recreate_iso_proc_id.returncode == 0:
+                if build_mode == "patch":
+                    iso_created = patch_custom_iso_image(filepath, temppath, destination_folder + destination_filename)
+                else:
+                    recreate_iso_proc_id = rebuild_iso_redhat_image(temppath, destination_folder, destination_filename, redhat_label)
+                    iso_created = recreate_iso_proc_id is not None and recreate_iso_proc_id.returncode == 0
+                if iso_created:
                     print("Successfully re-created the iso image for server {} after modifying the content".format(server_serial_number))
                     status = True
                 else:
                     print("Error in recreating the iso image for server {} after modifying the content".format(server_serial_number))
                     status = False
-                                
-                umount_proc_id = unmount_iso_image(mount_path)
-                if umount_proc_id == 0:
-                    print("Successfully unmounted the iso image")
-                else:
-                    print("Error in umounting the iso image")                
 
                 delete_temp_folder(temppath)
                 return status
             else:
                 print("Error in fetching custom kickstart file {}".format(kickstart_file))
+                delete_temp_folder(temppath)
                 return status
     else:
         print("File type is not supported")
@@ -139,12 +148,7 @@ def create_kickstart_file_for_redhat(kickstart_filepath, kickstart_file, server_
         server_data {dictionary} -- Custom configurations for a particular server as per the input_files/server_details.json
     """
     try:
- 
-        with open(kickstart_filepath, "w") as file_write:
-            with open(kickstart_file, 'r') as ksfile:
-                kickstart_file_contents_for_redhat = ksfile.read()
-            file_write.write(kickstart_file_contents_for_redhat.format(server = server_data))
-        file_write.close()
+        render_template_file(kickstart_file, kickstart_filepath, server_data)
         print("Successfully created kickstart file for server {} ".format(server_data["Server_serial_number"]) )
         return True
     except IOError as ioer:
@@ -155,41 +159,40 @@ def create_kickstart_file_for_redhat(kickstart_filepath, kickstart_file, server_
         return False
 
 
-def update_ks_file_location_redhat_iso_efi(temppath):
+def create_http_kickstart_file_for_redhat(kickstart_filepath, kickstart_file, server_data):
+    """This function is to create the kickstart file of a Red Hat Enterprise Linux node served over HTTP to the installer of a shared image
+    
+    Arguments:
+        kickstart_filepath {string} -- custom kickstart file path
+        kickstart_file {string}     -- base kickstart file path
+        server_data {dictionary}    -- Custom configurations for a particular server as per the input_files/server_details.json
+    """
+    create_dir_exist(os.path.dirname(kickstart_filepath))
+    #Encrypting user password
+    server_data = dict(server_data, Host_Password=crypt.crypt(server_data["Host_Password"], salt='lol'))
+    return create_kickstart_file_for_redhat(kickstart_filepath, kickstart_file, server_data)
+
+
+def update_ks_file_location_redhat_iso_efi(temppath, ks_boot_option="inst.ks=cdrom:/ks.cfg"):
     """This function is to update the kickstart file location in the /EFI/BOOT/grub.cfg file within the RHEL OS ISO file.
     
     Arguments:
         temppath {string}             -- Path to the custom ISO image file
         server_serial_number {string} -- server serial number
         http_url {string}             -- HTTP server base URL
+        ks_boot_option {string}       -- Kernel option giving the kickstart file location
     """
     boot_filename = temppath + "grub.cfg"
-    new_data = ""
-    redhat_label = ""
     try:
-        with open(boot_filename, "r") as file_read:
-            for line in file_read.readlines():
-                if "linuxefi" in line:
-                    str = line[line.index("LABEL=")+6:]
-                    redhat_label = str[:str.index(" ")]
-                    line = line.replace("/images/pxeboot/vmlinuz", "/images/pxeboot/vmlinuz inst.ks=cdrom:/ks.cfg")
-                if "default=" in line:
-                    line = line.replace("1", "0")
-                if "set timeout" in line:
-                    line = line.replace("60", "6")
-                new_data = new_data + line
-        file_read.close()
-        with open(boot_filename, "w") as file_write:
-            file_write.write(new_data)
-        file_write.close()
-        return redhat_label
+        variables = rewrite_boot_config(boot_filename, "rhel7", "efi_grub", {"ks_boot_option": ks_boot_option})
+        return variables.get("redhat_label", "")
     except IOError as ioer:
         print("I/O error occurred while modifying the iso img file {}".format(ioer))
     except Exception as er:
         print("Error occurred in modifying the image {}".format(er))
 
 
-def update_ks_file_location_redhat_iso_legacy(temppath):
+def update_ks_file_location_redhat_iso_legacy(temppath, ks_boot_option="inst.ks=cdrom:/ks.cfg"):
     """This function is to update the kickstart file location in the /isolinux/isolinux.cfg file within the RHEL OS ISO file.
     
     Arguments:
@@ -197,22 +200,11 @@ def update_ks_file_location_redhat_iso_legacy(temppath):
         server_serial_number {string} -- Server serial number
         http_url {string}             -- HTTP server base URL
         os_type {string}              -- Type of the OS
+        ks_boot_option {string}       -- Kernel option giving the kickstart file location
     """
     boot_filename = temppath + "isolinux.cfg"
-    new_data = ""
-    
     try:
-        with open(boot_filename, "r") as file_read:
-            for line in file_read.readlines():
-                if "initrd=initrd.img" in line:
-                    line = line.replace("append initrd=initrd.img", "append initrd=initrd.img inst.ks=cdrom:/ks.cfg")
-                if "default vesamenu.c32" in line:
-                    line = line.replace("default vesamenu.c32", "default linux")
-                new_data = new_data + line
-        file_read.close()
-        with open(boot_filename, "w") as file_write:
-            file_write.write(new_data)
-        file_write.close()
+        rewrite_boot_config(boot_filename, "rhel7", "isolinux", {"ks_boot_option": ks_boot_option})
     except IOError as ioer:
         print("I/O error occurred while modifying the iso img file: {}".format(ioer))
     except Exception as er:
@@ -231,15 +223,13 @@ def rebuild_iso_redhat_image(temppath, custom_iso_path, iso_filename, redhat_lab
         create_dir_exist(custom_iso_path)
 
         custom_iso = custom_iso_path + iso_filename
-        args = ["mkisofs", "-o", custom_iso, "-b", "isolinux/isolinux.bin", "-J" , "-R", "-l", "-c", "isolinux/boot.cat", "-no-emul-boot", "-boot-load-size", "4",
-                "-boot-info-table", "-eltorito-alt-boot", "-e", "images/efiboot.img", "-no-emul-boot","-graft-points", "-V" , redhat_label , temppath]
-        execute_linux_command(args)
+        execute_linux_command(get_mkisofs_args(temppath, custom_iso, "images/efiboot.img", redhat_label))
         args = ["isohybrid","--uefi",custom_iso]
         proc = execute_linux_command(args)
         args = ["implantisomd5", custom_iso]
         proc = execute_linux_command(args)
         return proc
     except CalledProcessError as subprcer:
-        print("Subprocess error occurred while rebuilding custom iso image {}".format(subprcer))
+        print("Subprocess error occurred while rebuilding custom iso image {} {}".format(subprcer, subprcer.stderr))
     except Exception as er:
         print("Error while rebuilding custom iso image {}".format(er))
@@ -32,6 +32,12 @@ from datetime import timedelta
 
 from ilo_operations import *
 from image_operations import *
+from template_operations import *
+from boot_config_operations import *
+from iso_patch_operations import *
+
+# Files of the SLES ISO image which are modified for each server, the ISO rebuild may rewrite the boot info table of isolinux.bin
+SLES_BOOT_FILES = ["EFI/BOOT/grub.cfg", "boot/x86_64/loader/isolinux.cfg", "boot/x86_64/loader/isolinux.bin"]
 
 def create_custom_iso_image_sles(os_type, server, config, kickstart_file):
     """This is the primary function is to create a custom SLES ISO image for each of the server. 
@@ -60,7 +66,7 @@ def create_custom_iso_image_sles(os_type, server, config, kickstart_file):
 
         print("Creating modified installation file for sles Installation")
         image_url = config["HTTP_server_base_url"] + sles_iso_filename
-        file_presence = is_iso_file_present(image_url)
+        file_presence = is_iso_file_present(image_url, config)
         if not file_presence:
             print("ISO file is not present in the given http location. Please check the http location and then try again.")
             return False
@@ -72,25 +78,15 @@ def create_custom_iso_image_sles(os_type, server, config, kickstart_file):
                 filepath = base_iso_image_path + sles_iso_filename
                 server_serial_number = server["Server_serial_number"]
 
-                temppath = "/tmp/" + "slesmount_" + server_serial_number + "/"
-                mount_path = "/tmp/" + "slesorig_" + server_serial_number
+                temppath = create_build_temp_path(config, "slesmount_" + server_serial_number + "_")
 
                 autoyast_filepath = temppath + "autoinst.xml"
 
-                mount_proc_id = mount_iso_image(filepath, mount_path)
-                if mount_proc_id == 0:
-                    print("Successfully mounted the image {}".format(sles_iso_filename))
-                else:
-                    print("Attempting to unmount the previously mounted image")
-                    umount_id = unmount_iso_image(mount_path)
-                    mount_proc_id = mount_iso_image(filepath, mount_path)
-                    if mount_proc_id == 0:
-                        print("Successfully unmounted the previously mounted image")                
-                    else:
-                        print("Failed to mount the image {}".format(sles_iso_filename))
-                        return False
-
-                copy_iso_contents(mount_path, temppath)
+                build_mode = get_iso_build_mode(filepath, config)
+                if not prepare_iso_tree_for_build(filepath, temppath, SLES_BOOT_FILES, config, build_mode):
+                    print("Failed to prepare the contents of the image {}".format(sles_iso_filename))
+                    delete_temp_folder(temppath)
+                    return False
                 autoyast_status  = create_autoyast_file_for_sles(autoyast_filepath, kickstart_file, server)
 
                 if(autoyast_status and os.path.isfile(autoyast_filepath)):
@@ -99,24 +95,23 @@ def create_custom_iso_image_sles(os_type, server, config, kickstart_file):
                     
                     destination_filename = get_custom_image_name(os_type, server_serial_number) 
                     
-                    recreate_iso_proc_id = rebuild_iso_sles_image(temppath, destination_folder, destination_filename)
-                    if recreate_iso_proc_id.returncode == 0:
+                    if build_mode == "patch":
+                        iso_created = patch_custom_iso_image(filepath, temppath, destination_folder + destination_filename)
+                    else:
+                        recreate_iso_proc_id = rebuild_iso_sles_image(temppath, destination_folder, destination_filename)
+                        iso_created = recreate_iso_proc_id is not None and recreate_iso_proc_id.returncode == 0
+                    if iso_created:
                         print("Successfully re-created the iso image for server {} after modifying the content".format(server_serial_number))
                         status = True
                     else:
                         print("Error in recreating the iso image for server {} after modifying the content".format(server_serial_number))
                         status = False
-                                    
-                    umount_proc_id = unmount_iso_image(mount_path)
-                    if umount_proc_id == 0:
-                        print("Successfully unmounted the iso image")
-                    else:
-                        print("Error in unmounting the iso image")                
 
                     delete_temp_folder(temppath)
                     return status
                 else:
                     print("Error in fetching custom kickstart file {}".format(kickstart_file))
+                    delete_temp_folder(temppath)
                     return status
         else:
             print("File type is not supported")
@@ -138,11 +133,7 @@ def create_autoyast_file_for_sles(filepath, autoyast_file, server_data):
         server_data {dictionary} -- Custom configurations for a particular server as per the input_files/server_details.json
     """
     try:
-        with open(filepath, "w") as file_write:
-            with open(autoyast_file, 'r') as ayfile:
-                autoyast_file_contents_for_sles = ayfile.read()
-            file_write.write(autoyast_file_contents_for_sles.format(server = server_data))
-        file_write.close()
+        render_template_file(autoyast_file, filepath, server_data)
         print("Successfully created kickstart file for server {} ".format(server_data["Server_serial_number"]) )
         return True
     except IOError as ioer:
@@ -162,21 +153,8 @@ def update_ks_file_location_sles_iso_efi(temppath, server_serial_number, http_ur
         os_type {string}              -- Type of operating system (currently supports sles15)        
     """
     boot_filename = temppath + "grub.cfg"
-    new_data = ""
     try:
-        with open(boot_filename, "r") as file_read:
-            for line in file_read.readlines():
-                if "linuxefi" in line:
-                    line = line.replace("linuxefi /boot/x86_64/loader/linux", "linuxefi /boot/x86_64/loader/linux autoyast=default")
-                if "timeout" in line:
-                    line = line.replace("60", "6")
-                new_data = new_data + line
-        file_read.close()
-        inst_mode = "instmode=cd\n"
-        new_data = inst_mode + new_data
-        with open(boot_filename, "w") as file_write:
-            file_write.write(new_data)
-        file_write.close()
+        rewrite_boot_config(boot_filename, os_type, "efi_grub")
     except IOError as ioer:
         print("I/O error occurred while modifying the iso img file {}".format(ioer))
     except Exception as er:
@@ -193,21 +171,8 @@ def update_ks_file_location_sles_iso_legacy(temppath, server_serial_number, http
         os_type {string}              -- Type of the OS
     """
     boot_filename = temppath + "isolinux.cfg"
-    new_data = ""
     try:
-        with open(boot_filename, "r") as file_read:
-            for line in file_read.readlines():
-                if "initrd=initrd" in line:
-                    line = line.replace("append initrd=initrd", "append initrd=initrd autoyast=default")
-                if "default harddisk" in line:
-                    line = line.replace("default harddisk", "default linux")
-                new_data = new_data + line
-        file_read.close()
-        inst_mode = "instmode=cd\n"
-        new_data = inst_mode + new_data
-        with open(boot_filename, "w") as file_write:
-            file_write.write(new_data)
-        file_write.close()
+        rewrite_boot_config(boot_filename, os_type, "isolinux")
     except IOError as ioer:
         print("I/O error occurred while modifying the iso img file: {}".format(ioer))
     except Exception as er:
@@ -231,7 +196,7 @@ def rebuild_iso_sles_image(temppath, custom_iso_path, iso_filename):
         proc = execute_linux_command(args)
         return proc
     except CalledProcessError as subprcer:
-        print("Subprocess error occurred while rebuilding custom iso image {}".format(subprcer))
+        print("Subprocess error occurred while rebuilding custom iso image {} {}".format(subprcer, subprcer.stderr))
     except Exception as er:
         print("Error while rebuilding custom iso image {}".format(er))
 
@@ -0,0 +1,169 @@
+# (C) Copyright (2018,2021) Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import re
+import string
+import threading
+
+# Server details which can be used in the kickstart templates, as per the input.yaml
+SERVER_FIELDS = ["Server_serial_number", "ILO_Address", "ILO_Username", "ILO_Password", "Hostname", "Host_Username",
+                 "Host_Password", "Host_IP", "Host_Netmask", "Host_Gateway", "Host_DNS", "Host_Search",
+                 "Bonding_Interface1", "Bonding_Interface2", "OS_type", "OS_image_name"]
+
+# Template syntaxes: "format" templates use {server[Host_IP]} placeholders (with {{ and }} for literal braces),
+# "token" templates (Ubuntu) use the bare field names, e.g. --ip=Host_IP
+TEMPLATE_SYNTAXES = ["format", "token"]
+
+FORMAT_FIELD_PATTERN = re.compile(r"^server\[(\w+)\]$")
+TOKEN_PATTERN = re.compile(r"\b(" + "|".join(sorted(SERVER_FIELDS, key=len, reverse=True)) + r")\b")
+
+# Compiled templates keyed by path and syntax, recompiled when the template file changes
+TEMPLATE_CACHE = {}
+TEMPLATE_CACHE_LOCK = threading.Lock()
+
+
+class TemplateError(Exception):
+    pass
+
+
+class KickstartTemplate(object):
+    """Kickstart template parsed once into literal text and server fields, rendered in a single pass"""
+
+    def __init__(self, template_path, segments):
+        self.template_path = template_path
+        self.segments = segments
+        self.fields = sorted(set(field for literal, field in segments if field))
+
+    def get_missing_fields(self, server_data):
+        """Returns the fields used by the template which are missing in the server details"""
+        return [field for field in self.fields if server_data.get(field) is None]
+
+    def render(self, server_data):
+        missing_fields = self.get_missing_fields(server_data)
+        if missing_fields:
+            raise TemplateError("Server {} has no value for {} used in {}".format(
+                server_data.get("Server_serial_number"), ", ".join(missing_fields), self.template_path))
+        parts = []
+        for literal, field in self.segments:
+            parts.append(literal)
+            if field:
+                parts.append(str(server_data[field]))
+        return "".join(parts)
+
+
+def compile_format_template(template_path, text):
+    segments = []
+    try:
+        parsed = list(string.Formatter().parse(text))
+    except ValueError as e:
+        raise TemplateError("Invalid template {}: {}".format(template_path, e))
+    for literal, field_name, format_spec, conversion in parsed:
+        field = None
+        if field_name is not None:
+            match = FORMAT_FIELD_PATTERN.match(field_name)
+            if not match or format_spec or conversion:
+                raise TemplateError("Invalid placeholder {{{}}} in {}".format(field_name, template_path))
+            field = match.group(1)
+            if field not in SERVER_FIELDS:
+                raise TemplateError("Unknown server field {} in {}".format(field, template_path))
+        segments.append((literal, field))
+    return segments
+
+
+def compile_token_template(template_path, text):
+    segments = []
+    position = 0
+    for match in TOKEN_PATTERN.finditer(text):
+        segments.append((text[position:match.start()], match.group(1)))
+        position = match.end()
+    segments.append((text[position:], None))
+    return segments
+
+
+def get_template(template_path, syntax="format"):
+    """This function is to get the compiled template of a base kickstart file, it is compiled once and cached
+
+    Arguments:
+        template_path {string} -- base kickstart file path
+
+    Keyword Arguments:
+        syntax {string}        -- placeholder syntax of the template, one of TEMPLATE_SYNTAXES (default: {"format"})
+
+    Returns:
+        object -- compiled template, raises TemplateError when the template is not valid
+    """
+    if syntax not in TEMPLATE_SYNTAXES:
+        raise TemplateError("Unknown template syntax {}".format(syntax))
+    file_stat = os.stat(template_path)
+    key = (os.path.realpath(template_path), syntax)
+    version = (file_stat.st_mtime_ns, file_stat.st_size)
+    with TEMPLATE_CACHE_LOCK:
+        cached = TEMPLATE_CACHE.get(key)
+        if cached and cached[0] == version:
+            return cached[1]
+    with open(template_path, "r") as template_file:
+        text = template_file.read()
+    if syntax == "format":
+        template = KickstartTemplate(template_path, compile_format_template(template_path, text))
+    else:
+        template = KickstartTemplate(template_path, compile_token_template(template_path, text))
+    with TEMPLATE_CACHE_LOCK:
+        TEMPLATE_CACHE[key] = (version, template)
+    return template
+
+
+def get_template_errors(template_path, server_data, syntax="format"):
+    """This function is to validate a template and the server details it uses, before any file is written
+
+    Arguments:
+        template_path {string}   -- base kickstart file path
+        server_data {dictionary} -- server details as per the input.yaml
+
+    Keyword Arguments:
+        syntax {string}          -- placeholder syntax of the template (default: {"format"})
+
+    Returns:
+        list -- the problems found, empty when the kickstart file of the server can be rendered
+    """
+    try:
+        template = get_template(template_path, syntax)
+    except (TemplateError, IOError, OSError) as e:
+        return [str(e)]
+    return ["Server has no value for {} used in {}".format(field, template_path) for field in template.get_missing_fields(server_data)]
+
+
+def render_template_file(template_path, output_path, server_data, syntax="format"):
+    """This function is to write the kickstart file of a server from its compiled template.
+    The file is written to a temporary file and renamed, so that it is never left half written
+
+    Arguments:
+        template_path {string}   -- base kickstart file path
+        output_path {string}     -- custom kickstart file path
+        server_data {dictionary} -- server details as per the input.yaml
+
+    Keyword Arguments:
+        syntax {string}          -- placeholder syntax of the template (default: {"format"})
+    """
+    text = get_template(template_path, syntax).render(server_data)
+    temp_path = "{}.{}.tmp".format(output_path, threading.get_ident())
+    with open(temp_path, "w") as output_file:
+        output_file.write(text)
+    os.rename(temp_path, output_path)
@@ -0,0 +1,283 @@
+# (C) Copyright 2021 Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import json
+import os
+import ssl
+import subprocess
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+
+import requests
+
+EVENT_SERVICE_URI = "/redfish/v1/EventService/"
+SSE_URI = "/redfish/v1/EventService/SSE/"
+SUBSCRIPTIONS_URI = "/redfish/v1/EventService/Subscriptions/"
+SESSIONS_URI = "/redfish/v1/SessionService/Sessions/"
+SYSTEMS_URI = "/redfish/v1/Systems/"
+SYSTEM_URI = "/redfish/v1/Systems/1/"
+
+
+def create_certificate(folder_path):
+    """Creates a self-signed certificate and its key in one PEM file, with the openssl command"""
+    key_path = os.path.join(folder_path, "fake_ilo.key")
+    certificate_path = os.path.join(folder_path, "fake_ilo.pem")
+    subprocess.check_call(["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=localhost",
+                           "-keyout", key_path, "-out", certificate_path], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    with open(key_path) as key_file, open(certificate_path, "a") as certificate_file:
+        certificate_file.write(key_file.read())
+    return certificate_path
+
+
+class FakeIloHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.0"
+
+    def send_json(self, status, body=None, headers=None):
+        data = json.dumps(body or {}).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length).decode("utf-8")) if length else {}
+
+    def is_authorized(self):
+        ilo = self.server.ilo
+        if ilo.require_session and self.headers.get("X-Auth-Token") not in ilo.sessions.values():
+            self.send_json(401)
+            return False
+        return True
+
+    def do_GET(self):
+        ilo = self.server.ilo
+        ilo.requests.append(("GET", self.path))
+        if not self.is_authorized():
+            return
+        if self.path == EVENT_SERVICE_URI:
+            body = {"ServiceEnabled": ilo.event_service_enabled, "Subscriptions": {"@odata.id": SUBSCRIPTIONS_URI}}
+            if ilo.server_sent_events:
+                body["ServerSentEventUri"] = SSE_URI
+            self.send_json(200, body)
+        elif self.path == SSE_URI and ilo.server_sent_events:
+            self.stream_events()
+        elif self.path == SYSTEMS_URI:
+            self.send_json(200, {"Members": [{"@odata.id": SYSTEM_URI}]})
+        elif self.path == SYSTEM_URI:
+            self.send_json(200, ilo.get_system())
+        else:
+            self.send_json(404)
+
+    def do_POST(self):
+        ilo = self.server.ilo
+        ilo.requests.append(("POST", self.path))
+        if self.path == SESSIONS_URI:
+            location, session_key = ilo.add_session(self.read_json())
+            if location:
+                self.send_json(201, headers={"X-Auth-Token": session_key, "Location": location})
+            else:
+                self.send_json(401)
+        elif not self.is_authorized():
+            return
+        elif self.path == SUBSCRIPTIONS_URI:
+            location = ilo.add_subscription(self.read_json())
+            self.send_json(201, headers={"Location": "https://{}:{}{}".format(ilo.host, ilo.port, location)})
+        else:
+            self.send_json(404)
+
+    def do_DELETE(self):
+        ilo = self.server.ilo
+        ilo.requests.append(("DELETE", self.path))
+        if not self.is_authorized():
+            return
+        self.send_json(200 if ilo.subscriptions.pop(self.path, None) or ilo.sessions.pop(self.path, None) else 404)
+
+    def stream_events(self):
+        """Writes the events of the iLO as Server-Sent Events until the stream is closed by either side"""
+        ilo = self.server.ilo
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        self.wfile.flush()
+        with ilo.condition:
+            sent = len(ilo.events)
+            ilo.streams += 1
+            ilo.condition.notify_all()
+        try:
+            while True:
+                with ilo.condition:
+                    while sent == len(ilo.events) and not ilo.closed:
+                        ilo.condition.wait()
+                    if ilo.closed:
+                        return
+                    events = ilo.events[sent:]
+                    sent = len(ilo.events)
+                for event in events:
+                    self.wfile.write("data: {}\n\n".format(json.dumps(event)).encode("utf-8"))
+                self.wfile.flush()
+        except (IOError, OSError):
+            pass
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ThreadingFakeIloServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeIlo(object):
+    """Local stand-in of the Redfish API of an iLO, serving the session login, the EventService, its Server-Sent
+    Events stream and push subscriptions, and the POST and power state of one server. The state is changed by the
+    tests with set_state, which emits an event on the stream and to the subscribers, or scripted with post_states,
+    the POST states returned by the next reads of the system.
+    """
+
+    def __init__(self, server_sent_events=True, event_service_enabled=True, require_session=False, certificate_path=None,
+                 post_states=None):
+        self.server_sent_events = server_sent_events
+        self.event_service_enabled = event_service_enabled
+        self.require_session = require_session
+        self.post_state = "Off"
+        self.power_state = "Off"
+        self.post_states = list(post_states or [])
+        self.events = []
+        self.subscriptions = {}
+        self.sessions = {}
+        self.logins = 0
+        self.requests = []
+        self.streams = 0
+        self.closed = False
+        self.condition = threading.Condition()
+        self.httpd = ThreadingFakeIloServer(("127.0.0.1", 0), FakeIloHandler)
+        self.httpd.ilo = self
+        self.host, self.port = self.httpd.server_address
+        self.address = "{}:{}".format(self.host, self.port)
+        self.base_url = "http://" + self.address
+        if certificate_path:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certificate_path)
+            self.httpd.socket = context.wrap_socket(self.httpd.socket, server_side=True)
+            self.base_url = "https://" + self.address
+        thread = threading.Thread(target=self.httpd.serve_forever)
+        thread.daemon = True
+        thread.start()
+
+    def close_streams(self):
+        """Ends the Server-Sent Events streams, like an iLO reset does"""
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+    def close(self):
+        self.close_streams()
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def get_system(self):
+        with self.condition:
+            if self.post_states:
+                self.post_state = self.post_states.pop(0) if len(self.post_states) > 1 else self.post_states[0]
+            return {"PowerState": self.power_state, "Oem": {"Hpe": {"PostState": self.post_state}}}
+
+    def add_session(self, credentials):
+        if credentials.get("UserName") != "admin" or credentials.get("Password") != "password":
+            return None, None
+        with self.condition:
+            self.logins += 1
+            location = SESSIONS_URI + str(self.logins) + "/"
+            self.sessions[location] = uuid.uuid4().hex
+            self.condition.notify_all()
+            return location, self.sessions[location]
+
+    def wait_for_logins(self, count=1, timeout=10):
+        with self.condition:
+            return self.condition.wait_for(lambda: self.logins >= count, timeout)
+
+    def expire_sessions(self):
+        """Drops the sessions, like the iLO does when they are idle for too long"""
+        self.sessions.clear()
+
+    def add_subscription(self, subscription):
+        location = SUBSCRIPTIONS_URI + str(len(self.subscriptions) + 1) + "/"
+        self.subscriptions[location] = subscription
+        return location
+
+    def wait_for_streams(self, count=1, timeout=10):
+        with self.condition:
+            return self.condition.wait_for(lambda: self.streams >= count, timeout)
+
+    def set_state(self, post_state, power_state="On"):
+        """Changes the state of the server and sends the matching event"""
+        event = {"Events": [{"EventType": "StatusChange", "OriginOfCondition": {"@odata.id": SYSTEM_URI},
+                             "Message": "PostState {}".format(post_state)}]}
+        with self.condition:
+            self.post_state = post_state
+            self.power_state = power_state
+            self.events.append(event)
+            self.condition.notify_all()
+        for subscription in list(self.subscriptions.values()):
+            event["Context"] = subscription.get("Context")
+            requests.post(subscription["Destination"], json=event, verify=False, timeout=10)
+
+
+class FakeResponse(object):
+    def __init__(self, response):
+        self.status = response.status_code
+        self.dict = response.json() if response.content else {}
+        self.headers = response.headers
+
+    def getheader(self, name):
+        return self.headers.get(name)
+
+
+class FakeRedfishClient(object):
+    def __init__(self, base_url):
+        self.base_url = base_url
+        self.session_key = "fake-session-key"
+
+
+class FakeRedfishObject(object):
+    """Minimal RedfishObject talking to a FakeIlo, with the calls used by event_operations"""
+
+    def __init__(self, ilo):
+        self.redfish_client = FakeRedfishClient(ilo.base_url)
+        self.errors = []
+
+    def request(self, method, uri, body=None):
+        return FakeResponse(requests.request(method, self.redfish_client.base_url + uri, json=body, timeout=10))
+
+    def redfish_get(self, uri):
+        return self.request("GET", uri)
+
+    def redfish_post(self, uri, body):
+        return self.request("POST", uri, body)
+
+    def redfish_delete(self, uri):
+        return self.request("DELETE", uri)
+
+    def error_handler(self, response):
+        self.errors.append(response.status)
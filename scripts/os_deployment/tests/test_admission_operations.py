@@ -0,0 +1,91 @@
+# (C) Copyright 2021 Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from admission_operations import *
+
+
+class AdmissionTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        with open(os.path.join(self.temp_path, "base.iso"), "wb") as iso_file:
+            iso_file.write(b"\x00" * 4096)
+        self.server = {"Server_serial_number": "SN0001", "OS_image_name": "base.iso"}
+        self.config = {"HTTP_file_path": self.temp_path + "/", "ISO_build_mode": "patch"}
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def test_build_admitted_and_released(self):
+        admission = BuildAdmissionController(max_builds_per_disk=1, min_free_bytes=0)
+        stats = []
+
+        def build(name):
+            stats.append(admission.get_stats())
+            return name
+
+        self.assertEqual(run_admitted_build(admission, self.server, self.config, build, "built"), "built")
+        self.assertEqual(stats[0]["running_builds"], 1)
+        self.assertEqual(list(stats[0]["reserved_bytes"].values()), [4096])
+        self.assertEqual(admission.get_stats(), {"queued_builds": 0, "running_builds": 0, "reserved_bytes": {}})
+        self.assertEqual(admission.get_admission("SN0001")["wait_seconds"], 0)
+        self.assertIsNone(admission.get_admission("SN0002"))
+
+    def test_build_queued_while_disk_busy(self):
+        admission = BuildAdmissionController(max_builds_per_disk=1, min_free_bytes=0)
+        started = threading.Event()
+        finish = threading.Event()
+
+        def first_build():
+            started.set()
+            finish.wait(10)
+            return True
+
+        thread = threading.Thread(target=run_admitted_build, args=(admission, self.server, self.config, first_build))
+        thread.start()
+        self.assertTrue(started.wait(10))
+        second_server = dict(self.server, Server_serial_number="SN0002")
+        threading.Timer(0.5, finish.set).start()
+        self.assertTrue(run_admitted_build(admission, second_server, self.config, lambda: True))
+        thread.join(10)
+        self.assertEqual(admission.get_admission("SN0002")["queued_builds"], 0)
+        self.assertEqual(admission.get_admission("SN0002")["running_builds"], 1)
+
+    def test_build_never_fits(self):
+        admission = BuildAdmissionController(min_free_bytes=2 ** 62)
+        builds = []
+        self.assertFalse(run_admitted_build(admission, self.server, self.config, builds.append, "built"))
+        self.assertEqual(builds, [])
+
+    def test_build_without_controller(self):
+        self.assertEqual(run_admitted_build(None, self.server, self.config, lambda: "built"), "built")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+# (C) Copyright 2021 Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import artifact_operations
+from artifact_operations import *
+
+
+class ArtifactKeyTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.path = os.environ["PATH"]
+        os.environ["PATH"] = self.temp_path + os.pathsep + self.path
+        artifact_operations.TOOL_VERSIONS.clear()
+
+    def tearDown(self):
+        os.environ["PATH"] = self.path
+        artifact_operations.TOOL_VERSIONS.clear()
+        shutil.rmtree(self.temp_path)
+
+    def add_tool(self, name, script):
+        tool_path = os.path.join(self.temp_path, name)
+        with open(tool_path, "w") as tool_file:
+            tool_file.write("#!/bin/sh\n" + script + "\n")
+        os.chmod(tool_path, os.stat(tool_path).st_mode | stat.S_IXUSR)
+
+    def test_tool_version(self):
+        self.add_tool("fake-mkisofs", 'echo "mkisofs 2.01.01a80"\necho "Copyright"')
+        self.assertEqual(get_tool_version("fake-mkisofs"), "mkisofs 2.01.01a80")
+
+    def test_tool_without_version_option(self):
+        # Like isohybrid, the usage is printed and the command fails
+        self.add_tool("fake-isohybrid", 'echo "isohybrid: unrecognized option --version" >&2\nexit 1')
+        self.assertEqual(get_tool_version("fake-isohybrid"), "")
+        self.assertEqual(get_tool_version("fake-not-installed"), "")
+
+    def test_builder_modules_in_inputs(self):
+        iso_filepath = os.path.join(self.temp_path, "base.iso")
+        open(iso_filepath, "wb").close()
+        builders = get_image_build_inputs("rhel8", iso_filepath, {})["builders"]
+        self.assertEqual(sorted(builders), sorted(ARTIFACT_BUILDER_MODULES))
+        self.assertTrue(all(len(digest) == 64 for digest in builders.values()))
+
+
+if __name__ == "__main__":
+    unittest.main()
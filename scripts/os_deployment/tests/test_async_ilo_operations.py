@@ -0,0 +1,144 @@
+# (C) Copyright 2021 Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import unittest
+
+import aiohttp
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from async_ilo_operations import *
+from fake_ilo import FakeIlo, SESSIONS_URI, create_certificate
+
+# Poll every second, the shortest interval of a PollingPolicy
+FAST_POLLING = {"Polling_policy": dict((phase, {"initial_interval": 1, "max_interval": 1, "jitter": 0}) for phase in POLLING_PHASES)}
+
+# POST states read by a deployment: POST completes (read twice), the installer reboots, the installed OS completes POST
+DEPLOYMENT_POST_STATES = ["FinishedPost", "FinishedPost", "InPost", "FinishedPost"]
+
+
+def get_server(ilo, serial_number="SN0001", password="password"):
+    return {"ILO_Address": ilo.address, "ILO_Username": "admin", "ILO_Password": password, "Server_serial_number": serial_number}
+
+
+@unittest.skipUnless(shutil.which("openssl"), "openssl is needed to create the fake iLO certificate")
+class AsyncIloOperationsTest(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        cls.temp_path = tempfile.mkdtemp()
+        cls.certificate_path = create_certificate(cls.temp_path)
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.temp_path)
+
+    def create_ilo(self, post_states):
+        ilo = FakeIlo(require_session=True, certificate_path=self.certificate_path, post_states=post_states)
+        self.addCleanup(ilo.close)
+        return ilo
+
+    def test_wait_loop_deploys_servers_concurrently(self):
+        ilos = [self.create_ilo(DEPLOYMENT_POST_STATES) for _ in range(3)]
+        wait_loop = AsyncWaitLoop(FAST_POLLING)
+        self.addCleanup(wait_loop.close)
+        outcomes = {}
+        done = threading.Event()
+
+        def callback(serial_number):
+            def set_outcome(is_complete):
+                outcomes[serial_number] = is_complete
+                if len(outcomes) == len(ilos):
+                    done.set()
+            return set_outcome
+
+        futures = [wait_loop.submit(get_server(ilo, "SN{}".format(index)), get_polling_policies(FAST_POLLING), callback("SN{}".format(index)))
+                   for index, ilo in enumerate(ilos)]
+        # Each deployment takes about 8 seconds (3 polls and 2 POST confirmations), together as well
+        self.assertTrue(done.wait(20))
+        self.assertEqual([future.result() for future in futures], [True] * 3)
+        self.assertEqual(outcomes, {"SN0": True, "SN1": True, "SN2": True})
+        for ilo in ilos:
+            # Logged out once the wait is over
+            self.assertEqual(ilo.logins, 1)
+            self.assertEqual(ilo.sessions, {})
+
+    def test_wait_loop_reports_unreachable_ilo(self):
+        ilo = self.create_ilo(DEPLOYMENT_POST_STATES)
+        wait_loop = AsyncWaitLoop(FAST_POLLING)
+        self.addCleanup(wait_loop.close)
+        outcomes = []
+        self.assertFalse(wait_loop.submit(get_server(ilo, password="wrong"), callback=outcomes.append).result(10))
+        self.assertEqual(outcomes, [False])
+
+    def test_close_cancels_waits_in_progress(self):
+        # The server never completes POST, the wait is cancelled by close
+        ilo = self.create_ilo(["InPost"])
+        wait_loop = AsyncWaitLoop(FAST_POLLING)
+        outcomes = []
+        future = wait_loop.submit(get_server(ilo), get_polling_policies(FAST_POLLING), outcomes.append)
+        self.assertTrue(ilo.wait_for_logins(1))
+        self.assertTrue(wait_loop.is_running())
+        wait_loop.close()
+        self.assertFalse(wait_loop.is_running())
+        self.assertTrue(future.cancelled())
+        self.assertEqual(outcomes, [False])
+
+    def test_callback_error_does_not_stop_loop(self):
+        ilo = self.create_ilo(DEPLOYMENT_POST_STATES)
+        wait_loop = AsyncWaitLoop(FAST_POLLING)
+        self.addCleanup(wait_loop.close)
+
+        def callback(is_complete):
+            raise RuntimeError("install pool shut down")
+
+        self.assertFalse(wait_loop.submit(get_server(ilo, password="wrong"), callback=callback).result(10))
+        outcomes = []
+        self.assertFalse(wait_loop.submit(get_server(ilo, password="wrong"), callback=outcomes.append).result(10))
+        self.assertEqual(outcomes, [False])
+
+    def test_login_again_when_session_expired(self):
+        ilo = self.create_ilo(["FinishedPost", "InPost"])
+
+        async def wait():
+            async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(ssl=False)) as http_session:
+                redfish_obj = await create_async_redfish_object(get_server(ilo), http_session)
+                self.assertTrue(redfish_obj)
+                self.assertEqual(await get_post_state(redfish_obj), "FinishedPost")
+                ilo.expire_sessions()
+                polling_policy = get_polling_policies(FAST_POLLING)["install"]
+                try:
+                    return await wait_for_reboot(redfish_obj, 1, polling_policy)
+                finally:
+                    await redfish_obj.logout()
+
+        self.assertTrue(asyncio.run(wait()))
+        self.assertEqual(ilo.logins, 2)
+        self.assertIn(("POST", SESSIONS_URI), ilo.requests)
+
+
+if __name__ == "__main__":
+    unittest.main()
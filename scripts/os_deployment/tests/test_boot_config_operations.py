@@ -0,0 +1,97 @@
+# (C) Copyright 2021 Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from boot_config_operations import *
+
+RHEL8_EFI_GRUB = """set default="1"
+
+function load_video {
+  insmod all_video
+}
+
+set timeout=60
+### BEGIN /etc/grub.d/10_linux ###
+menuentry 'Install Red Hat Enterprise Linux 8.4' --class fedora --class gnu-linux --class gnu --class os {
+	linuxefi /images/pxeboot/vmlinuz inst.stage2=hd:LABEL=RHEL-8-4-0-BaseOS-x86_64 quiet
+	initrdefi /images/pxeboot/initrd.img
+}
+menuentry 'Test this media & install Red Hat Enterprise Linux 8.4' --class fedora --class gnu-linux --class gnu --class os {
+	linuxefi /images/pxeboot/vmlinuz inst.stage2=hd:LABEL=RHEL-8-4-0-BaseOS-x86_64 rd.live.check quiet
+	initrdefi /images/pxeboot/initrd.img
+}
+submenu 'Troubleshooting -->' {
+	menuentry 'Install Red Hat Enterprise Linux 8.4 in basic graphics mode' --class fedora --class gnu-linux --class gnu --class os {
+		linuxefi /images/pxeboot/vmlinuz inst.stage2=hd:LABEL=RHEL-8-4-0-BaseOS-x86_64 nomodeset quiet
+		initrdefi /images/pxeboot/initrd.img
+	}
+	menuentry 'Rescue a Red Hat Enterprise Linux system' --class fedora --class gnu-linux --class gnu --class os {
+		linuxefi /images/pxeboot/vmlinuz inst.stage2=hd:LABEL=RHEL-8-4-0-BaseOS-x86_64 inst.rescue quiet
+		initrdefi /images/pxeboot/initrd.img
+	}
+}
+"""
+
+
+class BootConfigTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.file_path = os.path.join(self.temp_path, "grub.cfg")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def rewrite(self, data, os_type, config_name, variables):
+        with open(self.file_path, "w") as file_write:
+            file_write.write(data)
+        captured = rewrite_boot_config(self.file_path, os_type, config_name, variables)
+        with open(self.file_path, "r") as file_read:
+            return file_read.read(), captured
+
+    def test_rhel8_efi_grub(self):
+        data, captured = self.rewrite(RHEL8_EFI_GRUB, "rhel8", "efi_grub", {"ks_boot_option": "inst.ks=cdrom:/ks.cfg"})
+        self.assertEqual(captured["redhat_label"], "RHEL-8-4-0-BaseOS-x86_64")
+        lines = data.splitlines()
+        self.assertEqual(lines[0], 'set default="0"')
+        self.assertIn("set timeout=6", lines)
+        # Only the kernel lines of the install entries get the kickstart option, not the media check and rescue ones
+        self.assertEqual(data.count("inst.ks=cdrom:/ks.cfg"), 2)
+        self.assertIn("inst.stage2=hd:LABEL=RHEL-8-4-0-BaseOS-x86_64 inst.ks=cdrom:/ks.cfg quiet", lines[9])
+        self.assertIn("inst.stage2=hd:LABEL=RHEL-8-4-0-BaseOS-x86_64 inst.ks=cdrom:/ks.cfg nomodeset quiet", lines[18])
+        # The other lines are kept
+        self.assertEqual(data.replace('set default="0"', 'set default="1"').replace("timeout=6\n", "timeout=60\n")
+                         .replace(" inst.ks=cdrom:/ks.cfg", ""), RHEL8_EFI_GRUB)
+
+    def test_default_rule_anchored(self):
+        grub = 'set default="1"\n# default entry 1 of 10\nset default_kernel_opts="quiet 1"\nset timeout=600\n'
+        data, _ = self.rewrite(grub, "centos8", "efi_grub", {"ks_boot_option": "inst.ks=cdrom:/ks.cfg"})
+        self.assertEqual(data, 'set default="0"\n# default entry 1 of 10\nset default_kernel_opts="quiet 1"\nset timeout=600\n')
+
+
+if __name__ == "__main__":
+    unittest.main()
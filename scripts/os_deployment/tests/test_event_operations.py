@@ -0,0 +1,131 @@
+# (C) Copyright 2021 Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+import urllib3
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import event_operations
+from event_operations import *
+from fake_ilo import FakeIlo, FakeRedfishObject, create_certificate
+
+urllib3.disable_warnings()
+
+
+def get_free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def set_state_later(ilo, post_state, delay=0.2):
+    thread = threading.Timer(delay, ilo.set_state, args=(post_state,))
+    thread.start()
+    return thread
+
+
+class ServerEventsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.ilo = None
+        self.server_events = None
+        event_operations.EVENT_LISTENER = None
+
+    def tearDown(self):
+        if self.server_events is not None:
+            self.server_events.stop()
+        if self.ilo is not None:
+            self.ilo.close()
+        if event_operations.EVENT_LISTENER is not None:
+            event_operations.EVENT_LISTENER.httpd.shutdown()
+            event_operations.EVENT_LISTENER.httpd.server_close()
+            event_operations.EVENT_LISTENER = None
+
+    def start(self, config=None, **kwargs):
+        self.ilo = FakeIlo(**kwargs)
+        self.server_events = start_server_events(FakeRedfishObject(self.ilo), "SN0001", config or {})
+        return self.server_events
+
+    def assert_event_received(self, server_events):
+        start = time.time()
+        set_state_later(self.ilo, "InPostDiscoveryComplete").join()
+        self.assertTrue(server_events.wait_for_event(10))
+        self.assertLess(time.time() - start, 5)
+
+    def test_server_sent_events(self):
+        server_events = self.start()
+        self.assertTrue(server_events.active)
+        self.assertTrue(self.ilo.wait_for_streams())
+        self.assert_event_received(server_events)
+        # Only the events received after the previous wait wake up the next one
+        self.assertFalse(server_events.wait_for_event(0.2))
+        self.assert_event_received(server_events)
+
+    def test_stream_lost_falls_back_to_polling(self):
+        server_events = self.start()
+        self.assertTrue(self.ilo.wait_for_streams())
+        self.ilo.close_streams()
+        self.assertTrue(server_events.wait_for_event(10))
+        for _ in range(50):
+            if not server_events.active:
+                break
+            time.sleep(0.1)
+        self.assertFalse(server_events.active)
+
+    def test_event_service_disabled(self):
+        server_events = self.start(event_service_enabled=False)
+        self.assertFalse(server_events.active)
+        self.assertFalse(server_events.wait_for_event(0.1))
+
+    def test_no_event_source(self):
+        server_events = self.start(server_sent_events=False)
+        self.assertFalse(server_events.active)
+
+    @unittest.skipUnless(shutil.which("openssl"), "openssl is needed to create the listener certificate")
+    def test_push_events_over_https(self):
+        temp_path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, temp_path)
+        certificate_path = create_certificate(temp_path)
+
+        config = {
+            "Event_listener_url": "https://127.0.0.1:{}/events".format(get_free_port()),
+            "Event_listener_certificate": certificate_path
+        }
+        server_events = self.start(config, server_sent_events=False)
+        self.assertTrue(server_events.active)
+        self.assertEqual(list(self.ilo.subscriptions.values())[0]["Context"], "SN0001")
+        self.assert_event_received(server_events)
+
+        server_events.stop()
+        self.server_events = None
+        self.assertEqual(self.ilo.subscriptions, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
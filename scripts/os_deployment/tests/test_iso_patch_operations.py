@@ -0,0 +1,226 @@
+# (C) Copyright 2021 Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import io
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import unittest
+import zlib
+
+import pycdlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from iso_patch_operations import *
+
+
+def add_file(iso, name, data, directory=""):
+    iso_directory = "/" + directory.upper() + "/" if directory else "/"
+    iso.add_fp(io.BytesIO(data), len(data), iso_directory + get_iso9660_identifier(name).decode("ascii"),
+               rr_name=name, joliet_path="/" + (directory + "/" if directory else "") + name)
+
+
+def create_base_iso(iso_path, udf=False, app_use=""):
+    """Writes a small RHEL like image: Rock Ridge and Joliet hierarchies, an isolinux folder and an El Torito boot image"""
+    iso = pycdlib.PyCdlib()
+    iso.new(interchange_level=3, rock_ridge="1.09", joliet=3, app_use=app_use, udf="2.60" if udf else None)
+    iso.add_directory("/ISOLINUX", rr_name="isolinux", joliet_path="/isolinux")
+    add_file(iso, "isolinux.bin", b"\xfa" * 4096, "isolinux")
+    add_file(iso, "isolinux.cfg", b"default linux\nlabel linux\n  append initrd=initrd.img\n", "isolinux")
+    add_file(iso, "readme.txt", b"base image\n")
+    iso.add_eltorito("/ISOLINUX/ISOLINUX.BIN;1", "/ISOLINUX/BOOT.CAT;1", rr_bootcatname="boot.cat",
+                     joliet_bootcatfile="/isolinux/boot.cat", boot_load_size=4)
+    iso.write(iso_path)
+    iso.close()
+
+
+def get_gpt_entry(type_byte, first_lba, last_lba, name):
+    return b"\x01" * 16 + bytes([type_byte]) * 16 + struct.pack("<QQQ", first_lba, last_lba, 0) + name.encode("utf-16-le").ljust(72, b"\x00")
+
+
+def add_hybrid_partition_tables(iso_path):
+    """Adds a protective MBR and a GPT to an image, like isohybrid --uefi does: the ISO partition covers the image up
+    to the backup GPT and the EFI partition holds the EFI boot image"""
+    with open(iso_path, "r+b") as iso_file:
+        iso_file.seek(0, os.SEEK_END)
+        # isohybrid pads the image so that the backup GPT fits in the last sectors
+        iso_file.write(b"\x00" * 32768)
+        sectors = iso_file.tell() // PARTITION_SECTOR_SIZE
+        entries = get_gpt_entry(0xaf, 0, sectors - 34, "ISO9660") + get_gpt_entry(0xef, 64, 127, "EFI")
+        entries = entries.ljust(128 * 128, b"\x00")
+        header = GPT_SIGNATURE + struct.pack("<IIII", 0x10000, 92, 0, 0) + struct.pack("<QQQQ", 1, sectors - 1, 34, sectors - 34) + \
+                 b"\x02" * 16 + struct.pack("<QII", 2, 128, 128) + struct.pack("<I", zlib.crc32(entries) & 0xffffffff)
+        mbr_partition = struct.pack("<B3sB3sII", 0, b"\x00\x02\x00", MBR_PROTECTIVE_TYPE, b"\xff\xff\xff", 1, sectors - 1)
+        iso_file.seek(MBR_PARTITION_TABLE_OFFSET)
+        iso_file.write(mbr_partition + b"\x00" * 48 + b"\x55\xaa")
+        iso_file.write(set_gpt_header_crc(header))
+        iso_file.seek(2 * PARTITION_SECTOR_SIZE)
+        iso_file.write(entries)
+        backup = header[:24] + struct.pack("<QQ", sectors - 1, 1) + header[40:72] + struct.pack("<Q", sectors - 33) + header[80:]
+        iso_file.seek((sectors - 33) * PARTITION_SECTOR_SIZE)
+        iso_file.write(entries + set_gpt_header_crc(backup))
+
+
+def read_iso_file(image_path, **kwargs):
+    iso = pycdlib.PyCdlib()
+    iso.open(image_path)
+    try:
+        output = io.BytesIO()
+        iso.get_file_from_iso_fp(output, **kwargs)
+        return output.getvalue()
+    finally:
+        iso.close()
+
+
+def read_gpt_header(iso_file, lba):
+    iso_file.seek(lba * PARTITION_SECTOR_SIZE)
+    header = iso_file.read(92)
+    return header, get_gpt_header_crc(header) == struct.unpack("<I", header[16:20])[0]
+
+
+def read_gpt_entries(iso_file, header):
+    """Returns the first and last LBA of the partitions of a GPT, and whether the entries match their CRC"""
+    iso_file.seek(struct.unpack("<Q", header[72:80])[0] * PARTITION_SECTOR_SIZE)
+    entries = iso_file.read(128 * 128)
+    ranges = [struct.unpack("<QQ", entries[offset + 32:offset + 48]) for offset in range(0, len(entries), 128) if any(entries[offset:offset + 16])]
+    return ranges, zlib.crc32(entries) & 0xffffffff == struct.unpack("<I", header[88:92])[0]
+
+
+class IsoPatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.base_iso = os.path.join(self.temp_path, "base.iso")
+        self.custom_iso = os.path.join(self.temp_path, "custom.iso")
+        self.tree = os.path.join(self.temp_path, "tree")
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def write_tree_file(self, iso_path, data):
+        file_path = os.path.join(self.tree, iso_path)
+        create_dir_exist(os.path.dirname(file_path))
+        with open(file_path, "wb") as file_write:
+            file_write.write(data)
+
+    def patch(self):
+        self.assertTrue(patch_custom_iso_image(self.base_iso, self.tree, self.custom_iso))
+
+    def assert_file(self, name, data, directory=""):
+        """Checks a file through the three hierarchies of the patched image, read back by pycdlib"""
+        joliet_path = "/" + (directory + "/" if directory else "") + name
+        iso_path = ("/" + directory.upper() if directory else "") + "/" + get_iso9660_identifier(name).decode("ascii")
+        self.assertEqual(read_iso_file(self.custom_iso, iso_path=iso_path), data)
+        self.assertEqual(read_iso_file(self.custom_iso, rr_path=joliet_path), data)
+        self.assertEqual(read_iso_file(self.custom_iso, joliet_path=joliet_path), data)
+
+    def test_replace_file_larger_than_its_extent(self):
+        create_base_iso(self.base_iso)
+        config = b"default ks\nlabel ks\n  append initrd=initrd.img inst.ks=cdrom:/ks.cfg\n" * 100
+        self.write_tree_file("isolinux/isolinux.cfg", config)
+        self.patch()
+        self.assert_file("isolinux.cfg", config, "isolinux")
+        self.assert_file("readme.txt", b"base image\n")
+        with open(self.custom_iso, "rb") as iso_file:
+            self.assertEqual(IsoImage(iso_file).read_file("isolinux/isolinux.cfg"), config)
+
+    def test_add_new_file(self):
+        create_base_iso(self.base_iso)
+        self.write_tree_file("ks.cfg", b"install\nreboot\n")
+        self.patch()
+        self.assert_file("ks.cfg", b"install\nreboot\n")
+
+    def test_relocate_full_directory(self):
+        create_base_iso(self.base_iso)
+        files = dict(("kickstart_{:03d}.cfg".format(index), "server {}\n".format(index).encode("ascii")) for index in range(60))
+        for name, data in files.items():
+            self.write_tree_file("isolinux/" + name, data)
+        self.patch()
+        for name, data in files.items():
+            self.assert_file(name, data, "isolinux")
+        self.assert_file("isolinux.cfg", b"default linux\nlabel linux\n  append initrd=initrd.img\n", "isolinux")
+
+    def test_boot_catalog_kept(self):
+        create_base_iso(self.base_iso)
+        self.write_tree_file("isolinux/isolinux.cfg", b"default ks\n")
+        self.patch()
+        catalog = read_iso_file(self.base_iso, iso_path="/ISOLINUX/BOOT.CAT;1")
+        self.assertEqual(read_iso_file(self.custom_iso, iso_path="/ISOLINUX/BOOT.CAT;1"), catalog)
+        self.assertEqual(read_iso_file(self.custom_iso, iso_path="/ISOLINUX/ISOLINUX.BIN;1"), b"\xfa" * 4096)
+
+    def test_unchanged_image_is_not_grown(self):
+        create_base_iso(self.base_iso)
+        add_hybrid_partition_tables(self.base_iso)
+        self.write_tree_file("readme.txt", b"base image\n")
+        self.patch()
+        self.assertEqual(os.path.getsize(self.custom_iso), os.path.getsize(self.base_iso))
+
+    def test_backup_gpt_moved_to_new_end(self):
+        create_base_iso(self.base_iso)
+        add_hybrid_partition_tables(self.base_iso)
+        self.write_tree_file("ks.cfg", b"install\n" * 2000)
+        self.patch()
+        self.assert_file("ks.cfg", b"install\n" * 2000)
+
+        size = os.path.getsize(self.custom_iso)
+        self.assertGreater(size, os.path.getsize(self.base_iso))
+        self.assertEqual(size % SECTOR_SIZE, 0)
+        last_lba = size // PARTITION_SECTOR_SIZE - 1
+        with open(self.custom_iso, "rb") as iso_file:
+            primary, primary_valid = read_gpt_header(iso_file, 1)
+            backup, backup_valid = read_gpt_header(iso_file, last_lba)
+            self.assertTrue(primary_valid and backup_valid)
+            self.assertEqual(backup[:8], GPT_SIGNATURE)
+            self.assertEqual(struct.unpack("<QQ", primary[24:40]), (1, last_lba))
+            self.assertEqual(struct.unpack("<QQ", backup[24:40]), (last_lba, 1))
+            self.assertEqual(struct.unpack("<Q", primary[48:56])[0], last_lba - 33)
+            self.assertEqual(struct.unpack("<Q", backup[72:80])[0], last_lba - 32)
+            # The ISO partition is extended up to the new last usable LBA in both copies, the EFI partition is kept
+            for header in [primary, backup]:
+                self.assertEqual(read_gpt_entries(iso_file, header), ([(0, last_lba - 33), (64, 127)], True))
+            iso_file.seek(MBR_PARTITION_TABLE_OFFSET + 12)
+            self.assertEqual(struct.unpack("<I", iso_file.read(4))[0], last_lba)
+
+        # The patched image can be patched again
+        shutil.move(self.custom_iso, self.base_iso)
+        shutil.rmtree(self.tree)
+        self.write_tree_file("ks.cfg", b"reboot\n")
+        self.patch()
+        self.assert_file("ks.cfg", b"reboot\n")
+
+    def test_media_checksum_cleared(self):
+        create_base_iso(self.base_iso, app_use="ISO MD5SUM = 0123456789abcdef;SKIPSECTORS = 15;RHLISOSTATUS=1;")
+        self.write_tree_file("ks.cfg", b"install\n")
+        self.patch()
+        with open(self.custom_iso, "rb") as iso_file:
+            iso_file.seek(VOLUME_DESCRIPTOR_START * SECTOR_SIZE + APPLICATION_USE_OFFSET)
+            self.assertEqual(iso_file.read(APPLICATION_USE_LENGTH), b" " * APPLICATION_USE_LENGTH)
+
+    def test_udf_bridge_refused(self):
+        create_base_iso(self.base_iso, udf=True)
+        self.assertFalse(can_patch_iso_image(self.base_iso))
+        self.assertEqual(get_iso_build_mode(self.base_iso, {}), "rebuild")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+# (C) Copyright 2021 Hewlett Packard Enterprise Development LP
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+# THE SOFTWARE.
+
+import fcntl
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lifecycle_operations import *
+
+
+class StaleExtractionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_path = tempfile.mkdtemp()
+        self.http_file_path = os.path.join(self.temp_path, "http")
+        self.cache_path = os.path.join(self.temp_path, "cache")
+        os.makedirs(os.path.join(self.http_file_path, "rhel"))
+        os.makedirs(self.cache_path)
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_path)
+
+    def add_image(self, name):
+        iso_filepath = os.path.join(self.http_file_path, name)
+        with open(iso_filepath, "wb") as iso_file:
+            iso_file.write(b"\x00" * 2048)
+        return iso_filepath
+
+    def add_extraction(self, key):
+        os.makedirs(os.path.join(self.cache_path, key, "isolinux"))
+        open(os.path.join(self.cache_path, key + ".lock"), "w").close()
+        return os.path.join(self.cache_path, key)
+
+    def test_served_extractions_kept(self):
+        served = [self.add_extraction(get_iso_cache_key(self.add_image(name))) for name in ["rhel8.iso", "rhel/rhel7.iso"]]
+        removed = self.add_extraction("0" * 40)
+        # The other entries of the cache are not extractions
+        open(os.path.join(self.cache_path, "rhel8_shared.key"), "w").close()
+        os.makedirs(os.path.join(self.cache_path, "1" * 40 + ".partial"))
+
+        self.assertEqual(reclaim_stale_extractions(self.cache_path, self.http_file_path), 1)
+        self.assertFalse(os.path.exists(removed))
+        self.assertFalse(os.path.exists(removed + ".lock"))
+        for path in served:
+            self.assertTrue(os.path.isdir(path))
+        self.assertEqual(sorted(os.listdir(self.cache_path)),
+                         sorted([os.path.basename(path) for path in served] + [os.path.basename(path) + ".lock" for path in served] +
+                                ["rhel8_shared.key", "1" * 40 + ".partial"]))
+
+    def test_only_base_images_keyed(self):
+        base_image = self.add_image("rhel/rhel8.iso")
+        self.add_image("readme.txt")
+        os.makedirs(os.path.join(self.http_file_path, "artifacts"))
+        os.makedirs(os.path.join(self.http_file_path, "kickstarts"))
+        self.add_image("artifacts/0123.iso")
+        self.add_image("kickstarts/SN0001.cfg")
+        self.assertEqual(get_base_image_keys(self.http_file_path), {get_iso_cache_key(base_image)})
+
+    def test_replaced_image_extraction_deleted(self):
+        iso_filepath = self.add_image("rhel8.iso")
+        old_extraction = self.add_extraction(get_iso_cache_key(iso_filepath))
+        os.utime(iso_filepath, (0, 0))
+        self.assertEqual(reclaim_stale_extractions(self.cache_path, self.http_file_path), 1)
+        self.assertFalse(os.path.exists(old_extraction))
+
+    def test_extraction_in_progress_kept(self):
+        extraction = self.add_extraction("0" * 40)
+        with open(extraction + ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            self.assertEqual(reclaim_stale_extractions(self.cache_path, self.http_file_path), 0)
+        self.assertTrue(os.path.isdir(extraction))
+
+
+if __name__ == "__main__":
+    unittest.main()
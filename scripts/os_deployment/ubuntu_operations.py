@@ -32,31 +32,14 @@ from datetime import timedelta
 
 from ilo_operations import *
 from image_operations import *
+from template_operations import *
+from boot_config_operations import *
+from iso_patch_operations import *
 
 import pdb
 
-def run_cmd_on_shell(cmd):
-    """
-    This function executes command on command prompt.
-    It will provide stdout, std err.
-    Return: It will return stdout and stderr of input cmd command for this function.
-    """
-
-    try:
-        # print("cwd: {0}".format(os.getcwd()))
-        # This will form executing command based on stdout and stderr & will execute on shell
-        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, shell=True)
-
-        # This will execute the command/script on shell
-        out, err = p.communicate()
-
-        # Converting "bytes" type to "str" type
-        out1, err1 = str(out,'utf-8'), str(err, 'utf-8')
-    except Exception as run_except:
-        print("The exception '{}' occurred during execution of the command '{}'".format(run_except, cmd))
-
-    return out1, err1
-
+# Files of the Ubuntu ISO image which are read or modified for each server, mkisofs rewrites the boot info table of isolinux.bin
+UBUNTU_BOOT_FILES = ["boot/grub/grub.cfg", "isolinux/txt.cfg", "isolinux/isolinux.bin", "preseed/ubuntu-server.seed"]
 
 def create_custom_iso_image_ubuntu(os_type, server, config, kickstart_file):
     """This is the primary function is to create a custom Red Hat Enterprise Linux ISO image for each of the server. 
@@ -86,7 +69,7 @@ def create_custom_iso_image_ubuntu(os_type, server, config, kickstart_file):
 
     print("Creating modified installation file for RHEL Installation")
     image_url = config["HTTP_server_base_url"] + ubuntu_iso_filename
-    file_presence = is_iso_file_present(image_url)
+    file_presence = is_iso_file_present(image_url, config)
     if not file_presence:
         print("ISO file is not present in the given http location. Please check the http location and then try again.")
         return False
@@ -99,67 +82,47 @@ def create_custom_iso_image_ubuntu(os_type, server, config, kickstart_file):
             filepath = base_iso_image_path + ubuntu_iso_filename
             server_serial_number = server["Server_serial_number"]
 
-            temppath = "/tmp/" + "redhatmount_" + server_serial_number + "/"
-            mount_path = "/tmp/" + "redhatorig_" + server_serial_number
-
-            create_dir_exist(temppath)
+            temppath = create_build_temp_path(config, "redhatmount_" + server_serial_number + "_")
 
             kickstart_filepath = temppath + "/preseed/ks-ubuntu.cfg"
 
-            mount_proc_id = mount_iso_image(filepath, mount_path)
-            if mount_proc_id == 0:
-                print("Successfully mounted the image {}".format(ubuntu_iso_filename))
-                #run_cmd_on_shell("rm -f")
-            else:
-                print("Attempting to unmount the previously mounted image")
-                umount_id = unmount_iso_image(mount_path)
-                mount_proc_id = mount_iso_image(filepath, mount_path)
-                if mount_proc_id == 0:
-                    print("Successfully unmounted the previously mounted image")
-                    # Removing recursive ubuntu directory
-                    #run_cmd_on_shell("rm -f {}/ubuntu".format(mount_path))
-                else:
-                    print("Failed to mount the image {}".format(ubuntu_iso_filename))
-                    return False
-
-            # Create dot files
-            run_cmd_on_shell("shopt -s dotglob")
-
-            #copy_iso_contents(mount_path, temppath)
-            run_cmd_on_shell("cp -avRf {}/* {}".format(mount_path, temppath))
-            run_cmd_on_shell("cp -avRf {}/.disk {}".format(mount_path, temppath))
+            # The shared extraction includes the dot files such as .disk
+            build_mode = get_iso_build_mode(filepath, config)
+            if not prepare_iso_tree_for_build(filepath, temppath, UBUNTU_BOOT_FILES, config, build_mode):
+                print("Failed to prepare the contents of the image {}".format(ubuntu_iso_filename))
+                delete_temp_folder(temppath)
+                return False
 
             # Confirm the LABEL of the DVD iso
-            run_cmd_on_shell("blkid {}".format(filepath))
+            run_command(["blkid", filepath])
 
             kickstart_status  = create_kickstart_file_for_ubuntu(kickstart_filepath, kickstart_file, server)
             
             if(kickstart_status and os.path.isfile(kickstart_filepath)):
                 redhat_label = update_grub_file_for_efi_boot(temppath, os_type)
-                run_cmd_on_shell("cp {}/preseed/ubuntu-server.seed {}/preseed/ubuntu-custom.seed".format(temppath, temppath))
+                shutil.copyfile(temppath + "preseed/ubuntu-server.seed", temppath + "preseed/ubuntu-custom.seed")
                 configure_isolinux_file_to_ubuntu(temppath, os_type)
                 update_ubuntu_seed_file(temppath)
                 
                 destination_filename = get_custom_image_name(os_type, server_serial_number) 
 
-                out, err = rebuild_iso_redhat_image(temppath, destination_folder, destination_filename, redhat_label, os_type)
-                if out == '':
+                if build_mode == "patch":
+                    iso_created = patch_custom_iso_image(filepath, temppath, destination_folder + destination_filename)
+                else:
+                    recreate_iso_proc_id = rebuild_iso_redhat_image(temppath, destination_folder, destination_filename, redhat_label, os_type)
+                    iso_created = recreate_iso_proc_id is not None and recreate_iso_proc_id.returncode == 0
+                if iso_created:
                     print("Successfully re-created the iso image for server {} after modifying the content".format(server_serial_number))
                     status = True
                 else:
                     print("Error in recreating the iso image for server {} after modifying the content".format(server_serial_number))
                     status = False
-                                
-                umount_proc_id = unmount_iso_image(mount_path)
-                if umount_proc_id == 0:
-                    print("Successfully unmounted the iso image")
-                else:
-                    print("Error in umounting the iso image")                
 
                 delete_temp_folder(temppath)
                 return status
             else:
                 print("Error in fetching custom kickstart file {}".format(kickstart_file))
+                delete_temp_folder(temppath)
                 return status
         else:
             print("Not supporting installing '{}' OS".format(os_type))
@@ -179,35 +142,7 @@ def create_kickstart_file_for_ubuntu(kickstart_filepath, kickstart_file, server_
         server_data {dictionary} -- Custom configurations for a particular server as per the input_files/server_details.json
     """
     try:
-        ks_text = ""
-        run_cmd_on_shell("cp {} {}".format(kickstart_file, kickstart_filepath))
-        with open(kickstart_filepath, 'r') as fp:
-            for line in fp.readlines():
-                if "Host_IP" in line:
-                    line = line.replace("Host_IP", server_data["Host_IP"]) 
-                    line = line.replace("Host_DNS", server_data["Host_DNS"])
-                    line = line.replace("Host_Gateway", server_data["Host_Gateway"])
-                    line = line.replace("Host_Netmask", server_data["Host_Netmask"])
-                    line = line.replace("Bonding_Interface1", server_data["Bonding_Interface1"])
-                    line = line.replace("Bonding_Interface2", server_data["Bonding_Interface2"])
-                elif "Host_Username" in line:
-                    line = line.replace("Host_Username", server_data["Host_Username"]) 
-                    line = line.replace("Host_Password", server_data["Host_Password"])
-                elif "Host_Password" in line:
-                    line = line.replace("Host_Password", server_data["Host_Password"])
-                elif "Hostname" in line:
-                    line = line.replace("Hostname", server_data["Hostname"])
-                else:
-                    pass
-
-                # Gathering modifying kickstart file information
-                ks_text += line
-
-
-        # Update kickstart file with user input values
-        with open(kickstart_filepath, 'w') as fp:
-            fp.write(ks_text)
-
+        render_template_file(kickstart_file, kickstart_filepath, server_data, syntax="token")
         print("Successfully created kickstart file for server {} ".format(server_data["Server_serial_number"]) )
         return True
     except IOError as ioer:
@@ -218,26 +153,8 @@ def create_kickstart_file_for_ubuntu(kickstart_filepath, kickstart_file, server_
         return False
 
 def update_grub_file_for_efi_boot(efi_file_path, os_type):
-    #pdb.set_trace()
-    efi_cfg_text = ""
-    flag = False
-    #efi_grub_file = efi_file_path + "EFI/BOOT/grub.cfg"
     efi_grub_file = efi_file_path + "boot/grub/grub.cfg"
-
-    with open(efi_grub_file, 'r') as fp:
-        search_str = "quiet"
-        add_ks_str = search_str + " ks=cdrom:/preseed/ks-ubuntu.cfg"
-        for line in fp.readlines():
-            if (search_str in line):
-                line = line.replace(search_str, add_ks_str)
-
-            if ("timeout") in line:
-                line = line.replace("30", "6")
-
-            efi_cfg_text += line
-
-    with open(efi_grub_file, 'w') as fp:
-        fp.write(efi_cfg_text)
+    rewrite_boot_config(efi_grub_file, "ubuntu", "efi_grub")
 
 
 def update_ubuntu_seed_file(new_path):
@@ -248,26 +165,8 @@ def update_ubuntu_seed_file(new_path):
 
 
 def configure_isolinux_file_to_ubuntu(new_path, os_type):
-    #pdb.set_trace()
-    iso_cfg_text = ""
-    append_cnt = 0
     iso_conf_file = new_path + "/isolinux/txt.cfg"
-    with open(iso_conf_file, 'r') as fp:
-        for line in fp.readlines():
-            if ("append" in line):
-                append_cnt += 1
-
-            if (append_cnt == 1):
-                line += "\n" + "label myownoption" + "\n"
-                line += "  menu label ^Install Custom Ubuntu Server" + "\n"
-                line += "  kernel /install/vmlinuz" + "\n"
-                line += "  append  file=/cdrom/preseed/ubuntu-custom.seed initrd=/install/initrd.gz quiet ks=cdrom:/preseed/ks-ubuntu.cfg --" + "\n"
-                append_cnt += 1
-
-            iso_cfg_text += line
-
-    with open(iso_conf_file, 'w') as fp:
-        fp.write(iso_cfg_text)
+    rewrite_boot_config(iso_conf_file, "ubuntu", "isolinux")
 
 
 
@@ -344,36 +243,19 @@ def rebuild_iso_redhat_image(temppath, custom_iso_path, iso_filename, redhat_lab
         temppath {string}           -- Path to the custom ISO image contents which needs to rebuilt
         custom_iso_path {string}    -- Path to store the resultant ISO image
         iso_filename {string}       -- Name for the resultant ISO image
+
+    Returns:
+        object -- completed isohybrid process, returns None on failure
     """
     try:
-        #pdb.set_trace()
-
         create_dir_exist(custom_iso_path)
 
         custom_iso = custom_iso_path + iso_filename
-
-        os.chdir(temppath)
-        #run_cmd_on_shell("mkisofs -o {} -b isolinux/isolinux.bin -J -R -l -c isolinux/boot.cat -no-emul-boot -boot-load-size 4 -boot-info-table -eltorito-alt-boot -e images/efiboot.img -no-emul-boot -graft-points -V {} . ".format(custom_iso, custom_iso_verbose))
-        #custom_iso_creation_cmd = "mkisofs -o {} -b isolinux/isolinux.bin -J -R -l -c isolinux/boot.cat -no-emul-boot -boot-load-size 4 -boot-info-table -eltorito-alt-boot -e images/efiboot.img -no-emul-boot -graft-points -V {} . ".format(custom_iso, custom_iso_verbose)
-        custom_iso_creation_cmd = " mkisofs -o {} -b isolinux/isolinux.bin -J -R -l -c isolinux/boot.cat -no-emul-boot -boot-load-size 4 -boot-info-table -eltorito-alt-boot -e boot/grub/efi.img -no-emul-boot -graft-points .".format(custom_iso)
-
-        run_cmd_on_shell(custom_iso_creation_cmd)
+        execute_linux_command(get_mkisofs_args(temppath, custom_iso, "boot/grub/efi.img"))
 
         # Configure proper EFI boot
-        out, err = run_cmd_on_shell("isohybrid --uefi {}".format(custom_iso))
-
-        return out, err
-        '''
-        args = ["mkisofs", "-o", custom_iso, "-b", "isolinux/isolinux.bin", "-J" , "-R", "-l", "-c", "isolinux/boot.cat", "-no-emul-boot", "-boot-load-size", "4",
-                "-boot-info-table", "-eltorito-alt-boot", "-e", "images/efiboot.img", "-no-emul-boot","-graft-points", "-V" , redhat_label , temppath]
-        execute_linux_command(args)
-        args = ["isohybrid","--uefi",custom_iso]
-        proc = execute_linux_command(args)
-        args = ["implantisomd5", custom_iso]
-        proc = execute_linux_command(args)
-        return proc
-        '''
+        return execute_linux_command(["isohybrid", "--uefi", custom_iso])
     except CalledProcessError as subprcer:
-        print("Subprocess error occurred while rebuilding custom iso image {}".format(subprcer))
+        print("Subprocess error occurred while rebuilding custom iso image {} {}".format(subprcer, subprcer.stderr))
     except Exception as er:
         print("Error while rebuilding custom iso image {}".format(er))